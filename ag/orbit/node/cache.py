@@ -0,0 +1,124 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from . import config
+
+from os import path, makedirs
+from threading import Lock
+import sqlite3
+import mmap
+import zlib
+
+
+class BlockCache():
+
+    # an append-only store of zlib-compressed serialized blocks, indexed by height and hash in a small
+    #   sqlite database alongside; reads go through a memory map so replaying blocks never touches the network
+
+    DIR = 'blocks'
+    DATA = 'blocks.dat'
+    INDEX = 'index.db'
+
+    LEVEL = 6
+
+    @classmethod
+    def exists(self):
+        return path.exists(path.join(config.dir, self.DIR, self.INDEX))
+
+    def __init__(self):
+        base = path.join(config.dir, self.DIR)
+        makedirs(base, exist_ok=True)
+
+        self.lock = Lock()
+
+        self.index = sqlite3.connect(path.join(base, self.INDEX), check_same_thread=False)
+        self.index.execute('''CREATE TABLE IF NOT EXISTS block (
+                                  hash TEXT NOT NULL PRIMARY KEY,
+                                  height INTEGER NOT NULL,
+                                  offset INTEGER NOT NULL,
+                                  size INTEGER NOT NULL
+                              )''')
+        self.index.execute('''CREATE INDEX IF NOT EXISTS idx_block_height ON block (height)''')
+
+        self.data = open(path.join(base, self.DATA), 'a+b')
+        self.end = self.data.seek(0, 2)
+
+        # anything indexed past the end of the data was lost in a crash before it was synced to disk
+        self.index.execute('''DELETE FROM block WHERE offset + size > ?''', (self.end,))
+        self.index.commit()
+
+        self.map = None
+
+    def close(self):
+        with self.lock:
+            if self.map:
+                self.map.close()
+                self.map = None
+
+            self.data.close()
+            self.index.close()
+
+    def range(self):
+        with self.lock:
+            return self.index.execute('''SELECT MIN(height), MAX(height), COUNT(*) FROM block''').fetchone()
+
+    def size(self):
+        return self.end
+
+    def has(self, blockhash):
+        with self.lock:
+            return self.index.execute('''SELECT 1 FROM block WHERE hash = ?''', (blockhash,)).fetchone() is not None
+
+    def get_hash(self, height):
+        with self.lock:
+            row = self.index.execute('''SELECT hash FROM block WHERE height = ?''', (height,)).fetchone()
+
+        return row[0] if row else None
+
+    def get(self, blockhash):
+        # the serialized block, or None if it isn't cached
+        with self.lock:
+            row = self.index.execute('''SELECT offset, size FROM block WHERE hash = ?''', (blockhash,)).fetchone()
+
+            if row is None:
+                return None
+
+            offset, size = row
+
+            if self.map is None or offset + size > len(self.map):
+                # the data file has grown since it was last mapped; other threads may still be reading
+                #   from the old map, so it's left to be released once they're done
+                self.data.flush()
+                self.map = mmap.mmap(self.data.fileno(), 0, access=mmap.ACCESS_READ)
+
+            view = memoryview(self.map)[offset:offset+size]
+
+        try:
+            return zlib.decompress(view)
+
+        except zlib.error:
+            # damaged by an unclean shutdown; treat it as not cached
+            return None
+
+        finally:
+            view.release()
+
+    def put(self, blockhash, height, raw):
+        compressed = zlib.compress(raw, self.LEVEL)
+
+        with self.lock:
+            if self.index.execute('''SELECT 1 FROM block WHERE hash = ?''', (blockhash,)).fetchone():
+                return False
+
+            offset = self.end
+            self.data.write(compressed)
+            self.data.flush()
+            self.end += len(compressed)
+
+            # a block at this height from a chain that has since been reorganized is no longer wanted
+            self.index.execute('''DELETE FROM block WHERE height = ?''', (height,))
+            self.index.execute('''INSERT INTO block (hash, height, offset, size) VALUES (?, ?, ?, ?)''',
+                    (blockhash, height, offset, len(compressed)))
+            self.index.commit()
+
+        return True
@@ -3,12 +3,13 @@
 
 #import ag.logging as log
 
-from os import makedirs, path
+from os import makedirs, path, environ
 
 from appdirs import AppDirs
 dirs = AppDirs("orbit-node", "Alpha Griffin")
 
-dir = dirs.user_config_dir
+# overridden to run more than one node on the same machine
+dir = environ.get('ORBIT_NODE_DIR') or dirs.user_config_dir
 #log.debug("Starting up", configdir=dir)
 
 if not path.exists(dir):
@@ -21,20 +22,33 @@ if not path.isdir(dir):
     #log.fatal("Expected a directory for configdir", configdir=dir)
     raise Exception("Not a directory: " + dir)
 
+# extra (slow) checks of in-memory state against the database
+debug = bool(environ.get('ORBIT_NODE_DEBUG'))
+
 
 def get_rpc_url():
+    return get_rpc_urls()[0]
+
+def get_rpc_urls():
+    # the first URL is the primary node; any others are extra backends for fetching blocks
     rpc = path.join(dir, 'rpc')
 
     if not path.exists(rpc):
         raise ValueError('RPC URL not set. You must set a URL first with: `orbit-node config rpc`')
 
     with open(rpc, 'r') as rpcin:
-        return rpcin.readline()
+        urls = [ line.strip() for line in rpcin if line.strip() ]
+
+    if not urls:
+        raise ValueError('RPC URL not set. You must set a URL first with: `orbit-node config rpc`')
+
+    return urls
 
 def set_rpc_url(url):
+    # a comma-separated list sets multiple backends
     rpc = path.join(dir, 'rpc')
     with open(rpc, 'w') as out:
-        out.write(url)
+        out.write('\n'.join(u.strip() for u in url.split(',') if u.strip()))
 
     return rpc
 
@@ -76,3 +90,120 @@ def set_webapi_port(port):
 
     return webapi
 
+
+def get_webapi_pool_size():
+    # most database connections kept open for web API requests
+    webapi = path.join(dir, 'webapi_pool')
+
+    if not path.exists(webapi):
+        return 8
+
+    with open(webapi, 'r') as webapiin:
+        return int(webapiin.readline())
+
+def set_webapi_pool_size(size):
+    if int(size) < 1:
+        raise ValueError("Pool size must be a positive integer.")
+
+    webapi = path.join(dir, 'webapi_pool')
+    with open(webapi, 'w') as out:
+        out.write(size)
+
+    return webapi
+
+
+
+def get_prefetch_depth():
+    prefetch = path.join(dir, 'prefetch')
+
+    if not path.exists(prefetch):
+        return 0
+
+    with open(prefetch, 'r') as prefetchin:
+        return int(prefetchin.readline())
+
+def set_prefetch_depth(depth):
+    if int(depth) < 0:
+        raise ValueError("Prefetch depth must be zero (disabled) or a positive integer.")
+
+    prefetch = path.join(dir, 'prefetch')
+    with open(prefetch, 'w') as out:
+        out.write(depth)
+
+    return prefetch
+
+
+def get_fetch_strategy():
+    fetch = path.join(dir, 'fetch')
+
+    if not path.exists(fetch):
+        return 'verbose'
+
+    with open(fetch, 'r') as fetchin:
+        return fetchin.readline().strip()
+
+def set_fetch_strategy(strategy):
+    fetch = path.join(dir, 'fetch')
+    with open(fetch, 'w') as out:
+        out.write(strategy)
+
+    return fetch
+
+
+def get_notify():
+    notify = path.join(dir, 'notify')
+
+    if not path.exists(notify):
+        return 'poll'
+
+    with open(notify, 'r') as notifyin:
+        return notifyin.readline().strip()
+
+def set_notify(spec):
+    notify = path.join(dir, 'notify')
+    with open(notify, 'w') as out:
+        out.write(spec)
+
+    return notify
+
+
+def get_busy_timeout():
+    # milliseconds a database connection waits for a lock held by another before giving up
+    timeout = path.join(dir, 'timeout')
+
+    if not path.exists(timeout):
+        return 5000
+
+    with open(timeout, 'r') as timeoutin:
+        return int(timeoutin.readline())
+
+def set_busy_timeout(ms):
+    if int(ms) < 0:
+        raise ValueError("Busy timeout must be zero (fail immediately) or a positive number of milliseconds.")
+
+    timeout = path.join(dir, 'timeout')
+    with open(timeout, 'w') as out:
+        out.write(ms)
+
+    return timeout
+
+
+def get_checkpoint_interval():
+    # commits between checkpoints of the write-ahead log into the database (0 leaves it to SQLite)
+    checkpoint = path.join(dir, 'checkpoint')
+
+    if not path.exists(checkpoint):
+        return 100
+
+    with open(checkpoint, 'r') as checkpointin:
+        return int(checkpointin.readline())
+
+def set_checkpoint_interval(commits):
+    if int(commits) < 0:
+        raise ValueError("Checkpoint interval must be zero (automatic) or a positive number of commits.")
+
+    checkpoint = path.join(dir, 'checkpoint')
+    with open(checkpoint, 'w') as out:
+        out.write(commits)
+
+    return checkpoint
@@ -18,8 +18,17 @@ def usage():
     print("Where <command> is:")
     print("    help             - Display this usage screen")
     print("    rpc [<url>]      - Set or display the BCH node RPC URL")
+    print("                       (a comma-separated list adds backends for fetching blocks)")
     print("    interface [<ip>] - Set or display the interface IP to bind to")
     print("    port [<port>]    - Set or display the port number to bind to")
+    print("    pool [<n>]       - Set or display how many database connections the web API keeps open")
+    print("    prefetch [<n>]   - Set or display how many blocks to fetch ahead while syncing (0 to disable)")
+    print("    fetch [<name>]   - Set or display the block fetch strategy (verbose, rawtx or raw)")
+    print("    notify [<mode>]  - Set or display how the daemon learns of new blocks:")
+    print("                       poll, rpc, socket[:<ip>:<port>] or zmq:<endpoint>")
+    print("    timeout [<ms>]   - Set or display how long database connections wait for a lock")
+    print("    checkpoint [<n>] - Set or display how many commits the sync makes between WAL checkpoints")
+    print("                       (0 leaves checkpoints to SQLite)")
     print()
 
 
@@ -52,6 +61,30 @@ with suppress(KeyboardInterrupt):
         from .port import run
         invoke(CALL, cmd, 103, run, args, 1, 1, optional=True)
 
+    elif cmd == 'prefetch':
+        from .prefetch import run
+        invoke(CALL, cmd, 104, run, args, 1, 1, optional=True)
+
+    elif cmd == 'fetch':
+        from .fetch import run
+        invoke(CALL, cmd, 105, run, args, 1, 1, optional=True)
+
+    elif cmd == 'notify':
+        from .notify import run
+        invoke(CALL, cmd, 106, run, args, 1, 1, optional=True)
+
+    elif cmd == 'timeout':
+        from .timeout import run
+        invoke(CALL, cmd, 107, run, args, 1, 1, optional=True)
+
+    elif cmd == 'checkpoint':
+        from .checkpoint import run
+        invoke(CALL, cmd, 108, run, args, 1, 1, optional=True)
+
+    elif cmd == 'pool':
+        from .pool import run
+        invoke(CALL, cmd, 109, run, args, 1, 1, optional=True)
+
     else:
         print()
         print("{}: unknown command: {}".format(CALL, cmd))
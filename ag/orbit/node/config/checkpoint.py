@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.command import main
+from ag.orbit.node.config import get_checkpoint_interval, set_checkpoint_interval
+
+
+def run(args):
+    if args and len(args) != 1:
+        raise ValueError("Expecting exactly 1 argument")
+
+    if args:
+        commits = args[0]
+
+        print()
+        print("    Setting WAL checkpoint interval to: {} commits".format(commits))
+
+        checkpoint = set_checkpoint_interval(commits)
+
+        print()
+        print("WAL checkpoint interval saved to: {}".format(checkpoint))
+
+    else:
+        commits = get_checkpoint_interval()
+
+        print()
+        print("    WAL checkpoint interval: {}".format('{} commits'.format(commits) if commits else 'automatic'))
+
+
+if __name__ == '__main__':
+    main(run)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.command import main
+from ag.orbit.node.config import get_fetch_strategy, set_fetch_strategy
+from ag.orbit.node.sync.fetch import STRATEGIES
+
+
+def run(args):
+    if args and len(args) != 1:
+        raise ValueError("Expecting exactly 1 argument")
+
+    if args:
+        strategy = args[0]
+
+        if strategy not in STRATEGIES:
+            raise ValueError("Fetch strategy must be one of: {}".format(', '.join(STRATEGIES)))
+
+        print()
+        print("    Setting block fetch strategy to: {}".format(strategy))
+
+        fetch = set_fetch_strategy(strategy)
+
+        print()
+        print("Block fetch strategy saved to: {}".format(fetch))
+
+    else:
+        strategy = get_fetch_strategy()
+
+        print()
+        print("    Block fetch strategy: {}".format(strategy))
+
+
+if __name__ == '__main__':
+    main(run)
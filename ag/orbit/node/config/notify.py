@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.command import main
+from ag.orbit.node.config import get_notify, set_notify
+from ag.orbit.node.daemon.notify import parse
+
+
+def run(args):
+    if args and len(args) != 1:
+        raise ValueError("Expecting exactly 1 argument")
+
+    if args:
+        spec = args[0]
+        parse(spec)
+
+        print()
+        print("    Setting block notification mode to: {}".format(spec))
+
+        notify = set_notify(spec)
+
+        print()
+        print("Block notification mode saved to: {}".format(notify))
+
+    else:
+        spec = get_notify()
+
+        print()
+        print("    Block notification mode: {}".format(spec))
+
+
+if __name__ == '__main__':
+    main(run)
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.command import main
+from ag.orbit.node.config import get_webapi_pool_size, set_webapi_pool_size
+
+
+def run(args):
+    if args and len(args) != 1:
+        raise ValueError("Expecting exactly 1 argument")
+
+    if args:
+        size = args[0]
+
+        print()
+        print("    Setting web API connection pool size to: {}".format(size))
+
+        webapi = set_webapi_pool_size(size)
+
+        print()
+        print("Web API connection pool size saved to: {}".format(webapi))
+
+    else:
+        size = get_webapi_pool_size()
+
+        print()
+        print("    Web API connection pool size: {}".format(size))
+
+
+if __name__ == '__main__':
+    main(run)
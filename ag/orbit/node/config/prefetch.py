@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.command import main
+from ag.orbit.node.config import get_prefetch_depth, set_prefetch_depth
+
+
+def run(args):
+    if args and len(args) != 1:
+        raise ValueError("Expecting exactly 1 argument")
+
+    if args:
+        depth = args[0]
+
+        print()
+        print("    Setting block prefetch depth to: {}".format(depth))
+
+        prefetch = set_prefetch_depth(depth)
+
+        print()
+        print("Block prefetch depth saved to: {}".format(prefetch))
+
+    else:
+        depth = get_prefetch_depth()
+
+        print()
+        print("    Block prefetch depth: {}".format(depth))
+
+
+if __name__ == '__main__':
+    main(run)
@@ -4,7 +4,7 @@
 # @%@~LICENSE~@%@
 
 from ag.orbit.command import main
-from ag.orbit.node.config import get_rpc_url, set_rpc_url
+from ag.orbit.node.config import get_rpc_urls, set_rpc_url
 
 
 def run(args):
@@ -23,10 +23,13 @@ def run(args):
         print("RPC URL saved to: {}".format(rpc))
 
     else:
-        url = get_rpc_url()
+        urls = get_rpc_urls()
 
         print()
-        print("    RPC URL for bitcoind: {}".format(url))
+        print("    RPC URL for bitcoind: {}".format(urls[0]))
+
+        for url in urls[1:]:
+            print("    Additional fetch backend: {}".format(url))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.command import main
+from ag.orbit.node.config import get_busy_timeout, set_busy_timeout
+
+
+def run(args):
+    if args and len(args) != 1:
+        raise ValueError("Expecting exactly 1 argument")
+
+    if args:
+        ms = args[0]
+
+        print()
+        print("    Setting database busy timeout to: {} ms".format(ms))
+
+        timeout = set_busy_timeout(ms)
+
+        print()
+        print("Database busy timeout saved to: {}".format(timeout))
+
+    else:
+        ms = get_busy_timeout()
+
+        print()
+        print("    Database busy timeout: {} ms".format(ms))
+
+
+if __name__ == '__main__':
+    main(run)
@@ -20,6 +20,7 @@ def usage():
     print("    sync         - Sync blocks and validate transactions")
     print("    webapi       - Listen for client connections")
     print("    all          - Sync blocks, validate transactions, and listen for client connections")
+    print("    notify [<hash>] - Tell a running daemon about a new block (for bitcoind -blocknotify)")
     print()
 
 
@@ -52,6 +53,10 @@ with suppress(KeyboardInterrupt):
         from .all import run
         invoke(CALL, cmd, 304, run, args)
 
+    elif cmd == 'notify':
+        from .notify import run
+        invoke(CALL, cmd, 305, run, args, 1, 1, optional=True)
+
     else:
         print()
         print("{}: unknown command: {}".format(CALL, cmd))
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.command import main
+from ag.orbit.node.config import get_notify
+
+from bitcoinrpc.authproxy import AuthServiceProxy
+
+from threading import Thread
+from time import sleep
+from socket import socket, AF_INET, SOCK_DGRAM, timeout as SocketTimeout
+
+
+POLL = 'poll'       # no notifications, only check for new blocks every few seconds
+RPC = 'rpc'         # long-poll bitcoind with waitfornewblock
+SOCKET = 'socket'   # listen for datagrams sent by `orbit-node daemon notify` (e.g. from bitcoind -blocknotify)
+ZMQ = 'zmq'         # subscribe to bitcoind's ZMQ hashblock feed (requires pyzmq)
+
+MODES = (POLL, RPC, SOCKET, ZMQ)
+
+DEFAULT_SOCKET = ('127.0.0.1', 28339)
+
+# how often a listener re-checks whether it has been stopped
+LISTEN_SECONDS = 1
+
+# how long each waitfornewblock call blocks in bitcoind; when idle that's one RPC a minute
+WAIT_SECONDS = 60
+
+
+def parse(spec):
+    # returns (mode, argument) from a notify setting such as "socket:127.0.0.1:28339" or "zmq:tcp://127.0.0.1:28332"
+    mode, _, arg = spec.strip().partition(':')
+
+    if mode not in MODES:
+        raise ValueError("Notify mode must be one of: {}".format(', '.join(MODES)))
+
+    if mode == SOCKET:
+        if arg:
+            host, _, port = arg.rpartition(':')
+            arg = (host, int(port))
+        else:
+            arg = DEFAULT_SOCKET
+
+    elif mode == ZMQ:
+        if not arg:
+            raise ValueError("ZMQ notifications require an endpoint, e.g. zmq:tcp://127.0.0.1:28332")
+
+    return mode, arg
+
+def listener(spec, event, url):
+    # a started listener that sets the event whenever a new block is announced, or None for polling only
+    mode, arg = parse(spec)
+
+    if mode == POLL:
+        return None
+
+    if mode == RPC:
+        listen = RPCListener(event, url)
+    elif mode == SOCKET:
+        listen = SocketListener(event, arg)
+    else:
+        listen = ZMQListener(event, arg)
+
+    listen.start()
+    return listen
+
+
+class Listener(Thread):
+
+    def __init__(self, event, name):
+        Thread.__init__(self, name=name, daemon=True)
+
+        self.event = event
+        self.stopped = False
+        self.notified = 0
+
+    def stop(self):
+        self.stopped = True
+
+    def notify(self):
+        self.notified += 1
+        self.event.set()
+
+
+class RPCListener(Listener):
+
+    def __init__(self, event, url):
+        Listener.__init__(self, event, 'notify-rpc')
+
+        self.url = url
+
+    def run(self):
+        last = None
+
+        while not self.stopped:
+            try:
+                # a separate connection, since this one spends most of its time blocked in waitfornewblock
+                rpc = AuthServiceProxy(self.url, timeout=WAIT_SECONDS + 30)
+
+                if last is None:
+                    last = rpc.getbestblockhash()
+
+                while not self.stopped:
+                    block = rpc.waitfornewblock(WAIT_SECONDS * 1000)
+
+                    # stopping may have to wait out the call, but the thread is a daemon so it never holds up exit
+                    if self.stopped:
+                        break
+
+                    if block['hash'] != last:
+                        last = block['hash']
+                        self.notify()
+
+            except Exception:
+                # the sync thread keeps polling in the meantime
+                sleep(LISTEN_SECONDS)
+
+
+class SocketListener(Listener):
+
+    def __init__(self, event, address):
+        Listener.__init__(self, event, 'notify-socket')
+
+        self.sock = socket(AF_INET, SOCK_DGRAM)
+        self.sock.bind(address)
+        self.sock.settimeout(LISTEN_SECONDS)
+
+    def run(self):
+        try:
+            while not self.stopped:
+                try:
+                    self.sock.recv(256)
+                except SocketTimeout:
+                    continue
+
+                self.notify()
+
+        finally:
+            self.sock.close()
+
+
+class ZMQListener(Listener):
+
+    def __init__(self, event, endpoint):
+        Listener.__init__(self, event, 'notify-zmq')
+
+        try:
+            import zmq
+        except ImportError:
+            raise ValueError("ZMQ notifications require pyzmq (`pip install pyzmq`)")
+
+        self.context = zmq.Context.instance()
+        self.sock = self.context.socket(zmq.SUB)
+        self.sock.setsockopt(zmq.SUBSCRIBE, b'hashblock')
+        self.sock.setsockopt(zmq.RCVTIMEO, LISTEN_SECONDS * 1000)
+        self.sock.connect(endpoint)
+
+        self.again = zmq.Again
+
+    def run(self):
+        try:
+            while not self.stopped:
+                try:
+                    self.sock.recv_multipart()
+                except self.again:
+                    continue
+
+                self.notify()
+
+        finally:
+            self.sock.close()
+
+
+def send(address, blockhash=''):
+    sock = socket(AF_INET, SOCK_DGRAM)
+    try:
+        sock.sendto(blockhash.encode('ascii'), address)
+    finally:
+        sock.close()
+
+
+def run(args):
+    # hook for bitcoind, e.g.: -blocknotify="orbit-node daemon notify %s"
+    if args and len(args) > 1:
+        raise ValueError("Expecting at most 1 argument")
+
+    mode, address = parse(get_notify())
+    if mode != SOCKET:
+        raise ValueError("Notify mode is not configured for socket; set it with: `orbit-node config notify socket`")
+
+    send(address, args[0] if args else '')
+
+
+if __name__ == '__main__':
+    main(run)
@@ -4,8 +4,9 @@
 # @%@~LICENSE~@%@
 
 from ag.orbit.command import main, read_char
-from ag.orbit.node.config import get_rpc_url
+from ag.orbit.node.config import get_rpc_url, get_rpc_urls, get_prefetch_depth, get_fetch_strategy, get_notify
 from ag.orbit.node.sync import Process
+from ag.orbit.node.daemon.notify import listener
 
 from threading import Thread, Event
 from sys import stdin, stdout
@@ -36,6 +37,8 @@ def start():
 
     print("Daemon running")
 
+    info = None
+
     if stdin.isatty() and stdout.isatty():
         print()
 
@@ -51,8 +54,14 @@ def start():
 
             elif 'i' == c or 'I' == c:
                 print()
-                sync = Process(url=get_rpc_url())
-                sync.get_info()
+
+                # built once and reused: a read-only view of the token database that shares the daemon's pooled
+                #   RPC connections (and latency stats)
+                if info is None:
+                    info = Process(url=get_rpc_urls(), prefetch=get_prefetch_depth(), fetch=get_fetch_strategy(),
+                            readonly=True)
+
+                info.get_info()
                 print()
 
             elif '\x03' == c:
@@ -63,22 +72,40 @@ def start():
             #else:
             #    print(repr(c))
 
+        if info:
+            info.close()
+
         print()
         print("User quit")
 
     else:
         daemon.join()
 
+# seconds between checks for new blocks when polling, and when block notifications are enabled
+POLL_SECONDS = 10
+NOTIFIED_POLL_SECONDS = 120
+
 def forever():
-    sync = Process(url=get_rpc_url(), out=None)
+    sync = Process(url=get_rpc_urls(), out=None, prefetch=get_prefetch_depth(), fetch=get_fetch_strategy())
+
+    # notifications wake us up through the same event used to quit
+    notify = listener(get_notify(), sleep, get_rpc_url())
+    wait = NOTIFIED_POLL_SECONDS if notify else POLL_SECONDS
 
     while not quit:
         last = sync.next()
 
         if last is None:
             if not sync.refresh():
-                # wait 10 seconds between block checks
-                sleep.wait(10)
+                # idle time goes into any missing indexes first, one at a time so new blocks aren't held up for long
+                if sync.tokens.build_index() is None:
+                    sleep.wait(wait)
+                    sleep.clear()
+
+    if notify:
+        notify.stop()
+
+    sync.close()
 
 
 if __name__ == '__main__':
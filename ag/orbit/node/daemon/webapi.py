@@ -5,13 +5,103 @@
 
 from ag.orbit.command import main
 from ag.orbit.webapi import Endpoints
-from ag.orbit.node.config import get_webapi_interface, get_webapi_port
+from ag.orbit.node.config import get_webapi_interface, get_webapi_port, get_webapi_pool_size
 from ag.orbit.node.db import TokenDB
+from ag.orbit.node.rpc import Histogram
 
 from flask import Flask, request, abort
+from threading import Lock
+from queue import LifoQueue
+from time import time
+import sqlite3
 import json
 
 
+# endpoints served by the node in addition to those of the ORBIT web API
+CHANGES = 'changes'     # the change journal after a sequence number (?since=)
+PROOF = 'proof'         # a user's balances with Merkle inclusion proofs against the latest state root (?address=)
+ORBITS = 'orbits'       # orbit hashes, state roots and state digests at the given block heights, for finding where two
+                        #   nodes diverge and checking snapshots (?heights=)
+POOL = 'pool'           # database connection pool size and how long requests waited for a connection
+
+
+class Pool():
+
+    # long-lived read-only database connections shared by the request threads, opened as they are first needed;
+    #   a request never pays for opening the database, and each connection keeps its prepared statements
+
+    def __init__(self, size):
+        self.size = size
+
+        self.idle = LifoQueue()
+        self.created = 0
+        self.lock = Lock()
+
+        self.waits = Histogram() # milliseconds from asking for a connection to having one
+
+    def acquire(self):
+        start = time()
+
+        with self.lock:
+            opening = self.idle.empty() and self.created < self.size
+            if opening:
+                self.created += 1
+
+        if opening:
+            tokens = None
+        else:
+            tokens = self.idle.get()
+
+        if tokens is None:
+            try:
+                tokens = TokenDB(readonly=True)
+
+            except Exception:
+                self._discard()
+                raise
+
+        with self.lock:
+            self.waits.add((time() - start) * 1000)
+
+        return tokens
+
+    def release(self, tokens):
+        if tokens.conn.in_transaction:
+            tokens.conn.rollback()
+
+        self.idle.put(tokens)
+
+    def discard(self, tokens):
+        tokens.close()
+        self._discard()
+
+    def _discard(self):
+        # its slot gets a fresh connection when next needed
+        self.idle.put(None)
+
+    def close(self):
+        while not self.idle.empty():
+            tokens = self.idle.get()
+            if tokens:
+                tokens.close()
+
+    def stats(self):
+        with self.lock:
+            waits = self.waits
+
+            return {
+                "size": self.size,
+                "open": self.created,
+                "idle": sum(1 for tokens in list(self.idle.queue) if tokens),
+                "requests": waits.count,
+                "wait_ms": {
+                    "mean": waits.mean(),
+                    "p50": waits.percentile(50),
+                    "p99": waits.percentile(99)
+                    }
+                }
+
+
 class Server():
 
     def __init__(self, interface, port, daemon=False):
@@ -21,12 +111,24 @@ class Server():
         self.flask = Flask(__name__)
         self.daemon = daemon
 
-        if daemon:
-            self.tokens = None
-        else:
-            self.tokens = TokenDB()
+        # the pool only opens the database read-only, so it is created or migrated first if need be; on a new node
+        #   nothing else may have created it yet, and `daemon all` starts serving before the sync opens it
+        try:
+            TokenDB().close()
+
+        except (ValueError, sqlite3.OperationalError) as e:
+            # e.g. `sync migrate` still converting it, or waiting to be run; requests get a 503 until it's ready
+            print("Token database not ready yet: {}".format(e))
+
+        # requests are only handled one at a time unless running as a daemon
+        self.pool = Pool(get_webapi_pool_size() if daemon else 1)
 
         self._handler(Endpoints.USER_TOKENS, "get_user_tokens", "address")
+        self._handler(CHANGES, "get_changes", "since")
+        self._handler(PROOF, "get_user_proofs", "address")
+        self._handler(ORBITS, "get_orbit_hashes", "heights")
+
+        self.flask.add_url_rule("/" + POOL, POOL, lambda: json.dumps({ POOL: self.pool.stats() }))
 
     def run(self, quiet=False):
         if quiet:
@@ -36,8 +138,7 @@ class Server():
 
         self.flask.run(host=self.interface, port=self.port, threaded=self.daemon)
 
-        if self.tokens:
-            self.tokens.close()
+        self.pool.close()
 
     def _handler(self, endpoint, fn_name, *args):
         def handler():
@@ -47,16 +148,31 @@ class Server():
                 if not val: abort(400)
                 qargs.append(val)
 
-            tokens = self.tokens if self.tokens else TokenDB()
+            # read-only connections never wait on the sync, which may be in the middle of a block
+            try:
+                tokens = self.pool.acquire()
+
+            except (ValueError, sqlite3.OperationalError):
+                # not created or migrated yet
+                abort(503)
+
             try:
                 fn = getattr(tokens, fn_name)
-                return json.dumps({ endpoint: fn(*qargs) })
+                result = fn(*qargs)
+
+            except sqlite3.Error:
+                # the connection may be in an unknown state
+                self.pool.discard(tokens)
+                raise
+
+            except Exception:
+                self.pool.release(tokens)
+                raise
 
-            finally:
-                if not self.tokens:
-                    tokens.close()
+            self.pool.release(tokens)
+            return json.dumps({ endpoint: result })
 
-        self.flask.add_url_rule("/" + endpoint, view_func=handler)
+        self.flask.add_url_rule("/" + endpoint, endpoint, handler)
 
 
 def run(args):
@@ -2,20 +2,186 @@
 # @%@~LICENSE~@%@
 
 from . import config, TokenError
+from .state import StateTree
 
 from bitcash.format import public_key_to_address
 
 from os import path
+from pathlib import Path
 import sqlite3
 from hashlib import sha256
+from functools import lru_cache
+from heapq import heapify, heappush, heappop
+
+
+@lru_cache(maxsize=65536)
+def pubkey_address(pubkey):
+    # the same wallets sign over and over, so the address derivation is kept across blocks
+    return public_key_to_address(pubkey)
+
+def signer_address(scriptsigs):
+    # the one address whose key signed all of the given input scripts (as bytes)
+    address = None
+
+    for asm in scriptsigs:
+        sig_size = int.from_bytes(asm[0:1], 'little')
+        pubkey_size = int.from_bytes(asm[sig_size+1:sig_size+2], 'little')
+        pubkey = asm[sig_size + 2 : sig_size + pubkey_size + 2]
+        key_address = pubkey_address(pubkey)
+
+        if not address:
+            address = key_address
+
+        elif address != key_address:
+            raise ValueError("Multiple signer keys are present in the transaction inputs")
+
+    return address
 
 
 class TokenDB:
 
-    def __init__(self, auto_commit=True):
-        isolation = 'EXCLUSIVE' if not auto_commit else None
-        conn = sqlite3.connect(path.join(config.dir, 'tokens.db'), isolation_level=isolation)
+    # state tables in the order they are hashed, with the column holding the block each row was last changed in
+    JOURNALED = (
+        ('token', 'updated'),
+        ('balance', 'updated'),
+        ('transfer', 'created'),
+        ('advertisement', 'updated'),
+        ('registration', 'updated')
+    )
+
+    # schema changes in the order they were made; the database keeps how many have been applied in status as
+    #   'schema', and opening it only runs those that haven't
+    MIGRATIONS = (
+        '_migrate_tables',
+        '_migrate_schedule',
+        '_migrate_journal',
+        '_migrate_state',
+        '_migrate_snapshot',
+        '_migrate_indexes',
+        '_migrate_compact',
+        '_migrate_state_digest'
+    )
+
+    # migrations that rewrite most of an existing database, holding the write lock throughout; they are only run by
+    #   `orbit-node sync migrate`, so neither the sync nor the web API ends up waiting on one it didn't ask for
+    EXPLICIT_MIGRATIONS = ('_migrate_compact',)
+
+    WAL_SIZE_LIMIT = 67108864 # bytes the write-ahead log is truncated to once it has been checkpointed
+
+    ORBIT_HASHES = 1000 # most heights get_orbit_hashes() answers for at once
+
+    STATE_MODULUS = 1 << 256 # the state digest is a sum of row digests modulo this (see _state_digest())
+
+    # scheduled advertisement events
+    DELIVER = 'deliver'
+    END = 'end'
+
+    # secondary indexes never read while syncing, so a bulk sync may drop them and build them once at the end;
+    #   any missing (after an interrupted bulk sync, or added by a newer version) are built by build_index()
+    DEFERRABLE_INDEXES = {
+        'idx_tx_block': 'tx (block)',
+        'idx_txout_tx': 'txout (tx)',
+        'idx_token_symbol': 'token (symbol)'
+    }
+
+    def __init__(self, auto_commit=True, copy=False, readonly=False, migrate=False):
+        timeout = config.get_busy_timeout() / 1000
+
+        if readonly:
+            # only for queries, against a database that has already been set up; no schema changes are attempted
+            #   (may be handed between threads, e.g. by a pool, as long as only one uses it at a time)
+            filename = Path(config.dir, 'tokens.db')
+
+            if not filename.exists():
+                raise ValueError("The token database has not been created yet; it is created when the node first syncs")
+
+            conn = sqlite3.connect(filename.as_uri() + '?mode=ro', uri=True, timeout=timeout, check_same_thread=False)
+
+            version = self._get_schema_version(conn)
+
+            if version != len(self.MIGRATIONS):
+                conn.close()
+                raise ValueError("The token database has schema version {} but this version of orbit-node needs {};"
+                        " update it with: `orbit-node sync migrate`".format(version, len(self.MIGRATIONS)))
+
+            self.state = StateTree(conn, create=False)
+            self._open(conn)
+            return
+
+        # the database keeps a write-ahead log, so readers carry on with the last committed block while a block is
+        #   being processed; the writer still takes its lock up front rather than upgrading to it part way through
+        isolation = 'IMMEDIATE' if not auto_commit else None
+        conn = sqlite3.connect(path.join(config.dir, 'tokens.db'), isolation_level=isolation, timeout=timeout)
+
+        checkpoint = 0
+
+        if copy:
+            # work on an in-memory copy; nothing is ever written back
+            memory = sqlite3.connect(':memory:', isolation_level=isolation)
+            conn.backup(memory)
+            conn.close()
+            conn = memory
+
+        else:
+            conn.execute('''PRAGMA journal_mode = WAL''')
+            conn.execute('''PRAGMA journal_size_limit = {}'''.format(self.WAL_SIZE_LIMIT))
+
+            if not auto_commit:
+                # the sync checkpoints on its own schedule (see commit()); anything else is left to SQLite
+                checkpoint = config.get_checkpoint_interval()
+
+                if checkpoint:
+                    conn.execute('''PRAGMA wal_autocheckpoint = 0''')
+
+        version = self._get_schema_version(conn)
+
+        if version > len(self.MIGRATIONS):
+            raise ValueError("The token database has schema version {} but this version of orbit-node only knows up to {}".format(
+                    version, len(self.MIGRATIONS)))
+
+        if version and not (migrate or copy):
+            # a new database has nothing to convert, and an in-memory copy keeps no one waiting
+            explicit = [ name for name in self.MIGRATIONS[version:] if name in self.EXPLICIT_MIGRATIONS ]
+
+            if explicit:
+                conn.close()
+                raise ValueError("The token database has schema version {} and needs converting to version {},"
+                        " which may take a while; stop the daemon and run: `orbit-node sync migrate`".format(
+                        version, len(self.MIGRATIONS)))
+
+        for number in range(version, len(self.MIGRATIONS)):
+            # each in its own transaction, so an interrupted migration is simply run again; the write lock is taken
+            #   up front in case another connection (e.g. the web API starting up) is running the same migration
+            conn.execute('''BEGIN IMMEDIATE''')
+
+            if self._get_schema_version(conn) > number:
+                conn.rollback()
+                continue
 
+            getattr(self, self.MIGRATIONS[number])(conn)
+            conn.execute('''INSERT OR REPLACE INTO status (key, value) VALUES ('schema', ?)''', (number + 1,))
+            conn.commit()
+
+        self.state = StateTree(conn, create=False)
+        self._open(conn, checkpoint)
+
+    def get_schema_version(self):
+        return self._get_schema_version(self.conn)
+
+    @classmethod
+    def _get_schema_version(self, conn):
+        if not conn.execute('''SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'status' ''').fetchone():
+            return 0
+
+        version = conn.execute('''SELECT value FROM status WHERE key = 'schema' ''').fetchone()
+        if version is None or version[0] is None:
+            # from before the schema had a version; every migration checks what is already there
+            return 0
+
+        return int(version[0])
+
+    def _migrate_tables(self, conn):
+        # blocks, transactions, tokens and events
         conn.execute('''CREATE TABLE IF NOT EXISTS status (
                             key TEXT NOT NULL PRIMARY KEY,
                             value TEXT
@@ -37,7 +203,6 @@ class TokenDB:
                             block INTEGER NOT NULL,
                             confirmations INTEGER NOT NULL
                         )''')
-        conn.execute('''CREATE INDEX IF NOT EXISTS idx_tx_block ON tx (block)''')
 
         conn.execute('''CREATE TABLE IF NOT EXISTS txin (
                             hash TEXT NOT NULL PRIMARY KEY,
@@ -53,7 +218,6 @@ class TokenDB:
                             addresses TEXT,
                             asmhex TEXT NOT NULL
                         )''')
-        conn.execute('''CREATE INDEX IF NOT EXISTS idx_txout_tx ON txout (tx)''')
 
         #
         # Tokens and balances
@@ -71,7 +235,6 @@ class TokenDB:
                             main_uri TEXT,
                             image_uri TEXT
                         )''')
-        conn.execute('''CREATE INDEX IF NOT EXISTS idx_token_symbol ON token (symbol)''')
         conn.execute('''CREATE INDEX IF NOT EXISTS idx_token_updated ON token (updated)''')
 
         conn.execute('''CREATE TABLE IF NOT EXISTS balance (
@@ -126,13 +289,242 @@ class TokenDB:
                             payments INTEGER NOT NULL,
                             claimed INTEGER NOT NULL
                         )''')
+        conn.execute('''CREATE INDEX IF NOT EXISTS idx_registration_advertisement ON registration (advertisement)''')
+
+        self._create_indexes(conn)
 
         keys = conn.execute('''SELECT key FROM status''').fetchall()
         self._init_status(conn, keys, 'height')
 
-        conn.commit()
+    def _migrate_schedule(self, conn):
+        # scheduled advertisement events (deliveries and endings) by block height
+        scheduled = conn.execute('''SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schedule' ''').fetchone()
+
+        conn.execute('''CREATE TABLE IF NOT EXISTS schedule (
+                            height INTEGER NOT NULL,
+                            advertisement INTEGER NOT NULL,
+                            event TEXT NOT NULL
+                        )''')
+        conn.execute('''CREATE INDEX IF NOT EXISTS idx_schedule_height ON schedule (height)''')
+
+        if not scheduled:
+            # advertisements from before there was a schedule
+            conn.execute('''INSERT INTO schedule (height, advertisement, event)
+                            SELECT delivers, rowid, ? FROM advertisement''', (self.DELIVER,))
+            conn.execute('''INSERT INTO schedule (height, advertisement, event)
+                            SELECT ends, rowid, ? FROM advertisement WHERE ends IS NOT NULL''', (self.END,))
+
+    def _migrate_journal(self, conn):
+        # change journal: every row inserted or updated in the state tables, in order, by the block it was
+        #   changed in (written by triggers so no mutation can be missed); hash() adds the digest of each
+        #   row as it was at the end of the block, so any block can be audited later
+        journaled = conn.execute('''SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'journal' ''').fetchone()
+        digested = journaled and any(col[1] == 'digest' for col in conn.execute('''PRAGMA table_info(journal)'''))
+
+        conn.execute('''CREATE TABLE IF NOT EXISTS journal (
+                            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                            block INTEGER NOT NULL,
+                            tbl TEXT NOT NULL,
+                            row INTEGER NOT NULL,
+                            change TEXT NOT NULL,
+                            digest BLOB
+                        )''')
+        conn.execute('''CREATE INDEX IF NOT EXISTS idx_journal_block ON journal (block, tbl, row)''')
+
+        if journaled and not digested:
+            conn.execute('''ALTER TABLE journal ADD COLUMN digest BLOB''')
+
+        self._create_triggers(conn)
+
+        keys = conn.execute('''SELECT key FROM status''').fetchall()
+        self._init_status(conn, keys, 'journal') # lowest height with a complete journal (NULL for all of them)
+
+        if not digested:
+            # blocks hashed before row digests were journaled can't be audited
+            conn.execute('''UPDATE status
+                            SET value = (SELECT value + 1 FROM status WHERE key = 'height')
+                            WHERE key = 'journal' ''')
+
+    def _migrate_state(self, conn):
+        # a Merkle tree over all balances, and its root after each block
+        stated = conn.execute('''SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'state_leaf' ''').fetchone()
+
+        state = StateTree(conn)
+
+        conn.execute('''CREATE TABLE IF NOT EXISTS state_root (
+                            block INTEGER NOT NULL PRIMARY KEY,
+                            root BLOB NOT NULL
+                        )''')
+
+        if not stated:
+            # balances from before there was a state tree
+            state.update(conn.execute('''SELECT t.address, b.address, b.units, b.available
+                                         FROM balance b
+                                         LEFT JOIN token t ON t.rowid = b.token''').fetchall())
+
+    def _migrate_snapshot(self, conn):
+        # bootstrapping from a snapshot
+        keys = conn.execute('''SELECT key FROM status''').fetchall()
+        self._init_status(conn, keys, 'snapshot') # height a snapshot was imported at (NULL if synced from the launch)
+
+    def _migrate_indexes(self, conn):
+        # indexes for the queries the sync and web API actually make (checked by `orbit-node sync plans`): open
+        #   advertisements by token, and registrations by advertisement and address; the ones on when rows were
+        #   updated haven't been read since the journal took over hashing, and only slowed down every write
+        conn.execute('''CREATE INDEX IF NOT EXISTS idx_advertisement_token ON advertisement (token, finished, begins)''')
+        conn.execute('''CREATE INDEX IF NOT EXISTS idx_registration_advertisement_address ON registration (advertisement, address)''')
+
+        for name in ('idx_registration_advertisement', 'idx_token_updated', 'idx_balance_updated', 'idx_transfer_created'):
+            conn.execute('''DROP INDEX IF EXISTS {}'''.format(name))
+
+    def _migrate_compact(self, conn):
+        # hashes and scripts as BLOBs instead of hex, and addresses interned in a dictionary that balances, transfers
+        #   and registrations refer to by rowid; rowids are kept, since other tables and the journal refer to them
+        conn.create_function('fromhex', 1, lambda value: bytes.fromhex(value) if value is not None else None,
+                deterministic=True)
+
+        conn.execute('''CREATE TABLE IF NOT EXISTS address (
+                            address TEXT NOT NULL PRIMARY KEY
+                        )''')
+
+        conn.execute('''INSERT OR IGNORE INTO address (address)
+                        SELECT address FROM balance
+                        UNION SELECT addr_from FROM transfer
+                        UNION SELECT addr_to FROM transfer
+                        UNION SELECT address FROM registration''')
+
+        self._rebuild(conn, 'block', '''hash BLOB NOT NULL PRIMARY KEY,
+                                        height INTEGER NOT NULL,
+                                        orbit BLOB''',
+                '''SELECT rowid, fromhex(hash), height, orbit FROM block''')
+        conn.execute('''CREATE INDEX IF NOT EXISTS idx_block_height ON block (height)''')
+
+        self._rebuild(conn, 'tx', '''hash BLOB NOT NULL PRIMARY KEY,
+                                     block INTEGER NOT NULL,
+                                     confirmations INTEGER NOT NULL''',
+                '''SELECT rowid, fromhex(hash), block, confirmations FROM tx''')
+
+        self._rebuild(conn, 'txin', '''hash BLOB NOT NULL PRIMARY KEY,
+                                       tx INTEGER NOT NULL,
+                                       script BLOB NOT NULL''',
+                '''SELECT rowid, fromhex(hash), tx, fromhex(asmhex) FROM txin''')
+        conn.execute('''CREATE INDEX IF NOT EXISTS idx_txin_tx ON txin (tx)''')
+
+        self._rebuild(conn, 'txout', '''tx INTEGER NOT NULL,
+                                        value INTEGER NOT NULL,
+                                        type TEXT NOT NULL,
+                                        addresses TEXT,
+                                        script BLOB NOT NULL''',
+                '''SELECT rowid, tx, value, type, addresses, fromhex(asmhex) FROM txout''')
+
+        self._rebuild(conn, 'balance', '''address INTEGER NOT NULL,
+                                          token INTEGER NOT NULL,
+                                          updated INTEGER NOT NULL,
+                                          units INTEGER NOT NULL,
+                                          available INTEGER NOT NULL,
+                                          PRIMARY KEY (address, token)''',
+                '''SELECT b.rowid, a.rowid, b.token, b.updated, b.units, b.available
+                   FROM balance b
+                   LEFT JOIN address a ON a.address = b.address''')
+
+        self._rebuild(conn, 'transfer', '''tx INTEGER NOT NULL PRIMARY KEY,
+                                           created INTEGER NOT NULL,
+                                           addr_from INTEGER NOT NULL,
+                                           addr_to INTEGER NOT NULL,
+                                           units INTEGER''',
+                '''SELECT t.rowid, t.tx, t.created, f.rowid, o.rowid, t.units
+                   FROM transfer t
+                   LEFT JOIN address f ON f.address = t.addr_from
+                   LEFT JOIN address o ON o.address = t.addr_to''')
+
+        self._rebuild(conn, 'registration', '''tx INTEGER NOT NULL PRIMARY KEY,
+                                               address INTEGER NOT NULL,
+                                               advertisement INTEGER NOT NULL,
+                                               created INTEGER NOT NULL,
+                                               updated INTEGER NOT NULL,
+                                               finished INTEGER,
+                                               maximum INTEGER NOT NULL,
+                                               payments INTEGER NOT NULL,
+                                               claimed INTEGER NOT NULL''',
+                '''SELECT r.rowid, r.tx, a.rowid, r.advertisement, r.created, r.updated, r.finished, r.maximum,
+                       r.payments, r.claimed
+                   FROM registration r
+                   LEFT JOIN address a ON a.address = r.address''')
+        conn.execute('''CREATE INDEX IF NOT EXISTS idx_registration_advertisement_address ON registration (advertisement, address)''')
+
+        self._create_indexes(conn)
+
+        # state table rows as they are hashed, which is how they were stored before: the orbit hash stays the
+        #   same whatever the layout (see _hash_changed() and audit_blocks())
+        for table in ('token', 'advertisement'):
+            conn.execute('''CREATE VIEW IF NOT EXISTS hashed_{0} AS
+                            SELECT rowid AS row, * FROM {0}'''.format(table))
+
+        conn.execute('''CREATE VIEW IF NOT EXISTS hashed_balance AS
+                        SELECT b.rowid AS row, a.address, b.token, b.updated, b.units, b.available
+                        FROM balance b
+                        LEFT JOIN address a ON a.rowid = b.address''')
+
+        conn.execute('''CREATE VIEW IF NOT EXISTS hashed_transfer AS
+                        SELECT t.rowid AS row, t.tx, t.created, f.address AS addr_from, o.address AS addr_to, t.units
+                        FROM transfer t
+                        LEFT JOIN address f ON f.rowid = t.addr_from
+                        LEFT JOIN address o ON o.rowid = t.addr_to''')
+
+        conn.execute('''CREATE VIEW IF NOT EXISTS hashed_registration AS
+                        SELECT r.rowid AS row, r.tx, a.address, r.advertisement, r.created, r.updated, r.finished,
+                            r.maximum, r.payments, r.claimed
+                        FROM registration r
+                        LEFT JOIN address a ON a.rowid = r.address''')
+
+        # dropped along with the tables they were on
+        self._create_triggers(conn)
+
+    @classmethod
+    def _rebuild(self, conn, table, columns, select):
+        # SQLite can't change column types in place, so the rows are copied to a new table that takes the old one's
+        #   name; select gives the rowid followed by each column
+        conn.execute('''CREATE TABLE {}_new ({})'''.format(table, columns))
+
+        names = [ col[1] for col in conn.execute('''PRAGMA table_info({}_new)'''.format(table)) ]
+
+        conn.execute('''INSERT INTO {}_new (rowid, {}) {}'''.format(table, ', '.join(names), select))
+        conn.execute('''DROP TABLE {}'''.format(table))
+        conn.execute('''ALTER TABLE {0}_new RENAME TO {0}'''.format(table))
+
+    def _migrate_state_digest(self, conn):
+        # a digest of every state row after each block, kept alongside the state root (see _state_digest())
+        digested = conn.execute('''SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'state_row' ''').fetchone()
+
+        conn.execute('''CREATE TABLE IF NOT EXISTS state_row (
+                            tbl TEXT NOT NULL,
+                            row INTEGER NOT NULL,
+                            digest BLOB NOT NULL,
+                            PRIMARY KEY (tbl, row)
+                        ) WITHOUT ROWID''')
+
+        if not any(col[1] == 'state' for col in conn.execute('''PRAGMA table_info(state_root)''')):
+            conn.execute('''ALTER TABLE state_root ADD COLUMN state BLOB''')
+
+        if not digested:
+            # only the last block hashed has its state any more; earlier blocks go without
+            state = self._build_state_rows(conn.cursor())
+
+            conn.execute('''UPDATE state_root
+                            SET state = ?
+                            WHERE block = (SELECT rowid FROM block WHERE orbit IS NOT NULL ORDER BY height DESC LIMIT 1)''',
+                            (sqlite3.Binary(state),))
+
+    def _open(self, conn, checkpoint=0):
         self.conn = conn
 
+        self.checkpoint = checkpoint
+        self.commits = 0
+
+        self._reset_overlay()
+        self.registrations = None # see get_active_registrations_map()
+        self._reset_schedule()
+
     @classmethod
     def _init_status(self, conn, keys, key):
         for k in keys:
@@ -141,9 +533,141 @@ class TokenDB:
 
         conn.execute('''INSERT INTO status (key) VALUES (?)''', (key,))
 
+    @classmethod
+    def _create_indexes(self, conn):
+        for name, on in self.DEFERRABLE_INDEXES.items():
+            conn.execute('''CREATE INDEX IF NOT EXISTS {} ON {}'''.format(name, on))
+
+    @classmethod
+    def _create_triggers(self, conn):
+        for table, block in self.JOURNALED:
+            for change in ('insert', 'update'):
+                conn.execute('''CREATE TRIGGER IF NOT EXISTS journal_{0}_{1} AFTER {2} ON {0}
+                                BEGIN
+                                    INSERT INTO journal (block, tbl, row, change) VALUES (NEW.{3}, '{0}', NEW.rowid, '{1}');
+                                END'''.format(table, change, change.upper(), block))
+
+    def pause_journal(self):
+        # for loading rows that aren't changes made by a block (e.g. a snapshot); resume_journal() must follow
+        #   within the same transaction
+        for table, block in self.JOURNALED:
+            for change in ('insert', 'update'):
+                self.conn.execute('''DROP TRIGGER IF EXISTS journal_{}_{}'''.format(table, change))
+
+    def resume_journal(self):
+        self._create_triggers(self.conn)
+
+    def get_missing_indexes(self):
+        existing = { row[0] for row in self.conn.execute('''SELECT name FROM sqlite_master WHERE type = 'index' ''') }
+
+        return [ name for name in self.DEFERRABLE_INDEXES if name not in existing ]
+
+    def build_index(self):
+        # builds one missing index and returns its name (None if there are none); this holds the write lock
+        #   for as long as it takes but readers carry on, so the sync daemon calls it whenever it is idle
+        missing = self.get_missing_indexes()
+        if not missing:
+            return None
+
+        name = missing[0]
+
+        self.conn.commit()
+        self.conn.execute('''CREATE INDEX IF NOT EXISTS {} ON {}'''.format(name, self.DEFERRABLE_INDEXES[name]))
+        self.conn.commit()
+
+        return name
+
+    def begin_bulk(self):
+        # trade durability for speed while far behind the chain tip; an interrupted bulk sync loses only
+        #   uncommitted blocks, and the dropped indexes are rebuilt by the next bulk sync or build_index()
+        self.conn.commit()
+
+        for name in self.DEFERRABLE_INDEXES:
+            self.conn.execute('''DROP INDEX IF EXISTS {}'''.format(name))
+
+        self.conn.execute('''PRAGMA synchronous = OFF''')
+        self.conn.execute('''PRAGMA temp_store = MEMORY''')
+        self.conn.execute('''PRAGMA cache_size = -262144''') # 256 MiB
+
+    def end_bulk(self):
+        self.conn.commit()
+
+        self._create_indexes(self.conn)
+
+        self.conn.execute('''PRAGMA synchronous = FULL''')
+        self.conn.execute('''PRAGMA temp_store = DEFAULT''')
+        self.conn.execute('''PRAGMA cache_size = -2000''')
+
+        self.conn.commit()
+
+        # a bulk sync leaves a long log behind
+        self.checkpoint_wal()
+
     def commit(self):
+        self.flush()
         self.conn.commit()
 
+        self.commits += 1
+        if self.checkpoint and self.commits % self.checkpoint == 0:
+            self.checkpoint_wal()
+
+    def checkpoint_wal(self):
+        # copies committed pages from the write-ahead log into the database without waiting for readers, which
+        #   lets the log start over once none of them still need it; returns (busy, log pages, checkpointed pages)
+        return self.conn.execute('''PRAGMA wal_checkpoint(PASSIVE)''').fetchone()
+
+    def rollback(self):
+        self._reset_overlay()
+        self.registrations = None
+        self._reset_schedule()
+        self.conn.rollback()
+
+    def _reset_overlay(self):
+        # state read or changed while processing a block, kept in memory until flush()
+        self.heights = {}       # block rowid -> height
+        self.tokenrows = {}     # token address -> rowid
+        self.eligible = {}      # (token rowid, height) -> eligible advertisement rowid
+        self.balances = {}      # (token rowid, address) -> [rowid, updated, units, available], or None if there is none
+        self.balances_changed = {}  # keys of balances updated, in order (a dict) so they're journaled the same each run
+        self.balances_new = []  # keys of balances created, in order so they get the same rowids as immediate inserts
+        self.transfers = []
+
+    def flush(self):
+        # writes the balances and events accumulated for the block; anything reading those tables with SQL
+        #   (e.g. hash()) must come after this
+        cursor = self.conn.cursor()
+
+        balances = self.balances
+
+        if self.balances_changed:
+            cursor.executemany('''UPDATE balance
+                                  SET updated = ?, units = ?, available = ?
+                                  WHERE rowid = ?''',
+                                  [ balances[key][1:] + balances[key][:1] for key in self.balances_changed ])
+
+        if self.balances_new:
+            self._intern(cursor, [ key[1] for key in self.balances_new ])
+
+            cursor.executemany('''INSERT INTO balance
+                                  (address, token, updated, units, available)
+                                  VALUES ((SELECT rowid FROM address WHERE address = ?), ?, ?, ?, ?)''',
+                                  [ (key[1], key[0]) + tuple(balances[key][1:]) for key in self.balances_new ])
+
+        if self.transfers:
+            # every address given a balance above already
+            cursor.executemany('''INSERT INTO transfer
+                                  (tx, created, addr_from, addr_to, units)
+                                  VALUES (?, ?, (SELECT rowid FROM address WHERE address = ?),
+                                      (SELECT rowid FROM address WHERE address = ?), ?)''',
+                                  self.transfers)
+
+        self._reset_overlay()
+
+    def _intern(self, cursor, addresses):
+        # adds any of the addresses not yet in the address dictionary; rows refer to them by its rowid
+        cursor.executemany('''INSERT OR IGNORE INTO address (address) VALUES (?)''',
+                           [ (address,) for address in addresses ])
+
     def close(self):
         self.conn.close()
 
@@ -168,7 +692,9 @@ class TokenDB:
         cursor.execute('''INSERT INTO block
                           (hash, height)
                           VALUES (?, ?)''',
-                          (blockhash, height))
+                          (bytes.fromhex(blockhash), height))
+
+        self.heights[cursor.lastrowid] = height
         return cursor.lastrowid
 
     def save_tx(self, txhash, block, confirmations):
@@ -176,45 +702,69 @@ class TokenDB:
         cursor.execute('''INSERT INTO tx
                           (hash, block, confirmations)
                           VALUES (?, ?, ?)''',
-                          (txhash, block, confirmations))
+                          (bytes.fromhex(txhash), block, confirmations))
         return cursor.lastrowid
 
     def save_txin(self, txhash, tx, asmhex):
         cursor = self.conn.cursor()
         cursor.execute('''INSERT INTO txin
-                          (hash, tx, asmhex)
+                          (hash, tx, script)
                           VALUES (?, ?, ?)''',
-                          (txhash, tx, asmhex))
+                          (bytes.fromhex(txhash), tx, bytes.fromhex(asmhex)))
         return cursor.lastrowid
 
     def save_txout(self, tx, value, stype, addresses, asmhex):
         cursor = self.conn.cursor()
         cursor.execute('''INSERT INTO txout
-                          (tx, value, type, addresses, asmhex)
+                          (tx, value, type, addresses, script)
                           VALUES (?, ?, ?, ?, ?)''',
-                          (tx, value, stype, addresses, asmhex))
+                          (tx, value, stype, addresses, bytes.fromhex(asmhex)))
         return cursor.lastrowid
 
-    def get_signer_address(self, txrow):
-        txins = self.conn.execute('''SELECT asmhex FROM txin WHERE tx = ?''', (txrow,)).fetchall()
-        address = None
+    def get_blocks(self):
+        return self.conn.execute('''SELECT rowid, height FROM block ORDER BY height''').fetchall()
+
+    def get_orbits(self):
+        return { row[0]: row[1] for row in self.conn.execute('''SELECT height, orbit FROM block''') }
+
+    # stored transactions are read back in hex, as bitcoind gives them
+
+    def get_txs(self, blockrow):
+        return self.conn.execute('''SELECT rowid, lower(hex(hash)), confirmations FROM tx
+                                    WHERE block = ?
+                                    ORDER BY rowid''',
+                                    (blockrow,)).fetchall()
 
-        for txin in txins:
-            asmhex = txin[0]
-            asm = bytes.fromhex(asmhex)
+    def get_txins(self, txrow):
+        return self.conn.execute('''SELECT lower(hex(hash)), lower(hex(script)) FROM txin
+                                    WHERE tx = ?
+                                    ORDER BY rowid''',
+                                    (txrow,)).fetchall()
 
-            sig_size = int.from_bytes(asm[0:1], 'little')
-            pubkey_size = int.from_bytes(asm[sig_size+1:sig_size+2], 'little')
-            pubkey = asm[sig_size + 2 : sig_size + pubkey_size + 2]
-            pubkey_address = public_key_to_address(pubkey)
+    def get_txouts(self, txrow):
+        return self.conn.execute('''SELECT value, type, addresses, lower(hex(script)) FROM txout
+                                    WHERE tx = ?
+                                    ORDER BY rowid''',
+                                    (txrow,)).fetchall()
 
-            if not address:
-                address = pubkey_address
+    def reset_state(self):
+        # forgets all token state and the orbit hash chain while keeping the blocks and transactions they
+        #   were derived from; the tables are emptied so replayed rows get the same rowids as before
+        self._reset_overlay()
+        self.registrations = None
+        self._reset_schedule()
 
-            elif address != pubkey_address:
-                raise ValueError("Multiple signer keys are present in the transaction inputs")
+        for table in ('token', 'balance', 'transfer', 'advertisement', 'registration', 'schedule', 'journal',
+                'state_leaf', 'state_node', 'state_root', 'state_row'):
+            self.conn.execute('''DELETE FROM {}'''.format(table))
 
-        return address
+        self.conn.execute('''UPDATE block SET orbit = NULL''')
+        self._set_status('journal', None)
+
+    def get_signer_address(self, txrow):
+        txins = self.conn.execute('''SELECT script FROM txin WHERE tx = ?''', (txrow,)).fetchall()
+
+        return signer_address(txin[0] for txin in txins)
 
     def token_create(self, address, tx, block, supply, decimals, symbol, name=None, main_uri=None, image_uri=None):
         cursor = self.conn.cursor()
@@ -228,31 +778,82 @@ class TokenDB:
         except sqlite3.IntegrityError as e:
             raise TokenError("A token is already defined at this address: {}".format(e))
 
+        self.tokenrows[address] = tokenrow
+
         # no try/except here... it's a critical error to be able to insert a token yet already have a blance for it
-        cursor.execute('''INSERT INTO balance
-                          (address, token, updated, units, available)
-                          VALUES (?, ?, ?, ?, ?)''',
-                          (address, tokenrow, block, supply, supply))
+        self._insert_balance(cursor, tokenrow, address, block, supply, supply)
 
         return tokenrow
 
+    def _get_height(self, cursor, blockrow):
+        try:
+            return self.heights[blockrow]
+        except KeyError:
+            height = cursor.execute('''SELECT height FROM block WHERE rowid = ?''', (blockrow,)).fetchone()[0]
+            self.heights[blockrow] = height
+            return height
+
     def _get_tokenrow(self, cursor, address):
+        try:
+            return self.tokenrows[address]
+        except KeyError:
+            pass
+
         token = cursor.execute('''SELECT rowid FROM token WHERE address = ?''', (address,)).fetchone()
 
         if token is None:
             raise TokenError("No token defined at the specified address")
 
+        self.tokenrows[address] = token[0]
         return token[0]
 
-    def _get_balance(self, cursor, tokenrow, address, total=False):
-        balance = cursor.execute('''SELECT units, available FROM balance
-                                    WHERE token = ? AND address = ?''',
+    def _balance(self, cursor, tokenrow, address):
+        key = (tokenrow, address)
+
+        try:
+            return self.balances[key]
+        except KeyError:
+            pass
+
+        balance = cursor.execute('''SELECT rowid, updated, units, available FROM balance
+                                    WHERE token = ? AND address = (SELECT rowid FROM address WHERE address = ?)''',
                                     (tokenrow, address)).fetchone()
 
+        if balance:
+            balance = list(balance)
+
+        self.balances[key] = balance
+        return balance
+
+    def _get_balance(self, cursor, tokenrow, address, total=False):
+        balance = self._balance(cursor, tokenrow, address)
+
         if not balance:
             return None
 
-        return balance[0] if total else balance[1]
+        return balance[2] if total else balance[3]
+
+    def _insert_balance(self, cursor, tokenrow, address, blockrow, units, available):
+        if self._balance(cursor, tokenrow, address):
+            raise sqlite3.IntegrityError("UNIQUE constraint failed: balance.address, balance.token")
+
+        key = (tokenrow, address)
+        self.balances[key] = [None, blockrow, units, available]
+        self.balances_new.append(key)
+
+    def _update_balance(self, cursor, tokenrow, address, blockrow, units, available):
+        # adds to an existing balance; as with an UPDATE, nothing changes when there is none
+        balance = self._balance(cursor, tokenrow, address)
+
+        if not balance:
+            return
+
+        balance[1] = blockrow
+        balance[2] += units
+        balance[3] += available
+
+        if balance[0] is not None:
+            self.balances_changed[(tokenrow, address)] = None
 
     def token_transfer(self, address, txrow, blockrow, from_address, to_address, units):
         cursor = self.conn.cursor()
@@ -272,34 +873,22 @@ class TokenDB:
             raise TokenError("Insufficient available balance for this transfer")
 
         # update source balance
-        cursor.execute('''UPDATE balance
-                          SET updated = ?, units = units - ?, available = available - ?
-                          WHERE token = ? AND address = ?''',
-                          (blockrow, units, units, tokenrow, from_address))
+        self._update_balance(cursor, tokenrow, from_address, blockrow, -units, -units)
 
 
         # update destination balance
         balance = self._get_balance(cursor, tokenrow, to_address)
 
         if balance is None:
-            cursor.execute('''INSERT INTO balance
-                              (address, token, updated, units, available)
-                              VALUES (?, ?, ?, ?, ?)''',
-                              (to_address, tokenrow, blockrow, units, units))
+            self._insert_balance(cursor, tokenrow, to_address, blockrow, units, units)
 
         else:
-            cursor.execute('''UPDATE balance
-                              SET updated = ?, units = units + ?, available = available + ?
-                              WHERE token = ? AND address = ?''',
-                              (blockrow, units, units, tokenrow, to_address))
+            self._update_balance(cursor, tokenrow, to_address, blockrow, units, units)
  
         # save transfer event
-        cursor.execute('''INSERT INTO transfer
-                          (tx, created, addr_from, addr_to, units)
-                          VALUES (?, ?, ?, ?, ?)''',
-                          (txrow, blockrow, from_address, to_address, units))
+        self.transfers.append((txrow, blockrow, from_address, to_address, units))
 
-        return cursor.lastrowid
+        return txrow
 
     def token_advertise(self, address, txrow, blockrow, exchange_rate=None, units_avail=None, units_min=None, units_max=None,
             block_begin=None, block_end=None, block_deliver=None, preregister=False):
@@ -307,7 +896,7 @@ class TokenDB:
         cursor = self.conn.cursor()
 
         tokenrow = self._get_tokenrow(cursor, address)
-        height = cursor.execute('''SELECT height FROM block WHERE rowid = ?''', (blockrow,)).fetchone()[0]
+        height = self._get_height(cursor, blockrow)
 
         # block validation
 
@@ -380,12 +969,10 @@ class TokenDB:
         else:
             units_max = units_avail
 
-        cursor.execute('''UPDATE balance
-                          SET updated = ?, available = available - ?
-                          WHERE token = ? AND address = ?''',
-                          (blockrow, units_avail, tokenrow, address))
+        self._update_balance(cursor, tokenrow, address, blockrow, 0, -units_avail)
 
         # save advertise event
+        self.eligible.clear()
  
         cursor.execute('''INSERT INTO advertisement
                           (tx, token, created, updated, begins, ends, delivers, available, dispensed,
@@ -394,8 +981,16 @@ class TokenDB:
                           (txrow, tokenrow, blockrow, blockrow, block_begin, block_end, block_deliver,
                               units_avail, 0, units_min, units_max,
                               'Y' if preregister else None))
+        rowid = cursor.lastrowid
 
-        return cursor.lastrowid
+        self._schedule(cursor, block_deliver, rowid, self.DELIVER)
+        if block_end:
+            self._schedule(cursor, block_end, rowid, self.END)
+
+        # may have nothing available at all
+        self.claimed.add(rowid)
+
+        return rowid
 
     def token_advertise_cancel(self, address, txrow, blockrow, txhash):
         cursor = self.conn.cursor()
@@ -404,6 +999,11 @@ class TokenDB:
 
         # validate advertisement
 
+        try:
+            txhash = bytes.fromhex(txhash)
+        except ValueError:
+            raise TokenError("No advertisement exists for the given tx hash")
+
         advertisement = cursor.execute('''SELECT a.rowid, a.token, a.finished, a.available, a.claimed
                                           FROM tx
                                           LEFT JOIN advertisement a ON a.tx = tx.rowid
@@ -440,14 +1040,18 @@ class TokenDB:
                           WHERE rowid = ?''',
                           (blockrow, blockrow, advertisement[0]))
 
-        cursor.execute('''UPDATE balance
-                          SET updated = ?, available = available + ?
-                          WHERE token = ? AND address = ?''',
-                          (blockrow, advertisement[3], tokenrow, address))
+        self._update_balance(cursor, tokenrow, address, blockrow, 0, advertisement[3])
+        self.eligible.clear()
+        self._advertisement_finished(advertisement[0])
 
         return advertisement[0]
 
     def get_eligible_advertisement_row(self, cursor, tokenrow, height):
+        try:
+            return self.eligible[(tokenrow, height)]
+        except KeyError:
+            pass
+
         advertisement = None
 
         advertisements = cursor.execute('''SELECT rowid FROM advertisement
@@ -477,16 +1081,17 @@ class TokenDB:
         if not advertisement:
             raise TokenError("There is no active advertisement or future advertisement allowing preregistration")
 
+        self.eligible[(tokenrow, height)] = advertisement[0]
         return advertisement[0]
 
     def token_register(self, address, txrow, blockrow, user_address, units_max=None):
         cursor = self.conn.cursor()
 
         tokenrow = self._get_tokenrow(cursor, address)
-        height = cursor.execute('''SELECT height FROM block WHERE rowid = ?''', (blockrow,)).fetchone()[0]
+        height = self._get_height(cursor, blockrow)
         advertisement = self.get_eligible_advertisement_row(cursor, tokenrow, height)
 
-        advertisement = cursor.execute('''SELECT rowid, minimum, maximum, rate, available, claimed, delivers
+        advertisement = cursor.execute('''SELECT rowid, minimum, maximum, rate, available, claimed, delivers, begins
                                           FROM advertisement
                                           WHERE rowid = ?''',
                                           (advertisement,)).fetchone()
@@ -496,7 +1101,7 @@ class TokenDB:
 
         registrations = cursor.execute('''SELECT SUM(maximum)
                                           FROM registration
-                                          WHERE address = ? and advertisement = ?''',
+                                          WHERE address = (SELECT rowid FROM address WHERE address = ?) and advertisement = ?''',
                                           (user_address, advertisement[0])).fetchone()
 
         max_remains = advertisement[2]
@@ -519,57 +1124,53 @@ class TokenDB:
             # note that if height == delivers then process_advertisements() will make the units available
 
             # update source balance
-            cursor.execute('''UPDATE balance
-                              SET updated = ?, units = units - ?
-                              WHERE token = ? AND address = ?''',
-                              (blockrow, units, tokenrow, address))
+            self._update_balance(cursor, tokenrow, address, blockrow, -units, 0)
 
             # update destination balance
             balance = self._get_balance(cursor, tokenrow, user_address)
 
             if balance is None:
-                cursor.execute('''INSERT INTO balance
-                                  (address, token, updated, units, available)
-                                  VALUES (?, ?, ?, ?, ?)''',
-                                  (user_address, tokenrow, blockrow, units, units if available else 0))
+                self._insert_balance(cursor, tokenrow, user_address, blockrow, units, units if available else 0)
 
             else:
-                cursor.execute('''UPDATE balance
-                                  SET updated = ?, units = units + ?, available = available + ?
-                                  WHERE token = ? AND address = ?''',
-                                  (blockrow, units, units if available else 0, tokenrow, user_address))
+                self._update_balance(cursor, tokenrow, user_address, blockrow, units, units if available else 0)
 
             cursor.execute('''UPDATE advertisement
                               SET updated = ?, claimed = claimed + ?
                               WHERE rowid = ?''',
                               (blockrow, units, advertisement[0]))
+            self.claimed.add(advertisement[0])
  
             # save transfer event
-            cursor.execute('''INSERT INTO transfer
-                              (tx, created, addr_from, addr_to, units)
-                              VALUES (?, ?, ?, ?, ?)''',
-                              (txrow, blockrow, address, user_address, units))
+            self.transfers.append((txrow, blockrow, address, user_address, units))
 
         else:
             units = 0
 
+        self._intern(cursor, [ user_address ])
+
         cursor.execute('''INSERT INTO registration
                           (tx, address, advertisement, created, updated, finished, maximum, payments, claimed)
-                          VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                          VALUES (?, (SELECT rowid FROM address WHERE address = ?), ?, ?, ?, ?, ?, ?, ?)''',
                           (txrow, user_address, advertisement[0], blockrow, blockrow,
                               blockrow if advertisement[3] else None, units_max, 0, units))
+        rowid = cursor.lastrowid
 
-        return cursor.lastrowid
+        if not advertisement[3]:
+            self._registration_opened(rowid, address, user_address, advertisement[0], advertisement[7])
+
+        return rowid
 
     def token_unregister(self, address, txrow, blockrow, user_address):
         cursor = self.conn.cursor()
 
         tokenrow = self._get_tokenrow(cursor, address)
-        height = cursor.execute('''SELECT height FROM block WHERE rowid = ?''', (blockrow,)).fetchone()[0]
+        height = self._get_height(cursor, blockrow)
         advertisement = self.get_eligible_advertisement_row(cursor, tokenrow, height)
 
         registrations = cursor.execute('''SELECT rowid, token FROM registration
-                                          WHERE address = ? AND advertisement = ? AND finished IS NULL''',
+                                          WHERE address = (SELECT rowid FROM address WHERE address = ?)
+                                              AND advertisement = ? AND finished IS NULL''',
                                           (user_address, advertisement)).fetchall()
 
         if not registrations:
@@ -588,47 +1189,103 @@ class TokenDB:
                           WHERE rowid = ?''',
                           (blockrow, blockrow, registration[0]))
 
+        self._registration_finished(registration[0])
+
         return registration[0]
 
     def get_active_registrations_map(self, blockrow):
+        # token address -> { user address -> registration rowid } for the registrations open at the block,
+        #   from an index loaded once and kept current by the operations that change registrations;
+        #   callers get their own copy, which they may add to for the rest of the block
         cursor = self.conn.cursor()
 
-        height = cursor.execute('''SELECT height FROM block WHERE rowid = ?''', (blockrow,)).fetchone()[0]
+        height = self._get_height(cursor, blockrow)
+
+        if self.registrations is None:
+            self._load_registrations(cursor)
+
+        if self.registrations_map is None or not (self.registrations_from <= height < self.registrations_until):
+            # rebuilt only after a change, or once a known advertisement begins
+            until = float('inf')
+            active = []
+
+            for rowid, (token, address, advertisement, begins) in self.registrations.items():
+                if begins <= height:
+                    active.append((token, address, rowid))
+                elif begins < until:
+                    until = begins
+
+            self.registrations_map = self._map_registrations(active)
+            self.registrations_from = height
+            self.registrations_until = until
+
+        if config.debug:
+            registrations = cursor.execute('''SELECT t.address, u.address, r.rowid
+                                              FROM registration r
+                                              LEFT JOIN address u ON u.rowid = r.address
+                                              LEFT JOIN advertisement a ON a.rowid = r.advertisement
+                                              LEFT JOIN token t ON t.rowid = a.token
+                                              WHERE r.finished IS NULL AND a.finished IS NULL AND a.begins <= ?''',
+                                              (height,)).fetchall()
+
+            if self._map_registrations(registrations) != self.registrations_map:
+                raise ValueError('Active registration index does not match the database at height {}'.format(height))
+
+        return { token: dict(records) for token, records in self.registrations_map.items() }
 
-        registrations = cursor.execute('''SELECT t.address, r.address, r.rowid
+    def _map_registrations(self, registrations):
+        reg_map = {}
+
+        for registration in registrations:
+            try:
+                records = reg_map[registration[0]]
+            except KeyError:
+                records = {}
+                reg_map[registration[0]] = records
+
+            if registration[1] in records:
+                raise ValueError('Already have an active registration for this user and token')
+
+            records[registration[1]] = registration[2]
+
+        return reg_map
+
+    def _load_registrations(self, cursor):
+        # every open registration of an open advertisement, whether or not it has begun
+        registrations = cursor.execute('''SELECT r.rowid, t.address, u.address, a.rowid, a.begins
                                           FROM registration r
+                                          LEFT JOIN address u ON u.rowid = r.address
                                           LEFT JOIN advertisement a ON a.rowid = r.advertisement
                                           LEFT JOIN token t ON t.rowid = a.token
-                                          WHERE r.finished IS NULL AND a.finished IS NULL AND a.begins <= ?''',
-                                          (height,)).fetchall()
+                                          WHERE r.finished IS NULL AND a.finished IS NULL''').fetchall()
 
-        reg_map = {}
+        self.registrations = { registration[0]: registration[1:] for registration in registrations }
+        self.registrations_map = None
 
-        if registrations:
-            for registration in registrations:
-                try:
-                    records = reg_map[registration[0]]
-                except AttributeError:
-                    records = {}
-                    reg_map[registration[0]] = records
-
-                try:
-                    rowid = records[registration[1]]
-                    raise ValueError('Already have an active registration for this user and token')
-                except AttributeError:
-                    records[registration[1]] = registration[2]
+    def _registration_opened(self, rowid, token, address, advertisement, begins):
+        if self.registrations is not None:
+            self.registrations[rowid] = (token, address, advertisement, begins)
+            self.registrations_map = None
 
-        return reg_map
+    def _registration_finished(self, rowid):
+        if self.registrations is not None and self.registrations.pop(rowid, None):
+            self.registrations_map = None
+
+    def _advertisement_finished(self, advertisement):
+        if self.registrations is not None:
+            for rowid in [ rowid for rowid, registration in self.registrations.items() if registration[2] == advertisement ]:
+                self._registration_finished(rowid)
 
     def registration_payment(self, txrow, blockrow, rowid, value):
         cursor = self.conn.cursor()
 
-        height = cursor.execute('''SELECT height FROM block WHERE rowid = ?''', (blockrow,)).fetchone()[0]
+        height = self._get_height(cursor, blockrow)
 
-        details = cursor.execute('''SELECT r.address, r.maximum, r.payments, r.claimed,
+        details = cursor.execute('''SELECT u.address, r.maximum, r.payments, r.claimed,
                                         a.rowid, a.delivers, a.available, a.claimed, a.rate, a.minimum, a.maximum,
-                                        t.rowid, t.address
+                                        t.rowid, t.address, r.address
                                     FROM registration r
+                                    LEFT JOIN address u ON u.rowid = r.address
                                     LEFT JOIN advertisement a ON a.rowid = r.advertisement
                                     LEFT JOIN token t ON t.rowid = a.token
                                     WHERE r.rowid = ?''',
@@ -637,7 +1294,7 @@ class TokenDB:
         claimed = cursor.execute('''SELECT SUM(claimed)
                                     FROM registration
                                     WHERE address = ? AND advertisement = ? AND rowid <> ?''',
-                                    (details[0], details[4], rowid)).fetchone()[0]
+                                    (details[13], details[4], rowid)).fetchone()[0]
 
         ad_remaining = details[6] - details[7]
         user_remaining = details[10] - claimed - details[3]
@@ -673,31 +1330,19 @@ class TokenDB:
             # note that if height == delivers then process_advertisements() will make the units available
 
             # update source balance
-            cursor.execute('''UPDATE balance
-                              SET updated = ?, units = units - ?
-                              WHERE token = ? AND address = ?''',
-                              (blockrow, units, details[11], details[12]))
+            self._update_balance(cursor, details[11], details[12], blockrow, -units, 0)
 
             # update destination balance
             balance = self._get_balance(cursor, details[11], details[0])
 
             if balance is None:
-                cursor.execute('''INSERT INTO balance
-                                  (address, token, updated, units, available)
-                                  VALUES (?, ?, ?, ?, ?)''',
-                                  (details[0], details[11], blockrow, units, units if available else 0))
+                self._insert_balance(cursor, details[11], details[0], blockrow, units, units if available else 0)
 
             else:
-                cursor.execute('''UPDATE balance
-                                  SET updated = ?, units = units + ?, available = available + ?
-                                  WHERE token = ? AND address = ?''',
-                                  (blockrow, units, units if available else 0, details[11], details[0]))
+                self._update_balance(cursor, details[11], details[0], blockrow, units, units if available else 0)
  
             # save transfer event
-            cursor.execute('''INSERT INTO transfer
-                              (tx, created, addr_from, addr_to, units)
-                              VALUES (?, ?, ?, ?, ?)''',
-                              (txrow, blockrow, details[12], details[0], units))
+            self.transfers.append((txrow, blockrow, details[12], details[0], units))
 
             finished = (units == (details[1] - details[3]))
 
@@ -706,59 +1351,104 @@ class TokenDB:
                               WHERE rowid = ?''',
                               (blockrow, blockrow if finished else None, payments, units, rowid))
 
+            if finished:
+                self._registration_finished(rowid)
+
             cursor.execute('''UPDATE advertisement
                               SET updated = ?, claimed = claimed + ?
                               WHERE rowid = ?''',
                               (blockrow, units, details[4]))
+            self.claimed.add(details[4])
+
+    def _reset_schedule(self):
+        self.schedule = None    # heap of (height, advertisement rowid, event) still to come, loaded when first needed
+        self.claimed = set()    # advertisements created or claimed from in this block, which may now be fully claimed
+
+    def _schedule(self, cursor, height, advertisement, event):
+        cursor.execute('''INSERT INTO schedule
+                          (height, advertisement, event)
+                          VALUES (?, ?, ?)''',
+                          (height, advertisement, event))
+
+        if self.schedule is not None:
+            heappush(self.schedule, (height, advertisement, event))
+
+    def _due(self, cursor, height):
+        # the advertisements to deliver and to end at this height
+        if self.schedule is None:
+            self.schedule = cursor.execute('''SELECT height, advertisement, event FROM schedule
+                                              WHERE height >= ?''',
+                                              (height,)).fetchall()
+            heapify(self.schedule)
+
+        deliveries = []
+        endings = []
+
+        while self.schedule and self.schedule[0][0] <= height:
+            due, advertisement, event = heappop(self.schedule)
+
+            if due == height:
+                (deliveries if event == self.DELIVER else endings).append(advertisement)
+
+        return deliveries, endings
 
     def process_advertisements(self, blockrow):
+        # only advertisements with a delivery or ending scheduled at this height, or claimed from in this block,
+        #   have anything to do
+        #
+        # consensus rules since the schedule (pinned by tests/test_advertisements.py): units are delivered at the
+        #   block whose height is the delivery height, where the query before compared it to the block rowid and
+        #   so practically never delivered; and only unfinished advertisements are closed, where the query before
+        #   also closed a finished one again when its ending height came
         cursor = self.conn.cursor()
 
-        height = cursor.execute('''SELECT height FROM block WHERE rowid = ?''', (blockrow,)).fetchone()[0]
-
-        deliveries = cursor.execute('''SELECT rowid, token
-                                       FROM advertisement
-                                       WHERE delivers = ?''',
-                                       (blockrow,)).fetchall()
-
-        if deliveries:
-            for delivery in deliveries:
-                registrations = cursor.execute('''SELECT rowid, address, claimed
-                                                  FROM registration
-                                                  WHERE advertisement = ?
-                                                  ORDER BY address''',
-                                                  (delivery[0],)).fetchall()
-
-                if registrations:
-                    last_address = None
-                    user_claimed = 0
-
-                    for registration in registrations:
-                        if last_address is None:
-                            last_address = registration[1]
-
-                        if last_address == registration[1]:
-                            user_claimed += registration[2]
-                        else:
-                            cursor.execute('''UPDATE balance
-                                              SET updated = ?, available = available + ?
-                                              WHERE token = ? AND address = ?''',
-                                              (blockrow, user_claimed, delivery[1], last_address))
-
-                            last_address = registration[1]
-                            user_claimed = registration[2]
-
-                    cursor.execute('''UPDATE balance
-                                      SET updated = ?, available = available + ?
-                                      WHERE token = ? AND address = ?''',
-                                      (blockrow, user_claimed, delivery[1], last_address))
-
-        ads_to_close = cursor.execute('''SELECT a.rowid, a.available - a.claimed,
-                                             t.rowid, t.address
-                                         FROM advertisement a
-                                         LEFT JOIN token t ON t.rowid = a.token
-                                         WHERE a.finished IS NULL AND a.claimed = a.available OR a.ends = ?''',
-                                         (height,)).fetchall()
+        height = self._get_height(cursor, blockrow)
+
+        deliveries, endings = self._due(cursor, height)
+
+        for advertisement in deliveries:
+            tokenrow = cursor.execute('''SELECT token FROM advertisement WHERE rowid = ?''', (advertisement,)).fetchone()[0]
+
+            # in the order of the addresses themselves, not their rowids in the address dictionary
+            registrations = cursor.execute('''SELECT r.rowid, u.address, r.claimed
+                                              FROM registration r
+                                              LEFT JOIN address u ON u.rowid = r.address
+                                              WHERE r.advertisement = ?
+                                              ORDER BY u.address''',
+                                              (advertisement,)).fetchall()
+
+            if registrations:
+                last_address = None
+                user_claimed = 0
+
+                for registration in registrations:
+                    if last_address is None:
+                        last_address = registration[1]
+
+                    if last_address == registration[1]:
+                        user_claimed += registration[2]
+                    else:
+                        self._update_balance(cursor, tokenrow, last_address, blockrow, 0, user_claimed)
+
+                        last_address = registration[1]
+                        user_claimed = registration[2]
+
+                self._update_balance(cursor, tokenrow, last_address, blockrow, 0, user_claimed)
+
+        ads_to_close = []
+
+        for advertisement in sorted(set(endings) | self.claimed):
+            ad = cursor.execute('''SELECT a.rowid, a.available - a.claimed,
+                                      t.rowid, t.address
+                                  FROM advertisement a
+                                  LEFT JOIN token t ON t.rowid = a.token
+                                  WHERE a.rowid = ? AND a.finished IS NULL AND (a.claimed = a.available OR a.ends = ?)''',
+                                  (advertisement, height)).fetchone()
+
+            if ad:
+                ads_to_close.append(ad)
+
+        self.claimed.clear()
 
         if ads_to_close:
             for advertisement in ads_to_close:
@@ -772,12 +1462,13 @@ class TokenDB:
                                   WHERE rowid = ?''',
                                   (blockrow, blockrow, advertisement[0]))
 
+                self._advertisement_finished(advertisement[0])
+
                 make_available = advertisement[1]
                 if make_available:
-                    cursor.execute('''UPDATE balance
-                                      SET updated = ?, available = available + ?
-                                      WHERE token = ? AND address = ?''',
-                                      (blockrow, make_available, advertisement[2], advertisement[3]))
+                    self._update_balance(cursor, advertisement[2], advertisement[3], blockrow, 0, make_available)
+
+            self.eligible.clear()
 
     def get_user_tokens(self, address):
         return [{
@@ -791,34 +1482,72 @@ class TokenDB:
                 SELECT t.address, t.symbol, t.decimals, t.name, b.units, b.available
                 FROM balance b
                 LEFT JOIN token t ON t.rowid = b.token
-                WHERE b.address = ?''',
+                WHERE b.address = (SELECT rowid FROM address WHERE address = ?)''',
                 (address,)).fetchall()]
 
+    def get_user_proofs(self, address):
+        # the user's balances with inclusion proofs against the state root of the last block, read together
+        #   in one transaction so the proofs and root always agree
+        conn = self.conn
+        begun = not conn.in_transaction
+
+        if begun:
+            conn.execute('''BEGIN''')
+
+        try:
+            # from the last hashed block down, which walks idx_block_height instead of every state root
+            state = conn.execute('''SELECT b.height, (SELECT root FROM state_root WHERE block = b.rowid)
+                                    FROM block b
+                                    WHERE b.orbit IS NOT NULL
+                                    ORDER BY b.height DESC
+                                    LIMIT 1''').fetchone()
+
+            balances = []
+
+            for balance in self.get_user_tokens(address):
+                siblings = self.state.proof(balance['address'], address)
+
+                balance['siblings'] = [ sibling.hex() for sibling in siblings ] if siblings is not None else None
+                balances.append(balance)
+
+        finally:
+            if begun:
+                conn.execute('''COMMIT''')
+
+        return {
+            "height": state[0] if state else None,
+            "root": state[1].hex() if state and state[1] else None,
+            "balances": balances
+        }
+
     def hash(self, blockrow):
-        cursor = self.conn.cursor()
+        self.flush()
 
-        blocks = cursor.execute('''SELECT height, rowid, hash FROM block
-                                   WHERE orbit IS NULL
-                                   ORDER BY height''').fetchall()
+        cursor = self.conn.cursor()
 
-        if not blocks:
-            return None
+        # block hashes are hashed in hex
+        block = cursor.execute('''SELECT height, rowid, lower(hex(hash)) FROM block
+                                  WHERE rowid = ? AND orbit IS NULL''',
+                                  (blockrow,)).fetchone()
 
-        if len(blocks) > 1:
-            raise ValueError('Multiple unhashed orbits detected... hash() must be called concurrently as blocks are inserted')
+        if not block:
+            raise ValueError('Block is missing or has already been hashed: {}'.format(blockrow))
 
-        block = blocks[0]
         height = block[0]
-        blockrow = block[1]
 
         block_prev = cursor.execute('''SELECT orbit FROM block
                                        WHERE height = ?''',
                                        (height - 1,)).fetchone()
 
-        # hash the block and append to previous block hash
+        # hash the block and append to previous block hash; everything is fed straight into the digest
+
+        digest = sha256()
 
         if block_prev:
-            data = block_prev[0]
+            if block_prev[0] is None:
+                raise ValueError('Previous block has not been hashed... hash() must be called in order as blocks are inserted')
+
+            digest.update(block_prev[0])
 
         else:
             not_launch = cursor.execute('''SELECT 1 FROM block
@@ -828,74 +1557,269 @@ class TokenDB:
             if not_launch:
                 raise ValueError('Missing block: {}'.format(height - 1))
 
-            data = b'\x42\x81' # special sequence to indicate launch
+            digest.update(b'\x42\x81') # special sequence to indicate launch
 
-        data += self._hash_cols(block)
+        digest.update(self._hash_cols(block))
 
         # tokens and balances
 
-        data += self._hash_rows(cursor.execute('''SELECT * FROM token
-                                                  WHERE updated = ?
-                                                  ORDER BY rowid''',
-                                                  (blockrow,)))
-
-        data += self._hash_rows(cursor.execute('''SELECT * FROM balance
-                                                  WHERE updated = ?
-                                                  ORDER BY rowid''',
-                                                  (blockrow,)))
+        digest.update(self._hash_changed(cursor, 'token', blockrow))
+        digest.update(self._hash_changed(cursor, 'balance', blockrow))
 
         # events
 
-        data += self._hash_rows(cursor.execute('''SELECT * FROM transfer
-                                                  WHERE created = ?
-                                                  ORDER BY rowid''',
-                                                  (blockrow,)))
-
-        data += self._hash_rows(cursor.execute('''SELECT * FROM advertisement
-                                                  WHERE updated = ?
-                                                  ORDER BY rowid''',
-                                                  (blockrow,)))
-
-        data += self._hash_rows(cursor.execute('''SELECT * FROM registration
-                                                  WHERE updated = ?
-                                                  ORDER BY rowid''',
-                                                  (blockrow,)))
+        digest.update(self._hash_changed(cursor, 'transfer', blockrow))
+        digest.update(self._hash_changed(cursor, 'advertisement', blockrow))
+        digest.update(self._hash_changed(cursor, 'registration', blockrow))
 
         # final hash and save
 
-        orbit = self._hash(data)
+        orbit = sha256(digest.digest()).digest()
 
         cursor.execute('''UPDATE block
                           SET orbit = ?
                           WHERE rowid = ?''',
                           (sqlite3.Binary(orbit), blockrow))
 
+        # the balance state root is kept alongside (it is not part of the orbit hash)
+
+        root = self.state.update(cursor.execute('''SELECT t.address, a.address, b.units, b.available
+                                                   FROM balance b
+                                                   LEFT JOIN address a ON a.rowid = b.address
+                                                   LEFT JOIN token t ON t.rowid = b.token
+                                                   WHERE b.rowid IN (SELECT row FROM journal WHERE block = ? AND tbl = 'balance')''',
+                                                   (blockrow,)).fetchall())
+
+        # so is the digest of all state rows, for checking a snapshot
+
+        state = self._state_digest(cursor, height, blockrow)
+
+        cursor.execute('''INSERT OR REPLACE INTO state_root
+                          (block, root, state)
+                          VALUES (?, ?, ?)''',
+                          (blockrow, sqlite3.Binary(root), sqlite3.Binary(state)))
+
         return orbit
 
-    def _hash_rows(self, rows):
-        if not rows:
-            return b'\x00'
+    def _state_rows(self, cursor, table, blockrow=None):
+        # (rowid, digest) of the rows changed in the block, or of every row
+        tx = table != 'balance'
 
-        data = b'\x01'
+        rows = cursor.execute('''SELECT h.*{} FROM hashed_{} h {} {}'''.format(
+                ', lower(hex(x.hash))' if tx else '', table,
+                'LEFT JOIN tx x ON x.rowid = h.tx' if tx else '',
+                'WHERE h.row IN (SELECT row FROM journal WHERE block = ? AND tbl = ?)' if blockrow else ''),
+                (blockrow, table) if blockrow else ()).fetchall()
 
-        for row in rows:
-            data += self._hash_cols(row)
+        return [ (row[0], self._hash_cols((table,) + tuple(row))) for row in rows ]
 
-        data += b'\xFF'
+    def _state_digest(self, cursor, height, blockrow):
+        # commits to every row of the state tables as they are after the block, each along with the hash of the
+        #   transaction it came from: the sum of a digest per row, so a block only adds the digests of the rows it
+        #   changed and takes away what they were before; unlike the orbit hash it can be checked without the
+        #   history, which is what a snapshot comes without
+        prev = cursor.execute('''SELECT r.state FROM block b
+                                 LEFT JOIN state_root r ON r.block = b.rowid
+                                 WHERE b.height = ?''',
+                                 (height - 1,)).fetchone()
 
-        return self._hash(data)
+        if prev and prev[0] is None:
+            raise ValueError('Previous block has no state digest: {}'.format(height - 1))
 
-    def _hash_cols(self, cols):
-        data = '['
+        state = int.from_bytes(prev[0], 'big') if prev else 0
+
+        for table, column in self.JOURNALED:
+            for rowid, digest in self._state_rows(cursor, table, blockrow):
+                old = cursor.execute('''SELECT digest FROM state_row WHERE tbl = ? AND row = ?''', (table, rowid)).fetchone()
+
+                if old:
+                    state -= int.from_bytes(old[0], 'big')
+
+                state += int.from_bytes(digest, 'big')
+
+                cursor.execute('''INSERT OR REPLACE INTO state_row
+                                  (tbl, row, digest)
+                                  VALUES (?, ?, ?)''',
+                                  (table, rowid, sqlite3.Binary(digest)))
+
+        return (state % self.STATE_MODULUS).to_bytes(32, 'big')
+
+    def _build_state_rows(self, cursor):
+        # from scratch, for state that wasn't built block by block; returns the state digest
+        cursor.execute('''DELETE FROM state_row''')
+        state = 0
+
+        for table, column in self.JOURNALED:
+            digests = self._state_rows(cursor, table)
+
+            cursor.executemany('''INSERT INTO state_row
+                                  (tbl, row, digest)
+                                  VALUES (?, ?, ?)''',
+                                  [ (table, rowid, sqlite3.Binary(digest)) for rowid, digest in digests ])
+
+            state += sum(int.from_bytes(digest, 'big') for rowid, digest in digests)
+
+        return (state % self.STATE_MODULUS).to_bytes(32, 'big')
+
+    def build_state_digest(self):
+        return self._build_state_rows(self.conn.cursor())
+
+    def _hash_changed(self, cursor, table, blockrow):
+        # the rows journaled for the block are exactly those whose updated (or created) column is the block;
+        #   each row's digest is noted in the journal for audits
+        rows = cursor.execute('''SELECT * FROM hashed_{}
+                                 WHERE row IN (SELECT row FROM journal WHERE block = ? AND tbl = ?)
+                                 ORDER BY row'''.format(table),
+                                 (blockrow, table))
+
+        digests = [ (self._hash_cols(row[1:]), blockrow, table, row[0]) for row in rows ]
+
+        cursor.executemany('''UPDATE journal
+                              SET digest = ?
+                              WHERE block = ? AND tbl = ? AND row = ?''',
+                              digests)
+
+        return self._hash_digests(digest[0] for digest in digests)
+
+    def get_snapshot_height(self):
+        # blocks up to this height came from a snapshot and have no stored transactions (None if every block does)
+        height = self._get_status('snapshot')
+        if height is None:
+            return None
+
+        return int(height)
+
+    def set_snapshot_height(self, height):
+        # the journal only starts after the snapshot
+        self._set_status('height', height)
+        self._set_status('journal', height + 1)
+        self._set_status('snapshot', height)
+
+    def get_journal_start(self):
+        # blocks below this height can't be audited from the journal (None if every block can)
+        height = self._get_status('journal')
+        if height is None:
+            return None
+
+        return int(height)
+
+    def audit_blocks(self, start, end):
+        # recomputes the content digest of each block from the journal, for chaining against block.orbit;
+        #   rows whose last change was the block are also checked against their journaled digest
+        #   returns (height, content digest, [ (table, rowid) of rows that don't match ]) for every block
+        cursor = self.conn.cursor()
+        results = []
+
+        for height, blockrow, blockhash in cursor.execute('''SELECT height, rowid, lower(hex(hash)) FROM block
+                                                             WHERE height BETWEEN ? AND ?
+                                                             ORDER BY height''',
+                                                             (start, end)).fetchall():
+            content = self._hash_cols((height, blockrow, blockhash))
+            mismatched = []
+
+            for table, column in self.JOURNALED:
+                digests = cursor.execute('''SELECT row, MAX(digest) FROM journal
+                                            WHERE block = ? AND tbl = ?
+                                            GROUP BY row
+                                            ORDER BY row''',
+                                            (blockrow, table)).fetchall()
+
+                if any(digest is None for row, digest in digests):
+                    raise ValueError('Journal has no row digests for block {}'.format(height))
+
+                content += self._hash_digests(digest for row, digest in digests)
+
+                for rowid, digest in digests:
+                    row = cursor.execute('''SELECT {}, * FROM hashed_{} WHERE row = ?'''.format(column, table), (rowid,)).fetchone()
+
+                    if row is None or (row[0] == blockrow and self._hash_cols(row[2:]) != digest):
+                        mismatched.append((table, rowid))
+
+            results.append((height, content, mismatched))
+
+        return results
+
+    def get_block_range(self):
+        return self.conn.execute('''SELECT MIN(height), MAX(height) FROM block''').fetchone()
 
-        for col in cols:
-            if col:
-                data += '{}'.format(col)
-            data += '|'
+    def get_orbits_between(self, start, end):
+        return self.conn.execute('''SELECT height, orbit FROM block
+                                    WHERE height BETWEEN ? AND ?
+                                    ORDER BY height''',
+                                    (start, end)).fetchall()
 
-        data += ']'
+    def get_orbit_hashes(self, heights):
+        # orbit hashes at the given heights (a list, or comma separated) with the last synced height, for comparing
+        #   with a peer; each orbit hash commits to every block before it, so a few of them are enough to bisect
+        #   to the first block where two nodes differ
+        if isinstance(heights, str):
+            heights = heights.split(',')
+
+        heights = sorted(set(int(height) for height in heights))
+
+        if len(heights) > self.ORBIT_HASHES:
+            raise ValueError('At most {} heights can be requested at once'.format(self.ORBIT_HASHES))
+
+        orbits = self.conn.execute('''SELECT b.height, b.orbit, r.root, r.state FROM block b
+                                      LEFT JOIN state_root r ON r.block = b.rowid
+                                      WHERE b.height IN ({})'''.format(','.join('?' * len(heights))),
+                                      heights).fetchall()
+
+        # the state roots and digests let a snapshot be checked against this node too
+        return {
+            "height": self.get_last_block(),
+            "orbits": { str(height): orbit.hex() if orbit else None for height, orbit, root, state in orbits },
+            "roots": { str(height): root.hex() if root else None for height, orbit, root, state in orbits },
+            "states": { str(height): state.hex() if state else None for height, orbit, root, state in orbits }
+            }
+
+    def get_changes(self, since=0, limit=1000):
+        # the change journal after the given sequence number, for following state changes as they happen
+        return [{
+            "seq": row[0],
+            "height": row[1],
+            "table": row[2],
+            "rowid": row[3],
+            "change": row[4]
+            } for row in self.conn.execute('''
+                SELECT j.seq, b.height, j.tbl, j.row, j.change
+                FROM journal j
+                LEFT JOIN block b ON b.rowid = j.block
+                WHERE j.seq > ?
+                ORDER BY j.seq
+                LIMIT ?''',
+                (int(since), int(limit))).fetchall()]
+
+    def prune_journal(self, height):
+        # journal entries are only needed until their block has been hashed and any followers have caught up
+        cursor = self.conn.cursor()
+        cursor.execute('''DELETE FROM journal
+                          WHERE block IN (SELECT rowid FROM block WHERE height < ?)''',
+                          (height,))
+        pruned = cursor.rowcount
+
+        start = self.get_journal_start()
+        if start is None or start < height:
+            self._set_status('journal', height)
+
+        return pruned
+
+    def _hash_digests(self, digests):
+        # row digests are streamed in as they are computed and never gathered into one buffer
+        digest = sha256(b'\x01')
+
+        for row in digests:
+            digest.update(row)
+
+        digest.update(b'\xFF')
+
+        return sha256(digest.digest()).digest()
+
+    def _hash_cols(self, cols):
+        # canonical encoding: '[' then each column formatted (empty if falsy) and followed by '|', then ']'
+        encoded = '|'.join([ '{}'.format(col) if col else '' for col in cols ])
 
-        return self._hash(data.encode('utf-8'))
+        return self._hash(('[' + encoded + '|]' if cols else '[]').encode('utf-8'))
 
     def _hash(self, data):
         return sha256(sha256(data).digest()).digest()
@@ -0,0 +1,363 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from bitcoinrpc.authproxy import AuthServiceProxy, JSONRPCException
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from queue import LifoQueue
+from bisect import bisect_left
+from http.client import HTTPException
+from urllib.parse import urlparse
+from time import time, sleep
+
+
+# bitcoind is still loading or verifying blocks; worth waiting for
+RPC_IN_WARMUP = -28
+
+# a height or hash the node doesn't have (yet), e.g. a backend still catching up with the tip
+RPC_INVALID_PARAMETER = -8
+RPC_INVALID_ADDRESS_OR_KEY = -5
+
+# a parameter of the wrong type, e.g. a numeric verbosity for a node that only takes a boolean (older nodes
+#   report this as a general error instead)
+RPC_TYPE_ERROR = -3
+RPC_MISC_ERROR = -1
+
+# raised by AuthServiceProxy itself when the HTTP response is missing or isn't JSON-RPC
+RPC_NO_RESPONSE = -342
+
+
+class Histogram():
+
+    BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000) # milliseconds
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+
+    def add(self, ms):
+        self.counts[bisect_left(self.BOUNDS, ms)] += 1
+        self.count += 1
+        self.total += ms
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        # upper bound of the bucket containing the p-th percentile (None if beyond the last bound)
+        if not self.count:
+            return 0
+
+        rank = p * self.count / 100
+        seen = 0
+
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.BOUNDS[i] if i < len(self.BOUNDS) else None
+
+
+class Client():
+
+    # a pool of keep-alive bitcoind connections shared by every thread that talks to the same node,
+    #   with retries for transient failures and per-method latency histograms
+
+    def __init__(self, url, size=4, timeout=480, retries=4, backoff=0.5):
+        self.url = url
+        self.size = size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+        self.idle = LifoQueue()
+        self.created = 0
+        self.lock = Lock()
+
+        self.latency = {}
+        self.executor = None
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+
+        return lambda *params: self.call(method, *params)
+
+    def resize(self, size):
+        with self.lock:
+            if size > self.size:
+                self.size = size
+
+    def _acquire(self):
+        with self.lock:
+            if self.idle.empty() and self.created < self.size:
+                self.created += 1
+                return AuthServiceProxy(self.url, timeout=self.timeout)
+
+        proxy = self.idle.get()
+        if proxy is None:
+            proxy = AuthServiceProxy(self.url, timeout=self.timeout)
+
+        return proxy
+
+    def _release(self, proxy):
+        self.idle.put(proxy)
+
+    def _discard(self):
+        # the connection is in an unknown state after a transport error; its slot gets a fresh one when next used
+        self.idle.put(None)
+
+    def _transient(self, e):
+        if isinstance(e, JSONRPCException):
+            return e.error.get('code') == RPC_IN_WARMUP
+
+        return isinstance(e, (OSError, HTTPException))
+
+    def _record(self, method, start, failed=False):
+        ms = (time() - start) * 1000
+
+        with self.lock:
+            try:
+                histogram = self.latency[method]
+            except KeyError:
+                histogram = Histogram()
+                self.latency[method] = histogram
+
+            if failed:
+                histogram.errors += 1
+            else:
+                histogram.add(ms)
+
+    def _run(self, method, fn):
+        attempt = 0
+
+        while True:
+            proxy = self._acquire()
+            start = time()
+
+            try:
+                result = fn(proxy)
+
+            except Exception as e:
+                transient = self._transient(e)
+
+                if transient and not isinstance(e, JSONRPCException):
+                    self._discard()
+                else:
+                    self._release(proxy)
+
+                self._record(method, start, True)
+
+                if not transient or attempt >= self.retries:
+                    raise
+
+                sleep(self.backoff * (2 ** attempt))
+                attempt += 1
+                continue
+
+            self._release(proxy)
+            self._record(method, start)
+
+            return result
+
+    def call(self, method, *params):
+        return self._run(method, lambda proxy: getattr(proxy, method)(*params))
+
+    def batch(self, calls, size=1000):
+        # splits the calls into batches that are sent concurrently on separate connections; results keep their order
+        if len(calls) <= size:
+            return self._batch(calls)
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='rpc')
+
+        futures = [ self.executor.submit(self._batch, calls[i:i+size]) for i in range(0, len(calls), size) ]
+
+        results = []
+        for future in futures:
+            results.extend(future.result())
+
+        return results
+
+    def _batch(self, calls):
+        return self._run('batch:' + calls[0][0] if calls else 'batch', lambda proxy: proxy.batch_(calls))
+
+    def stats(self):
+        with self.lock:
+            return { method: (h.count, h.errors, h.mean(), h.percentile(50), h.percentile(99))
+                    for method, h in self.latency.items() }
+
+    def print_stats(self, out):
+        stats = self.stats()
+
+        print('RPC latency (ms)', file=out)
+
+        if not stats:
+            print('    No calls made yet', file=out)
+
+        bound = lambda ms: '<= {}'.format(ms) if ms is not None else '> {}'.format(Histogram.BOUNDS[-1])
+
+        for method in sorted(stats):
+            count, errors, mean, p50, p99 = stats[method]
+            print('    {}: {} call{}, {} error{}, mean {:.1f}, p50 {}, p99 {}'.format(
+                    method, count, '' if count == 1 else 's', errors, '' if errors == 1 else 's',
+                    mean, bound(p50), bound(p99)), file=out)
+
+
+class Backends():
+
+    # spreads fetches over several nodes by load and health, failing over when one errors or lags behind;
+    #   block hashes are cross-checked between two nodes so every backend must agree on the chain
+
+    DOWN_SECONDS = 30   # how long a failing backend is avoided
+
+    def __init__(self, clients):
+        if not clients:
+            raise ValueError('At least one RPC backend is required')
+
+        self.clients = clients
+        self.inflight = [0] * len(clients)
+        self.down = [0.0] * len(clients)
+        self.used = [0] * len(clients)
+        self.failed = [0] * len(clients)
+        self.lock = Lock()
+
+        self.executor = None
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+
+        return lambda *params: self.call(method, *params)
+
+    def _score(self, i, now):
+        client = self.clients[i]
+
+        with client.lock:
+            latencies = [ h.mean() for h in client.latency.values() if h.count ]
+
+        latency = sum(latencies) / len(latencies) if latencies else 0.0
+
+        # healthy first, then least busy, then fastest
+        return (self.down[i] > now, self.inflight[i], latency)
+
+    def _order(self, exclude=()):
+        now = time()
+
+        with self.lock:
+            return sorted((i for i in range(len(self.clients)) if i not in exclude), key=lambda i: self._score(i, now))
+
+    def _on(self, fn, exclude=()):
+        # runs fn(client) on the best backend, moving on to the next one if it fails
+        error = None
+
+        for i in self._order(exclude):
+            with self.lock:
+                self.inflight[i] += 1
+                self.used[i] += 1
+
+            try:
+                return i, fn(self.clients[i])
+
+            except Exception as e:
+                if self._behind(e):
+                    # the node is fine, just lagging; another backend may already have the block
+                    error = e
+                    continue
+
+                if not self._unhealthy(e):
+                    # the node answered; any other backend would give the same error (e.g. an unsupported verbosity)
+                    raise
+
+                with self.lock:
+                    self.failed[i] += 1
+                    self.down[i] = time() + self.DOWN_SECONDS
+
+                error = e
+
+            finally:
+                with self.lock:
+                    self.inflight[i] -= 1
+
+        raise error
+
+    def _unhealthy(self, e):
+        # only a backend that can't be reached, times out or is still warming up counts as failing
+        if isinstance(e, JSONRPCException):
+            return e.error.get('code') in (RPC_IN_WARMUP, RPC_NO_RESPONSE)
+
+        return isinstance(e, (OSError, HTTPException))
+
+    def _behind(self, e):
+        return isinstance(e, JSONRPCException) and e.error.get('code') in (RPC_INVALID_PARAMETER, RPC_INVALID_ADDRESS_OR_KEY)
+
+    def call(self, method, *params):
+        return self._on(lambda client: client.call(method, *params))[1]
+
+    def getblockhash(self, height):
+        first, blockhash = self._on(lambda client: client.call('getblockhash', height))
+
+        if len(self.clients) > 1:
+            try:
+                second, check = self._on(lambda client: client.call('getblockhash', height), (first,))
+            except Exception:
+                # no other backend can answer yet (e.g. still syncing); go with the one we have
+                return blockhash
+
+            if check != blockhash:
+                raise ValueError('RPC backends disagree on the block at height {}: {} from {}, {} from {}'.format(
+                        height, blockhash, self.label(first), check, self.label(second)))
+
+        return blockhash
+
+    def batch(self, calls, size=1000):
+        if len(calls) <= size:
+            return self._on(lambda client: client._batch(calls))[1]
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=sum(c.size for c in self.clients),
+                        thread_name_prefix='backends')
+
+        futures = [ self.executor.submit(self._on, lambda client, chunk=calls[i:i+size]: client._batch(chunk))
+                for i in range(0, len(calls), size) ]
+
+        results = []
+        for future in futures:
+            results.extend(future.result()[1])
+
+        return results
+
+    def label(self, i):
+        # never show credentials
+        url = urlparse(self.clients[i].url)
+        return '{}:{}'.format(url.hostname, url.port)
+
+    def print_stats(self, out):
+        now = time()
+
+        for i, client in enumerate(self.clients):
+            print('Backend {} ({}): {} request{}, {} failure{}{}'.format(i + 1, self.label(i),
+                    self.used[i], '' if self.used[i] == 1 else 's', self.failed[i], '' if self.failed[i] == 1 else 's',
+                    ', currently avoided' if self.down[i] > now else ''), file=out)
+
+            client.print_stats(out)
+
+
+_clients = {}
+_clients_lock = Lock()
+
+def get_client(url, size=4):
+    # one shared client per node URL for the whole process
+    with _clients_lock:
+        try:
+            client = _clients[url]
+        except KeyError:
+            client = Client(url, size)
+            _clients[url] = client
+
+    client.resize(size)
+    return client
@@ -0,0 +1,260 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from hashlib import sha256
+import gzip
+import json
+
+
+# A snapshot is the token state at one block, for bringing up a new node without replaying every block since
+#   the launch. It's a gzip-compressed stream of JSON lines: a header with the height, orbit hash, state root and
+#   state digest, then each table as a line naming its columns followed by a line per row (BLOB columns in hex), and last a
+#   line with the sha256 digest of everything before it. Rows keep their rowids since the tables refer to each
+#   other by rowid.
+
+FORMAT = 3
+LEVEL = 6
+BATCH = 10000   # rows inserted at once when loading
+
+# tables in a snapshot, with which of their rows are included (None for all); the change journal is left out,
+#   and so are the Merkle tree over balances and the state row digests, since rebuilding them is how the state is
+#   verified
+TABLES = (
+    ('block', None),
+    # only those the token state refers to, since the rest is history that is never replayed on a snapshot node;
+    #   the last one too, so new transactions get the same rowids (which are hashed) as on any other node
+    ('tx', '''rowid IN (SELECT tx FROM token UNION SELECT tx FROM transfer
+                        UNION SELECT tx FROM advertisement UNION SELECT tx FROM registration
+                        UNION SELECT MAX(rowid) FROM tx)'''),
+    ('token', None),
+    ('address', None),
+    ('balance', None),
+    ('transfer', None),
+    ('advertisement', None),
+    ('registration', None),
+    ('schedule', None),
+    ('state_root', None)
+)
+
+
+def _columns(conn, table):
+    # column names, and the positions of BLOB columns in a row that starts with the rowid
+    info = conn.execute('''PRAGMA table_info({})'''.format(table)).fetchall()
+
+    return [ col[1] for col in info ], { i + 1 for i, col in enumerate(info) if col[2].upper() == 'BLOB' }
+
+def export(tokens, filename, height=None):
+    # writes the state at the last synced block, which is the only one whose token state the database has
+    #   (height, if given, must be that block); returns (height, orbit hash, state root, state digest, rows)
+    conn = tokens.conn
+
+    # a single read transaction so the snapshot is consistent even while a sync is running
+    conn.execute('''BEGIN''')
+
+    try:
+        last = tokens.get_last_block()
+        if last is None:
+            raise ValueError("No blocks have been synced")
+
+        if height is not None and height != last:
+            raise ValueError("Only the token state at the last synced block ({}) is kept, so a snapshot can't be"
+                    " taken at block {}".format(last, height))
+
+        height = last
+
+        blockrow, orbit = conn.execute('''SELECT rowid, orbit FROM block WHERE height = ?''', (height,)).fetchone()
+        if orbit is None:
+            raise ValueError("Block {} has not been hashed".format(height))
+
+        state = conn.execute('''SELECT root, state FROM state_root WHERE block = ?''', (blockrow,)).fetchone()
+        if state is None or state[1] is None:
+            raise ValueError("Block {} has no state root or digest".format(height))
+
+        root, state = state
+        digest = sha256()
+        rows = 0
+
+        with gzip.open(filename, 'wt', compresslevel=LEVEL, encoding='utf-8') as out:
+            def write(record):
+                line = json.dumps(record, separators=(',', ':')) + '\n'
+                digest.update(line.encode('utf-8'))
+                out.write(line)
+
+            write({ "snapshot": FORMAT, "height": height, "orbit": orbit.hex(), "root": root.hex(), "state": state.hex() })
+
+            for table, where in TABLES:
+                columns, blobs = _columns(conn, table)
+                write({ "table": table, "columns": columns })
+
+                for row in conn.execute('''SELECT rowid, {} FROM {} {} ORDER BY rowid'''.format(
+                        ', '.join(columns), table, 'WHERE ' + where if where else '')):
+                    write([ value.hex() if i in blobs and value is not None else value for i, value in enumerate(row) ])
+                    rows += 1
+
+            out.write(json.dumps({ "digest": digest.hexdigest(), "rows": rows }, separators=(',', ':')) + '\n')
+
+    finally:
+        conn.rollback()
+
+    return height, orbit, root, state, rows
+
+def header(filename):
+    # the height, orbit hash, state root and state digest a snapshot claims, before anything is loaded
+    with gzip.open(filename, 'rt', encoding='utf-8') as infile:
+        return _header(infile.readline())
+
+def _header(line):
+    try:
+        header = json.loads(line)
+    except ValueError:
+        header = None
+
+    if not isinstance(header, dict) or header.get('snapshot') != FORMAT:
+        raise ValueError("Not a snapshot, or not a format this version can read")
+
+    return header
+
+def load(tokens, filename, out=None, orbit=None, root=None, state=None):
+    # bulk loads a snapshot into an empty database and verifies it, all in one transaction; the snapshot is only
+    #   checked against itself unless the orbit hash (and state root and digest) expected at its height, from a
+    #   trusted source, are given; returns (height, orbit hash, state root, state digest, rows)
+    #
+    # the state root covers the balances and the state digest every token, balance, transfer, advertisement and
+    #   registration row with the transaction it came from; the schedule has to be the one the advertisements
+    #   make, and the blocks have to end with the orbit hash. Earlier blocks and their state roots are history
+    #   that is kept as it came.
+    conn = tokens.conn
+
+    if tokens.get_block_range()[0] is not None:
+        raise ValueError("A snapshot can only be imported into a new database")
+
+    tokens.begin_bulk()
+
+    # the journal is paused within the transaction, so it can never be left paused
+    conn.execute('''BEGIN''')
+
+    try:
+        tokens.pause_journal()
+
+        header, rows = _load(conn, filename, out)
+        height = header['height']
+
+        if orbit is not None and header['orbit'] != orbit.lower():
+            raise ValueError("Snapshot orbit hash at block {} is not the one expected: {}".format(height, header['orbit']))
+
+        if root is not None and header['root'] != root.lower():
+            raise ValueError("Snapshot state root at block {} is not the one expected: {}".format(height, header['root']))
+
+        if state is not None and header['state'] != state.lower():
+            raise ValueError("Snapshot state digest at block {} is not the one expected: {}".format(height, header['state']))
+
+        if out: print('    Verifying...', flush=True, file=out)
+
+        last = conn.execute('''SELECT rowid, height, orbit FROM block
+                               ORDER BY height DESC
+                               LIMIT 1''').fetchone()
+        if last is None or last[1] != height or last[2] is None or last[2].hex() != header['orbit']:
+            raise ValueError("Snapshot blocks do not end with its orbit hash at block {}".format(height))
+
+        # the Merkle tree is rebuilt from the balances, so they have to hash to the root the snapshot claims
+        root = tokens.state.update(conn.execute('''SELECT t.address, a.address, b.units, b.available
+                                                   FROM balance b
+                                                   LEFT JOIN address a ON a.rowid = b.address
+                                                   LEFT JOIN token t ON t.rowid = b.token''').fetchall())
+
+        stored = conn.execute('''SELECT root, state FROM state_root WHERE block = ?''', (last[0],)).fetchone()
+        if root.hex() != header['root'] or stored is None or stored[0] != root:
+            raise ValueError("Snapshot balances do not match its state root")
+
+        # and the rest of the state to the digest
+        state = tokens.build_state_digest()
+
+        if state.hex() != header['state'] or stored[1] != state:
+            raise ValueError("Snapshot state does not match its state digest")
+
+        if _schedule(conn, '''SELECT height, advertisement, event FROM schedule''') != _schedule(conn, '''
+                SELECT delivers, rowid, ? FROM advertisement
+                UNION ALL SELECT ends, rowid, ? FROM advertisement WHERE ends IS NOT NULL''',
+                (tokens.DELIVER, tokens.END)):
+            raise ValueError("Snapshot schedule does not match its advertisements")
+
+        tokens.set_snapshot_height(height)
+        tokens.resume_journal()
+        conn.commit()
+
+    except Exception:
+        conn.rollback()
+        raise
+
+    finally:
+        tokens.end_bulk()
+
+    return height, bytes.fromhex(header['orbit']), root, state, rows
+
+def _schedule(conn, select, params=()):
+    return sorted(conn.execute(select, params).fetchall())
+
+def _load(conn, filename, out):
+    known = dict(TABLES)
+    digest = sha256()
+    rows = 0
+
+    with gzip.open(filename, 'rt', encoding='utf-8') as infile:
+        line = infile.readline()
+        digest.update(line.encode('utf-8'))
+
+        header = _header(line)
+
+        insert = None
+        blobs = ()
+        batch = []
+
+        for line in infile:
+            record = json.loads(line)
+
+            if isinstance(record, list):
+                if insert is None:
+                    raise ValueError("Snapshot row outside of a table")
+
+                digest.update(line.encode('utf-8'))
+                batch.append([ bytes.fromhex(value) if i in blobs and value is not None else value
+                        for i, value in enumerate(record) ])
+
+                if len(batch) >= BATCH:
+                    conn.executemany(insert, batch)
+                    rows += len(batch)
+                    batch = []
+
+                continue
+
+            if batch:
+                conn.executemany(insert, batch)
+                rows += len(batch)
+                batch = []
+
+            if not isinstance(record, dict):
+                raise ValueError("Unexpected record in snapshot")
+
+            if 'digest' in record:
+                if record['digest'] != digest.hexdigest() or record['rows'] != rows:
+                    raise ValueError("Snapshot is damaged (digest mismatch)")
+
+                return header, rows
+
+            digest.update(line.encode('utf-8'))
+
+            # names are only ever taken from the schema, never from the snapshot
+            table = record.get('table')
+            if table not in known:
+                raise ValueError("Unexpected table in snapshot: {}".format(table))
+
+            columns, blobs = _columns(conn, table)
+            if record.get('columns') != columns:
+                raise ValueError("Snapshot columns for {} do not match the database".format(table))
+
+            if out: print('    {}...'.format(table), flush=True, file=out)
+
+            insert = '''INSERT INTO {} (rowid, {}) VALUES ({})'''.format(table, ', '.join(columns),
+                    ', '.join('?' * (len(columns) + 1)))
+
+    raise ValueError("Snapshot is truncated")
@@ -0,0 +1,153 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from hashlib import sha256
+from bisect import bisect_left
+
+
+# A sparse Merkle tree over every balance, keyed by sha256("<token address>|<address>") and holding
+#   "<units>|<available>". Subtrees are hashed compactly: an empty subtree is EMPTY, a subtree with a single
+#   leaf takes that leaf's hash, and anything larger is node_hash(left, right). A proof is then just the
+#   sibling hashes from the root down to where the leaf sits alone, usually about log2(balances) of them.
+
+BITS = 256
+EMPTY = bytes(32)
+
+
+def leaf_key(token, address):
+    return sha256('{}|{}'.format(token, address).encode('utf-8')).digest()
+
+def leaf_hash(key, units, available):
+    return sha256(b'\x00' + key + '{}|{}'.format(units, available).encode('utf-8')).digest()
+
+def node_hash(left, right):
+    return sha256(b'\x01' + left + right).digest()
+
+def verify(token, address, units, available, siblings, root):
+    # what a light wallet does with a proof: fold the siblings up from the leaf and compare with the root
+    key = leaf_key(token, address)
+    path = int.from_bytes(key, 'big')
+    digest = leaf_hash(key, units, available)
+
+    for depth in reversed(range(len(siblings))):
+        if (path >> (BITS - 1 - depth)) & 1:
+            digest = node_hash(siblings[depth], digest)
+        else:
+            digest = node_hash(digest, siblings[depth])
+
+    return digest == root
+
+
+class StateTree():
+
+    # leaves and the hashes of subtrees with two or more leaves are kept in the token database;
+    #   updating a block's changed balances only rehashes the paths leading to them
+
+    def __init__(self, conn, create=True):
+        self.conn = conn
+
+        if not create:
+            return
+
+        conn.execute('''CREATE TABLE IF NOT EXISTS state_leaf (
+                            key BLOB NOT NULL PRIMARY KEY,
+                            hash BLOB NOT NULL
+                        ) WITHOUT ROWID''')
+
+        conn.execute('''CREATE TABLE IF NOT EXISTS state_node (
+                            depth INTEGER NOT NULL,
+                            prefix BLOB NOT NULL,
+                            hash BLOB NOT NULL,
+                            PRIMARY KEY (depth, prefix)
+                        ) WITHOUT ROWID''')
+
+    def _range(self, depth, prefix):
+        lo = prefix << (BITS - depth)
+        hi = lo | ((1 << (BITS - depth)) - 1)
+
+        return lo.to_bytes(32, 'big'), hi.to_bytes(32, 'big')
+
+    def _leaves(self, lo, hi):
+        # no more than two, which is all it takes to know how a subtree is hashed
+        return self.conn.execute('''SELECT key, hash FROM state_leaf
+                                    WHERE key BETWEEN ? AND ?
+                                    LIMIT 2''',
+                                    (lo, hi)).fetchall()
+
+    def _subtree(self, depth, prefix):
+        lo, hi = self._range(depth, prefix)
+        leaves = self._leaves(lo, hi)
+
+        if not leaves:
+            return EMPTY
+
+        if len(leaves) == 1:
+            return leaves[0][1]
+
+        return self.conn.execute('''SELECT hash FROM state_node
+                                    WHERE depth = ? AND prefix = ?''',
+                                    (depth, lo)).fetchone()[0]
+
+    def root(self):
+        return self._subtree(0, 0)
+
+    def update(self, balances):
+        # balances: (token address, address, units, available) for everything that changed; returns the new root
+        leaves = {}
+
+        for token, address, units, available in balances:
+            key = leaf_key(token, address)
+            leaves[key] = leaf_hash(key, units, available)
+
+        if not leaves:
+            return self.root()
+
+        self.conn.executemany('''INSERT OR REPLACE INTO state_leaf
+                                 (key, hash)
+                                 VALUES (?, ?)''',
+                                 leaves.items())
+
+        return self._update(0, 0, sorted(int.from_bytes(key, 'big') for key in leaves))
+
+    def _update(self, depth, prefix, paths):
+        # rehashes the subtree given the sorted changed paths within it
+        lo, hi = self._range(depth, prefix)
+        leaves = self._leaves(lo, hi)
+
+        if len(leaves) < 2:
+            return leaves[0][1] if leaves else EMPTY
+
+        right = (prefix << 1) | 1
+        split = bisect_left(paths, right << (BITS - depth - 1))
+
+        left_paths = paths[:split]
+        right_paths = paths[split:]
+
+        digest = node_hash(
+                self._update(depth + 1, prefix << 1, left_paths) if left_paths else self._subtree(depth + 1, prefix << 1),
+                self._update(depth + 1, right, right_paths) if right_paths else self._subtree(depth + 1, right))
+
+        self.conn.execute('''INSERT OR REPLACE INTO state_node
+                             (depth, prefix, hash)
+                             VALUES (?, ?, ?)''',
+                             (depth, lo, digest))
+
+        return digest
+
+    def proof(self, token, address):
+        # sibling hashes from the root down to the balance's leaf, or None if there is no such balance
+        key = leaf_key(token, address)
+
+        if not self.conn.execute('''SELECT 1 FROM state_leaf WHERE key = ?''', (key,)).fetchone():
+            return None
+
+        path = int.from_bytes(key, 'big')
+        siblings = []
+
+        for depth in range(BITS):
+            if len(self._leaves(*self._range(depth, path >> (BITS - depth)))) < 2:
+                break
+
+            siblings.append(self._subtree(depth + 1, (path >> (BITS - depth - 1)) ^ 1))
+
+        return siblings
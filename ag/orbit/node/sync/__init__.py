@@ -4,18 +4,29 @@
 from ... import API
 from ...ops import Abstract, allocation, advertisement
 from .. import TokenError
-from ..db import TokenDB
-
-from bitcoinrpc.authproxy import AuthServiceProxy
+from ..db import TokenDB, signer_address, pubkey_address
+from ..rpc import get_client, Backends
+from ..cache import BlockCache
+from .fetch import Fetcher, Prefetcher, VERBOSE
+from .raw import RawBlock, address_script, orbit_candidate, ORBIT_PREFIX, OP_RETURN, OP_PUSHDATA4
 
 from sys import stdout
+from collections import Counter
+from decimal import Decimal
+from time import time
 
 
 class Process():
 
     BCH_TO_SAT_MULTIPLIER = 100000000
 
-    def __init__(self, url='http://localhost:8332', out=stdout): # host='localhost', port=8332, user=None, password=None):
+    BULK_COMMIT_BLOCKS = 1000   # in bulk mode commit at least this often...
+    BULK_COMMIT_SECONDS = 60    # ...or after this many seconds, whichever comes first
+    BULK_TIP_DISTANCE = 6       # and go back to durable per-block commits this close to the chain tip
+
+    PREFIX_HEX = ORBIT_PREFIX.hex() # ORBIT data as it appears in script hex, after OP_RETURN and the push opcode
+
+    def __init__(self, url='http://localhost:8332', out=stdout, prefetch=0, fetch=VERBOSE, bulk=False, copy=False, readonly=False): # host='localhost', port=8332, user=None, password=None):
         #url = 'http://'
         #if user is not None:
         #    url += user
@@ -30,12 +41,56 @@ class Process():
         if self.api.version.major != 0:
             raise ValueError('this version of the ORBIT API is not supported: {}'.format(self.orbit.version))
 
-        self.rpc = AuthServiceProxy(url, timeout=480)
-        self.tokens = TokenDB(auto_commit=False)
+        if readonly:
+            # only for reporting (see get_info()): no writer, no migrations and no prefetch threads
+            self.tokens = TokenDB(readonly=True)
+        else:
+            self.tokens = TokenDB(auto_commit=False, copy=copy)
+
+        self.prefetch = prefetch
+
+        if url is None:
+            # offline: only the transactions already stored can be replayed (see reindex())
+            self.rpc = None
+            self.backends = None
+            self.cache = None
+            self.fetcher = None
+            self.prefetcher = None
+
+        else:
+            # the first URL is the primary node; blocks may also be fetched from any others
+            urls = [ url ] if isinstance(url, str) else list(url)
+
+            # connections for the prefetch threads plus one for this thread
+            self.rpc = get_client(urls[0], prefetch + 1)
+
+            if len(urls) > 1:
+                self.backends = Backends([ self.rpc ] + [ get_client(u, prefetch + 1) for u in urls[1:] ])
+            else:
+                self.backends = None
+
+            # blocks are read from the local block cache first, if one has been populated
+            self.cache = BlockCache() if BlockCache.exists() else None
+
+            self.fetcher = Fetcher(self.backends if self.backends else self.rpc, strategy=fetch, cache=self.cache)
+            self.prefetcher = Prefetcher(self.fetcher.fetch, prefetch) if prefetch and not readonly else None
 
         self.info = None
+        self.payees = set()
+        self.filtered = Counter()
+
+        self.bulk = bulk
+        self.bulk_active = False
+        self.uncommitted = 0
+        self.committed = time()
 
     def close(self):
+        if self.prefetcher:
+            self.prefetcher.close()
+
+        if self.cache:
+            self.cache.close()
+
         self.tokens.close()
         #self.rpc.close()
 
@@ -45,6 +100,8 @@ class Process():
             prev = self.info['blocks']
 
         self.info = self.rpc.getblockchaininfo()
+        self.fetcher.pruned = self.info['pruned']
+        self.fetcher.tip = self.info['blocks']
         if self.out: print('last BCH block sync: {}'.format(self.info['blocks']), file=self.out)
 
         self.last = self.tokens.get_last_block()
@@ -96,9 +153,22 @@ class Process():
         diff = completed - last
         if self.out: print('    Blocks to sync: {}'.format(diff), file=self.out)
 
-    def _chunks(self, data, size):
-        for i in range(0, len(data), size):
-            yield data[i:i+size]
+        if self.out: print(file=self.out)
+        if self.out: print('Block fetching', file=self.out)
+
+        if self.out: print('    Fetch strategy: {}'.format(self.fetcher.strategy), file=self.out)
+
+        if self.out: print('    Prefetch depth: {}'.format(self.prefetch), file=self.out)
+
+        if self.cache:
+            first, last, count = self.cache.range()
+            if self.out: print('    Block cache: {} block{} from {} to {} ({:.1f} MiB)'.format(count, '' if count == 1 else 's',
+                    first, last, self.cache.size() / 1048576), file=self.out)
+        else:
+            if self.out: print('    Block cache: none (populate with `orbit-node sync cache`)', file=self.out)
+
+        if self.out: print(file=self.out)
+        if self.out: (self.backends if self.backends else self.rpc).print_stats(self.out)
 
     def next(self):
         if not self.info:
@@ -117,37 +187,45 @@ class Process():
 
         # FIXME check confirmations?
 
-        blockhash = self.rpc.getblockhash(cur)
-        block = self.rpc.getblock(blockhash)
-
-        txcount = len(block['tx'])
-        if self.out: print('    {} transaction{}...'.format(txcount, '' if txcount == 1 else 's'), end='', flush=True, file=self.out)
+        if self.prefetcher:
+            blockhash, block, txs = self.prefetcher.get(cur, self.info['blocks'])
 
-        # break into batches of 1,000
-        txs = []
-        txcount = 0
-        txhashes = self._chunks(block['tx'], 1000)
-
-        for txbatch in txhashes:
-            if self.info['pruned']:
-                # requires a recent Bitcoin-ABC node that includes the patch for lookups by txhash and blockhash
-                txs.extend(self.rpc.batch_([ [ "getrawtransaction", txhash, True, block['hash'] ] for txhash in txbatch ]))
-            else:
-                txs.extend(self.rpc.batch_([ [ "getrawtransaction", txhash, True ] for txhash in txbatch ]))
+            txcount = len(txs)
+            if self.out: print('    {} transaction{}...'.format(txcount, '' if txcount == 1 else 's'), end='', flush=True, file=self.out)
 
-            txcount += len(txbatch)
-            if self.out: print('{}...'.format(txcount), end='', flush=True, file=self.out)
+        else:
+            blockhash, block, txs = self.fetcher.fetch(cur, self.out)
 
         if self.out: print('validating...', file=self.out)
         blockrow = self.tokens.save_block(blockhash, cur)
 
+        self.validate(blockrow, txs)
+
+        orbit = self.tokens.hash(blockrow)
+        if self.out: print('    -> {}'.format(orbit), file=self.out)
+
+        self.tokens.set_last_block(cur)
+        self._commit(cur)
+        self.last = cur
+
+        return cur
+
+    def validate(self, blockrow, txs):
+        # applies the ORBIT operations and registration payments in the transactions of a block that has been saved
         registrations = self.tokens.get_active_registrations_map(blockrow)
+        self.payees = set(address_script(address) for address in registrations)
+
+        raw = txs if isinstance(txs, RawBlock) else None
+        if raw:
+            # only transactions with ORBIT data or paying a registered token address get decoded
+            txs = raw.transactions(self._relevant)
 
         for tx in txs:
             #if i % 5000 == 0:
             #    if self.out: print('{}...'.format(i), end='', flush=True, file=self.out)
 
             txrow = None
+            signer = None
             payments = []
 
             for vout in tx['vout']:
@@ -155,14 +233,23 @@ class Process():
                 asmhex = vout['scriptPubKey']['hex']
 
                 if asmhex.startswith('6a'): # OP_RETURN
+                    if not self._candidate(asmhex):
+                        continue
+
                     try:
-                        # FIXME: proper pushdata op and length check
                         orbit = self.api.parse(bytearray.fromhex(asmhex[4:])) # we skip the next byte too (pushdata)
 
                     except ValueError as e:
                         if self.out: print("        VOID {}: {}".format(tx['txid'], e), file=self.out)
+                        self.filtered['void'] += 1
+                        orbit = None
+
+                    if orbit is None:
+                        self.filtered['unparsed'] += 1
+
+                    else:
+                        self.filtered['orbit'] += 1
 
-                    if orbit is not None:
                         if self.out: print("        ORBIT @ {}".format(tx['txid']), file=self.out)
                         if self.out: print("            Token Address: {}".format(orbit[0]), file=self.out)
                         if self.out: print("            {}".format(orbit[1]), file=self.out)
@@ -170,8 +257,11 @@ class Process():
                         if txrow is None:
                             txrow = self.save_tx_row(tx, blockrow)
 
+                        if signer is None:
+                            signer = self.signer(tx)
+
                         try:
-                            self.op(orbit[0], orbit[1], txrow, blockrow, registrations)
+                            self.op(orbit[0], orbit[1], txrow, blockrow, registrations, signer)
 
                         except TokenError as e:
                             # note that we don't rollback the sql transaction; we might want to re-evaluate the data later
@@ -195,24 +285,150 @@ class Process():
                         if txrow is None:
                             txrow = self.save_tx_row(tx, blockrow)
 
+                        if signer is None:
+                            signer = self.signer(tx)
+
                         regs_for_token = registrations[address]
-                        from_address = self.tokens.get_signer_address(txrow)
-                        reg_rowid = regs_for_token[from_address]
+                        reg_rowid = regs_for_token[signer]
 
                         self.tokens.registration_payment(txrow, blockrow, reg_rowid, value)
 
+        if raw:
+            self.filtered['skipped'] += raw.skipped
+
         self.tokens.process_advertisements(blockrow)
 
-        orbit = self.tokens.hash(blockrow)
-        if self.out: print('    -> {}'.format(orbit), file=self.out)
+    def reindex(self):
+        # rebuilds all token state and the orbit hash chain by validating the stored transactions of every block
+        #   again, without a node; returns the number of blocks replayed and the heights whose orbit hash changed
+        snapshot = self.tokens.get_snapshot_height()
+        if snapshot is not None:
+            raise ValueError("Token state was imported from a snapshot at block {}; there are no stored transactions to replay".format(snapshot))
 
-        self.tokens.set_last_block(cur)
+        previous = self.tokens.get_orbits()
+        blocks = self.tokens.get_blocks()
+
+        self.tokens.reset_state()
+
+        changed = []
+        began = time()
+
+        for blockrow, height in blocks:
+            self.validate(blockrow, self.stored_txs(blockrow))
+
+            orbit = self.tokens.hash(blockrow)
+            if orbit != previous.get(height):
+                changed.append(height)
+
+            if self.out and height % 1000 == 0:
+                print('    {}... ({:.1f} blocks/s)'.format(height, (height - blocks[0][1] + 1) / (time() - began)),
+                        flush=True, file=self.out)
+
+        # a single transaction, so an interrupted reindex leaves the previous state intact
         self.tokens.commit()
-        self.last = cur
 
-        return cur
+        return len(blocks), changed
+
+    def stored_txs(self, blockrow):
+        # the transactions saved by save_tx_row() for a block, in the layout bitcoind returns them
+        txs = []
+
+        for txrow, txhash, confirmations in self.tokens.get_txs(blockrow):
+            vin = [ { 'txid': prevhash, 'scriptSig': { 'hex': asmhex } }
+                    for prevhash, asmhex in self.tokens.get_txins(txrow) ]
+
+            vout = []
+            for value, stype, addresses, asmhex in self.tokens.get_txouts(txrow):
+                script = { 'hex': asmhex, 'type': stype }
+                if addresses is not None:
+                    script['addresses'] = addresses.split(',')
+
+                vout.append({ 'value': Decimal(value).scaleb(-8), 'scriptPubKey': script })
+
+            txs.append({ 'rowid': txrow, 'txid': txhash, 'confirmations': confirmations, 'vin': vin, 'vout': vout })
+
+        return txs
+
+    def _commit(self, height):
+        if self.bulk and self.info['blocks'] - height > self.BULK_TIP_DISTANCE:
+            if not self.bulk_active:
+                if self.out: print('    (bulk mode: deferring indexes and grouping commits)', file=self.out)
+                self.tokens.begin_bulk()
+                self.bulk_active = True
+
+            self.uncommitted += 1
+
+            if self.uncommitted < self.BULK_COMMIT_BLOCKS and time() - self.committed < self.BULK_COMMIT_SECONDS:
+                return
+
+        elif self.bulk_active:
+            if self.out: print('    (near chain tip: building indexes and returning to per-block commits)', file=self.out)
+            self.tokens.end_bulk()
+            self.bulk_active = False
+
+        self.tokens.commit()
+        self.uncommitted = 0
+        self.committed = time()
+
+    def _candidate(self, asmhex):
+        # cheap checks on the script hex before anything is decoded or parsed; rejections are counted by stage
+        if not 0 < int(asmhex[2:4] or '0', 16) <= OP_PUSHDATA4:
+            self.filtered['pushdata'] += 1
+            return False
+
+        if asmhex[4:4+len(self.PREFIX_HEX)] != self.PREFIX_HEX:
+            self.filtered['prefix'] += 1
+            return False
+
+        return True
+
+    def _relevant(self, value, script):
+        # decides which raw transactions get decoded, with the same checks on the script bytes; those that do are
+        #   counted again by next() so don't count here
+        if len(script) and script[0] == OP_RETURN:
+            return orbit_candidate(script)
+
+        return value and script in self.payees
+
+    def print_filtered(self):
+        if not self.out:
+            return
+
+        print('Transaction output filtering', file=self.out)
+        print('    Skipped undecoded: {}'.format(self.filtered['skipped']), file=self.out)
+        print('    Rejected malformed OP_RETURN: {}'.format(self.filtered['pushdata']), file=self.out)
+        print('    Rejected non-ORBIT OP_RETURN: {}'.format(self.filtered['prefix']), file=self.out)
+        print('    Rejected by ORBIT parser: {}'.format(self.filtered['unparsed']), file=self.out)
+        print('        (of which void): {}'.format(self.filtered['void']), file=self.out)
+        print('    Accepted ORBIT operations: {}'.format(self.filtered['orbit']), file=self.out)
+
+    def print_stats(self):
+        if not self.out:
+            return
+
+        self.print_filtered()
+
+        hits, misses, maxsize, currsize = pubkey_address.cache_info()
+        lookups = hits + misses
+
+        print(file=self.out)
+        print('Signer key cache: {} hit{}, {} miss{} ({:.1f}% hit rate), {} of {} keys held'.format(
+                hits, '' if hits == 1 else 's', misses, '' if misses == 1 else 'es',
+                100.0 * hits / lookups if lookups else 0.0, currsize, maxsize), file=self.out)
+
+        if self.cache:
+            print(file=self.out)
+            print('Blocks read from cache: {}'.format(self.fetcher.cached), file=self.out)
+
+        if self.rpc:
+            print(file=self.out)
+            (self.backends if self.backends else self.rpc).print_stats(self.out)
 
     def save_tx_row(self, tx, blockrow):
+        if 'rowid' in tx:
+            # replayed from the database by reindex()
+            return tx['rowid']
+
         txrow = self.tokens.save_tx(tx['txid'], blockrow, tx['confirmations'])
 
         for txin in tx['vin']:
@@ -230,9 +446,11 @@ class Process():
 
         return txrow
 
-    def op(self, address, op, txrow, blockrow, registrations):
-        signer_address = self.tokens.get_signer_address(txrow)
+    def signer(self, tx):
+        # derived from the inputs in hand rather than the saved txin rows
+        return signer_address(bytes.fromhex(txin['scriptSig']['hex']) for txin in tx['vin'])
 
+    def op(self, address, op, txrow, blockrow, registrations, signer_address):
         if not signer_address:
             raise ValueError("Unable to determine signer's address from transaction inputs")
 
@@ -268,6 +486,7 @@ class Process():
             else:
                 token_regs = {}
                 registrations[address] = token_regs
+                self.payees.add(address_script(address))
 
             if signer_address in token_regs:
                 raise ValueError("Already have an active registration for this user and token")
@@ -19,7 +19,22 @@ def usage():
     print("    help         - Display this usage screen")
     print("    info         - Print information about the node status")
     print("    next         - Process next block, if available")
-    print("    all          - Process all available blocks")
+    print("    all [bulk]   - Process all available blocks")
+    print("                   (bulk: group commits and defer indexes until near the chain tip)")
+    print("    cache [<from> [<to>]] - Download blocks into the local block cache for fast resync")
+    print("    reindex      - Rebuild token state from stored transactions (no BCH node needed)")
+    print("    prune <height> - Remove change journal entries for blocks below <height>")
+    print("    verify [--from <height>] [--to <height>] - Audit the recorded orbit hash chain (in parallel)")
+    print("    verify replay - Check the recorded orbit hash chain by replaying stored transactions")
+    print("    compare <url> - Find the first block where a peer node's orbit hashes differ (<url> is its web API)")
+    print("    snapshot export <file> [<height>] - Write the token state at the last synced block to a snapshot file")
+    print("                   (the only height whose token state is kept)")
+    print("    snapshot import <file> <peer url | orbit hash> [<state root> <state digest>] - Bootstrap a new node")
+    print("                   from a snapshot file, then sync from there; the snapshot must match the orbit hash,")
+    print("                   state root and state digest a trusted peer's web API has at its height, or those given")
+    print("    migrate      - Update the token database schema and build any missing indexes now (needed for")
+    print("                   conversions that rewrite the whole database, which the daemon won't start on its own)")
+    print("    plans        - Check that no frequent query does a full table scan (on an in-memory copy)")
     print()
 
 
@@ -52,6 +67,38 @@ with suppress(KeyboardInterrupt):
         from .all import run
         invoke(CALL, cmd, 204, run, args)
 
+    elif cmd == 'cache':
+        from .cache import run
+        invoke(CALL, cmd, 205, run, args)
+
+    elif cmd == 'reindex':
+        from .reindex import run
+        invoke(CALL, cmd, 206, run, args)
+
+    elif cmd == 'prune':
+        from .prune import run
+        invoke(CALL, cmd, 207, run, args)
+
+    elif cmd == 'verify':
+        from .verify import run
+        invoke(CALL, cmd, 208, run, args)
+
+    elif cmd == 'compare':
+        from .compare import run
+        invoke(CALL, cmd, 209, run, args)
+
+    elif cmd == 'snapshot':
+        from .snapshot import run
+        invoke(CALL, cmd, 210, run, args)
+
+    elif cmd == 'migrate':
+        from .migrate import run
+        invoke(CALL, cmd, 211, run, args)
+
+    elif cmd == 'plans':
+        from .plans import run
+        invoke(CALL, cmd, 212, run, args)
+
     else:
         print()
         print("{}: unknown command: {}".format(CALL, cmd))
@@ -4,29 +4,41 @@
 # @%@~LICENSE~@%@
 
 from ag.orbit.command import main
-from ag.orbit.node.config import get_rpc_url
+from ag.orbit.node.config import get_rpc_urls, get_prefetch_depth, get_fetch_strategy
 from ag.orbit.node.sync import Process
 
 
 def run(args):
+    bulk = False
+
     if args is not None and len(args) > 0:
-        raise ValueError("Not expecting any arguments")
+        if len(args) > 1 or args[0] != 'bulk':
+            raise ValueError("Only expecting the optional argument: bulk")
+
+        bulk = True
 
     print()
-    print('Sync all blocks...')
+    print('Sync all blocks{}...'.format(' (bulk mode)' if bulk else ''))
 
     print()
-    sync = Process(get_rpc_url())
+    sync = Process(get_rpc_urls(), prefetch=get_prefetch_depth(), fetch=get_fetch_strategy(), bulk=bulk)
     print()
 
-    while True:
-        last = sync.next()
+    try:
+        while True:
+            last = sync.next()
+
+            if last is None:
+                print()
+                if not sync.refresh():
+                    break
+                print()
 
-        if last is None:
-            print()
-            if not sync.refresh():
-                break
-            print()
+    finally:
+        sync.close()
+
+    print()
+    sync.print_stats()
 
     print()
     print('Sync complete')
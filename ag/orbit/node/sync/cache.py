@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit import API
+from ag.orbit.command import main
+from ag.orbit.node.config import get_rpc_urls, get_prefetch_depth
+from ag.orbit.node.rpc import get_client, Backends
+from ag.orbit.node.cache import BlockCache
+from ag.orbit.node.sync.fetch import Fetcher, Prefetcher
+
+from time import time
+
+
+def run(args):
+    if args is not None and len(args) > 2:
+        raise ValueError("Expecting at most 2 arguments")
+
+    urls = get_rpc_urls()
+    depth = max(get_prefetch_depth(), 4)
+
+    clients = [ get_client(url, depth + 1) for url in urls ]
+    rpc = Backends(clients) if len(clients) > 1 else clients[0]
+
+    tip = clients[0].getblockchaininfo()['blocks']
+
+    start = int(args[0]) if args else API().launched
+    end = int(args[1]) if args and len(args) > 1 else tip
+
+    if end > tip:
+        raise ValueError("The BCH node only has blocks up to {}".format(tip))
+
+    print()
+    print('Caching blocks {} to {}...'.format(start, end))
+
+    cache = BlockCache()
+    fetcher = Fetcher(rpc)
+
+    def fetch(height):
+        # nothing is downloaded for blocks already cached
+        blockhash = rpc.getblockhash(height)
+        if cache.has(blockhash):
+            return blockhash, None
+
+        return blockhash, fetcher.fetch_serialized(blockhash)
+
+    prefetcher = Prefetcher(fetch, depth)
+    began = time()
+    added = 0
+
+    try:
+        for height in range(start, end + 1):
+            blockhash, raw = prefetcher.get(height, end)
+
+            if raw is not None and cache.put(blockhash, height, raw):
+                added += 1
+
+            if height % 1000 == 0:
+                print('    {}... ({:.1f} blocks/s)'.format(height, (height - start + 1) / (time() - began)), flush=True)
+
+    finally:
+        prefetcher.close()
+
+        first, last, count = cache.range()
+        size = cache.size()
+        cache.close()
+
+    print()
+    print('Added {} block{}; cache now holds {} block{} from {} to {} ({:.1f} MiB)'.format(
+            added, '' if added == 1 else 's', count, '' if count == 1 else 's', first, last, size / 1048576))
+
+
+if __name__ == '__main__':
+    main(run)
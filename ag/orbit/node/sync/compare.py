@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.command import main
+from ag.orbit.node.db import TokenDB
+from ag.orbit.node.daemon.webapi import ORBITS
+
+from urllib.parse import urlencode
+from urllib.request import urlopen
+import json
+
+
+SAMPLES = 16    # heights compared per round trip; each one narrows the search about 17 times
+TIMEOUT = 30    # seconds to wait for the peer
+
+
+def run(args):
+    if args is None or len(args) != 1:
+        raise ValueError("Expecting exactly 1 argument: the web API URL of the peer node (e.g. http://127.0.0.1:5001)")
+
+    peer = args[0].rstrip('/')
+
+    print()
+    print('Comparing orbit hashes with {}...'.format(peer))
+
+    tokens = TokenDB(readonly=True)
+
+    try:
+        divergent, agreed, trips = compare(tokens, peer)
+
+    finally:
+        tokens.close()
+
+    print()
+
+    if divergent is None:
+        if agreed is None:
+            print('No blocks in common to compare ({} round trip{})'.format(trips, '' if trips == 1 else 's'))
+        else:
+            print('Both nodes agree up to block {} ({} round trip{})'.format(agreed, trips, '' if trips == 1 else 's'))
+
+        return
+
+    height, local, remote = divergent
+
+    print('    Local orbit hash: {}'.format(local))
+    print('    Peer orbit hash:  {}'.format(remote))
+    print()
+
+    raise ValueError("Nodes diverge at block {} (found in {} round trip{})".format(height, trips, '' if trips == 1 else 's'))
+
+def fetch_orbits(peer, heights):
+    # the /orbits response of a peer node's web API at the given heights
+    url = '{}/{}?{}'.format(peer, ORBITS, urlencode({ 'heights': ','.join(str(height) for height in heights) }))
+
+    with urlopen(url, timeout=TIMEOUT) as response:
+        return json.loads(response.read().decode('utf-8'))[ORBITS]
+
+def compare(tokens, peer):
+    # orbit hashes chain every block to the one before, so two nodes agree on everything up to a height exactly
+    #   when their orbit hashes there match; that makes the first divergent block a search over heights
+    #   returns ((height, local orbit, peer orbit) or None, last height both agree on or None, round trips)
+    first, last = tokens.get_block_range()
+    if first is None:
+        raise ValueError("No blocks have been synced")
+
+    last = tokens.get_last_block()
+
+    peer_orbits = fetch_orbits(peer, [first, last])
+    trips = 1
+
+    if peer_orbits['height'] is None:
+        return None, None, trips
+
+    local = tokens.get_orbit_hashes([first, last])['orbits']
+    remote = peer_orbits['orbits']
+
+    if local.get(str(first)) != remote.get(str(first)):
+        return (first, local.get(str(first)), remote.get(str(first))), None, trips
+
+    # the search is limited to blocks both nodes have synced
+    hi = min(last, peer_orbits['height'])
+
+    if hi != last:
+        remote = fetch_orbits(peer, [hi])['orbits']
+        local = tokens.get_orbit_hashes([hi])['orbits']
+        trips += 1
+
+    if local.get(str(hi)) == remote.get(str(hi)):
+        return None, hi, trips
+
+    # they agree at lo and differ at hi
+    lo = first
+    divergent = (hi, local.get(str(hi)), remote.get(str(hi)))
+
+    while hi - lo > 1:
+        step = (hi - lo) / (SAMPLES + 1)
+        heights = sorted(set(lo + int(step * i) for i in range(1, SAMPLES + 1)) - { lo, hi })
+
+        local = tokens.get_orbit_hashes(heights)['orbits']
+        remote = fetch_orbits(peer, heights)['orbits']
+        trips += 1
+
+        for height in heights:
+            key = str(height)
+
+            if local.get(key) != remote.get(key):
+                hi = height
+                divergent = (height, local.get(key), remote.get(key))
+                break
+
+            lo = height
+
+    return divergent, lo, trips
+
+
+if __name__ == '__main__':
+    main(run)
@@ -0,0 +1,167 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ..rpc import RPC_TYPE_ERROR, RPC_MISC_ERROR
+from .raw import RawBlock
+
+from bitcoinrpc.authproxy import JSONRPCException
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+VERBOSE = 'verbose'     # one getblock call with verbosity 2 returning every decoded transaction
+RAWTX = 'rawtx'         # getblock then batches of getrawtransaction for each txid
+RAW = 'raw'             # the serialized block, parsed locally without any JSON transaction decoding
+
+STRATEGIES = (VERBOSE, RAWTX, RAW)
+
+
+class Fetcher():
+
+    BATCH_SIZE = 1000
+
+    def __init__(self, rpc, pruned=False, strategy=VERBOSE, cache=None):
+        if strategy not in STRATEGIES:
+            raise ValueError('Unknown fetch strategy: {}'.format(strategy))
+
+        self.rpc = rpc # a pooled rpc.Client (or rpc.Backends), safe to share between prefetch threads
+        self.pruned = pruned
+        self.strategy = strategy
+
+        self.cache = cache
+        self.tip = None # kept current by the caller, for the confirmation count of cached blocks
+        self.cached = 0
+
+    def fetch(self, height, out=None):
+        rpc = self.rpc
+
+        blockhash = rpc.getblockhash(height)
+
+        if self.cache:
+            raw = self.cache.get(blockhash)
+
+            if raw is not None:
+                self.cached += 1
+                return self._cached(height, blockhash, raw, out)
+
+        if self.strategy == RAW:
+            return self._fetch_raw(rpc, blockhash, out)
+
+        if self.strategy == VERBOSE:
+            try:
+                return self._fetch_verbose(rpc, blockhash, out)
+
+            except JSONRPCException as e:
+                if not self._unsupported(e):
+                    raise
+
+                # older nodes only accept a boolean verbosity; stick with getrawtransaction from now on
+                if out: print('    verbose getblock not supported ({}), falling back to {}'.format(e.error, RAWTX), file=out)
+                self.strategy = RAWTX
+
+        return self._fetch_rawtx(rpc, blockhash, out)
+
+    def _unsupported(self, e):
+        # whether getblock rejected the verbosity itself, rather than failing for the block
+        code = e.error.get('code')
+        message = e.error.get('message', '')
+
+        return code == RPC_TYPE_ERROR or (code == RPC_MISC_ERROR and 'boolean' in message)
+
+    def fetch_serialized(self, blockhash):
+        return bytes.fromhex(self.rpc.getblock(blockhash, False))
+
+    def _cached(self, height, blockhash, raw, out):
+        block = RawBlock(raw, blockhash, self.tip - height + 1)
+
+        txcount = len(block)
+        if out: print('    {} transaction{} (cached)...'.format(txcount, '' if txcount == 1 else 's'), end='', flush=True, file=out)
+
+        return blockhash, { 'hash': blockhash, 'height': height }, block
+
+    def _getblock(self, rpc, blockhash, *verbosity):
+        block = rpc.getblock(blockhash, *verbosity)
+
+        # blocks may come from a different backend than the hash did
+        if block['hash'] != blockhash:
+            raise ValueError('Requested block {} but received {}'.format(blockhash, block['hash']))
+
+        return block
+
+    def _fetch_raw(self, rpc, blockhash, out):
+        header = rpc.getblockheader(blockhash)
+        block = RawBlock(self.fetch_serialized(blockhash), blockhash, header['confirmations'])
+
+        txcount = len(block)
+        if out: print('    {} transaction{}...'.format(txcount, '' if txcount == 1 else 's'), end='', flush=True, file=out)
+
+        return blockhash, header, block
+
+    def _fetch_verbose(self, rpc, blockhash, out):
+        block = self._getblock(rpc, blockhash, 2)
+        txs = block['tx']
+
+        txcount = len(txs)
+        if out: print('    {} transaction{}...'.format(txcount, '' if txcount == 1 else 's'), end='', flush=True, file=out)
+
+        # transactions decoded as part of a block don't carry their own confirmation count
+        confirmations = block['confirmations']
+        for tx in txs:
+            tx['confirmations'] = confirmations
+
+        return blockhash, block, txs
+
+    def _fetch_rawtx(self, rpc, blockhash, out):
+        block = self._getblock(rpc, blockhash)
+
+        txcount = len(block['tx'])
+        if out: print('    {} transaction{}...'.format(txcount, '' if txcount == 1 else 's'), end='', flush=True, file=out)
+
+        if self.pruned:
+            # requires a recent Bitcoin-ABC node that includes the patch for lookups by txhash and blockhash
+            calls = [ [ "getrawtransaction", txhash, True, block['hash'] ] for txhash in block['tx'] ]
+        else:
+            calls = [ [ "getrawtransaction", txhash, True ] for txhash in block['tx'] ]
+
+        # batches of 1,000 are sent concurrently over the pooled connections
+        txs = rpc.batch(calls, self.BATCH_SIZE)
+
+        return blockhash, block, txs
+
+
+class Prefetcher():
+
+    # keeps a bounded window of upcoming blocks being fetched in background threads;
+    #   blocks are still handed back one at a time in the order requested so validation stays sequential
+
+    def __init__(self, fetch, depth):
+        if depth < 1:
+            raise ValueError('Prefetch depth must be a positive integer')
+
+        self.fetch = fetch # fetch(height)
+        self.depth = depth
+
+        self.executor = ThreadPoolExecutor(max_workers=depth, thread_name_prefix='prefetch')
+        self.pending = {}
+
+    def get(self, height, tip):
+        # anything below the requested height is stale (e.g. after a refresh)
+        for stale in [h for h in self.pending if h < height]:
+            self.pending.pop(stale).cancel()
+
+        for ahead in range(height, min(height + self.depth, tip + 1)):
+            if ahead not in self.pending:
+                self.pending[ahead] = self.executor.submit(self.fetch, ahead)
+
+        future = self.pending.pop(height, None)
+        if future is None:
+            return self.fetch(height)
+
+        return future.result()
+
+    def close(self):
+        for future in self.pending.values():
+            future.cancel()
+
+        self.pending.clear()
+        self.executor.shutdown(wait=False)
@@ -4,7 +4,7 @@
 # @%@~LICENSE~@%@
 
 from ag.orbit.command import main
-from ag.orbit.node.config import get_rpc_url
+from ag.orbit.node.config import get_rpc_urls, get_prefetch_depth, get_fetch_strategy
 from ag.orbit.node.sync import Process
 
 
@@ -13,7 +13,7 @@ def run(args):
         raise ValueError("Not expecting any arguments")
 
     print()
-    sync = Process(get_rpc_url())
+    sync = Process(get_rpc_urls(), prefetch=get_prefetch_depth(), fetch=get_fetch_strategy())
     sync.get_info()
 
 
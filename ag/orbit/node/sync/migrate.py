@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.command import main
+from ag.orbit.node.db import TokenDB
+
+from time import time
+
+
+def run(args):
+    if args:
+        raise ValueError("Not expecting any arguments")
+
+    print()
+    print('Migrating the token database...')
+
+    # opening it applies any schema migrations not yet applied, including those that rewrite whole tables; the web
+    #   API answers 503 until they are done
+    tokens = TokenDB(migrate=True)
+
+    try:
+        print('    Schema version: {}'.format(tokens.get_schema_version()))
+
+        # the indexes the sync daemon would otherwise build while idle
+        for name in tokens.get_missing_indexes():
+            print('    Building index {}...'.format(name), end='', flush=True)
+
+            began = time()
+            tokens.build_index()
+
+            print(' {:.1f}s'.format(time() - began))
+
+    finally:
+        tokens.close()
+
+    print()
+    print('Database is up to date')
+
+
+if __name__ == '__main__':
+    main(run)
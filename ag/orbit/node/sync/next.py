@@ -4,7 +4,7 @@
 # @%@~LICENSE~@%@
 
 from ag.orbit.command import main
-from ag.orbit.node.config import get_rpc_url
+from ag.orbit.node.config import get_rpc_urls, get_fetch_strategy
 from ag.orbit.node.sync import Process
 
 
@@ -16,9 +16,12 @@ def run(args):
     print('Sync next block...')
     print()
 
-    sync = Process(get_rpc_url())
+    sync = Process(get_rpc_urls(), fetch=get_fetch_strategy())
     sync.next()
 
+    print()
+    sync.print_stats()
+
 
 if __name__ == '__main__':
     main(run)
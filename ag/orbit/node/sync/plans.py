@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.command import main
+from ag.orbit.node.sync import Process
+
+import re
+
+
+HOT = 2         # executions during the workload for a statement to count as hot
+ADDRESSES = 100 # addresses whose balances and proofs are read as the web API would
+
+# literal values (the trace has them already bound), so every execution of a statement is grouped together
+LITERALS = re.compile(r"\bX'[0-9A-F]*'|'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b", re.IGNORECASE)
+
+# a plan step that reads every row of a table rather than searching it or walking one of its indexes
+FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?([^ (]\S*)(?: AS \S+)?$")
+
+STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')
+
+
+def run(args):
+    if args:
+        raise ValueError("Not expecting any arguments")
+
+    print()
+    print('Tracing the sync and web API workload on an in-memory copy of the token database...')
+
+    # replays the stored transactions like `orbit-node sync reindex`, but nothing is written back
+    sync = Process(None, out=None, copy=True)
+
+    try:
+        statements = trace(sync)
+        plans = explain(sync.tokens.conn, statements)
+
+    finally:
+        sync.close()
+
+    hot = [ plan for plan in plans if plan[0] >= HOT ]
+    scans = [ plan for plan in hot if plan[3] ]
+
+    print()
+    print('{} distinct statement{}, {} hot:'.format(len(plans), '' if len(plans) == 1 else 's', len(hot)))
+
+    for count, sql, details, scanned in hot:
+        print()
+        print('    {:>8}x {}'.format(count, sql if len(sql) <= 100 else sql[:97] + '...'))
+
+        for detail in details:
+            print('              {}{}'.format(detail, '   <-- full table scan' if detail in scanned else ''))
+
+    print()
+
+    if scans:
+        raise ValueError("{} hot statement{} full table scan{}".format(len(scans),
+                ' does a' if len(scans) == 1 else 's do', '' if len(scans) == 1 else 's'))
+
+    print('No hot statement does a full table scan')
+
+def trace(sync):
+    # every statement the token database executes while replaying all blocks and answering the web API;
+    #   returns { normalized statement: [ executions, one execution as it ran ] }
+    tokens = sync.tokens
+
+    first, last = tokens.get_block_range()
+    if first is None:
+        raise ValueError("No blocks have been synced")
+
+    addresses = [ row[0] for row in tokens.conn.execute('''SELECT DISTINCT a.address
+                                                           FROM balance b
+                                                           LEFT JOIN address a ON a.rowid = b.address
+                                                           LIMIT ?''', (ADDRESSES,)) ]
+
+    statements = {}
+
+    def traced(sql):
+        if sql.startswith('--'):
+            # statements run by triggers are reported as comments
+            return
+
+        key = ' '.join(LITERALS.sub('?', sql).split())
+
+        try:
+            statements[key][0] += 1
+        except KeyError:
+            statements[key] = [ 1, sql ]
+
+    tokens.conn.set_trace_callback(traced)
+
+    try:
+        if tokens.get_snapshot_height() is None:
+            count, changed = sync.reindex()
+            print('    Replayed {} block{}'.format(count, '' if count == 1 else 's'))
+
+        else:
+            print('    Token state was imported from a snapshot; only the web API queries are traced')
+
+        for address in addresses:
+            tokens.get_user_tokens(address)
+            tokens.get_user_proofs(address)
+
+        for height in range(max(first, last - 9), last + 1):
+            tokens.get_orbit_hashes([ first, height, last ])
+
+        changes = tokens.get_changes(0, 100)
+        tokens.get_changes(changes[-1]['seq'] if changes else 0, 100)
+
+        journal = tokens.get_journal_start()
+        start = max(first, last - 9, journal if journal is not None else first)
+
+        if start <= last:
+            tokens.audit_blocks(start, last)
+
+        print('    Traced the web API for {} address{}'.format(len(addresses), '' if len(addresses) == 1 else 'es'))
+
+    finally:
+        tokens.conn.set_trace_callback(None)
+
+    return statements
+
+def explain(conn, statements):
+    # returns (executions, statement, plan steps, steps that are full table scans) for each distinct statement,
+    #   most executed first
+    plans = []
+
+    for key, (count, sql) in statements.items():
+        if key.split(' ', 1)[0].upper() not in STATEMENTS:
+            continue
+
+        details = [ row[3] for row in conn.execute('''EXPLAIN QUERY PLAN ''' + sql) ]
+        if not details:
+            # plain inserts have nothing to look up
+            continue
+
+        scanned = [ detail for detail in details if FULL_SCAN.match(detail) ]
+
+        plans.append((count, key, details, scanned))
+
+    plans.sort(key=lambda plan: -plan[0])
+
+    return plans
+
+
+if __name__ == '__main__':
+    main(run)
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.command import main
+from ag.orbit.node.db import TokenDB
+
+
+def run(args):
+    if args is None or len(args) != 1:
+        raise ValueError("Expecting exactly 1 argument: the height to keep the change journal from")
+
+    height = int(args[0])
+
+    tokens = TokenDB()
+    try:
+        last = tokens.get_last_block()
+        if last is not None and height > last + 1:
+            raise ValueError("Blocks are only synced up to {}".format(last))
+
+        pruned = tokens.prune_journal(height)
+
+    finally:
+        tokens.close()
+
+    print()
+    print('Removed {} change journal entr{} for blocks below {}'.format(pruned, 'y' if pruned == 1 else 'ies', height))
+
+
+if __name__ == '__main__':
+    main(run)
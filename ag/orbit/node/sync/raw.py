@@ -0,0 +1,194 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from bitcash.cashaddress import Address
+from bitcash.format import public_key_to_address
+
+from decimal import Decimal
+from functools import lru_cache
+from hashlib import sha256
+
+
+OP_PUSHDATA1 = 0x4c
+OP_PUSHDATA2 = 0x4d
+OP_PUSHDATA4 = 0x4e
+OP_RETURN = 0x6a
+OP_DUP = 0x76
+OP_HASH160 = 0xa9
+OP_EQUAL = 0x87
+OP_EQUALVERIFY = 0x88
+OP_CHECKSIG = 0xac
+OP_CHECKMULTISIG = 0xae
+OP_1 = 0x51
+OP_16 = 0x60
+
+HEADER_SIZE = 80
+NULL_TXID = bytes(32)
+
+ORBIT_PREFIX = b'\x42\x81' # leading bytes of all ORBIT data
+
+
+def _dsha256(data):
+    return sha256(sha256(data).digest()).digest()
+
+def _varint(data, pos):
+    size = data[pos]
+
+    if size < 0xfd:
+        return size, pos + 1
+
+    if size == 0xfd:
+        end = pos + 3
+    elif size == 0xfe:
+        end = pos + 5
+    else:
+        end = pos + 9
+
+    return int.from_bytes(data[pos+1:end], 'little'), end
+
+@lru_cache(maxsize=1024)
+def address_script(address):
+    # the locking script paying to a cashaddr, for matching outputs without decoding them
+    address = Address.from_string(address)
+    payload = bytes(address.payload)
+
+    if address.version.startswith('P2PKH'):
+        return bytes((OP_DUP, OP_HASH160, 20)) + payload + bytes((OP_EQUALVERIFY, OP_CHECKSIG))
+
+    return bytes((OP_HASH160, 20)) + payload + bytes((OP_EQUAL,))
+
+def orbit_candidate(script):
+    # whether an OP_RETURN script can carry ORBIT data: a data push whose payload, read the way validation reads it
+    #   (everything after the push opcode), starts with the ORBIT prefix; this only narrows what reaches the parser
+    return (len(script) >= 2 + len(ORBIT_PREFIX) and script[0] == OP_RETURN and 0 < script[1] <= OP_PUSHDATA4
+            and script[2:2+len(ORBIT_PREFIX)] == ORBIT_PREFIX)
+
+def decode_script(script):
+    # returns (type, addresses) using the same names bitcoind gives in scriptPubKey
+    size = len(script)
+
+    if size and script[0] == OP_RETURN:
+        return 'nulldata', None
+
+    if (size == 25 and script[0] == OP_DUP and script[1] == OP_HASH160 and script[2] == 20
+            and script[23] == OP_EQUALVERIFY and script[24] == OP_CHECKSIG):
+        return 'pubkeyhash', [ Address('P2PKH', list(script[3:23])).cash_address() ]
+
+    if size == 23 and script[0] == OP_HASH160 and script[1] == 20 and script[22] == OP_EQUAL:
+        return 'scripthash', [ Address('P2SH', list(script[2:22])).cash_address() ]
+
+    if size in (35, 67) and script[0] == size - 2 and script[-1] == OP_CHECKSIG:
+        return 'pubkey', [ public_key_to_address(bytes(script[1:-1])) ]
+
+    if size > 3 and script[-1] == OP_CHECKMULTISIG and OP_1 <= script[0] <= OP_16 and OP_1 <= script[-2] <= OP_16:
+        addresses = []
+        pos = 1
+
+        while pos < size - 2:
+            keysize = script[pos]
+            if keysize not in (33, 65):
+                return 'nonstandard', None
+
+            addresses.append(public_key_to_address(bytes(script[pos+1:pos+1+keysize])))
+            pos += 1 + keysize
+
+        if pos == size - 2 and len(addresses) == script[-2] - OP_1 + 1:
+            return 'multisig', addresses
+
+    return 'nonstandard', None
+
+
+class RawBlock():
+
+    # a serialized block (as returned by `getblock <hash> 0`) that is walked lazily through a memoryview;
+    #   only transactions accepted by the caller are decoded into the (partial) bitcoind JSON layout
+    #   that Process.next() and Process.save_tx_row() consume
+
+    def __init__(self, data, blockhash, confirmations):
+        self.data = memoryview(data)
+        self.hash = blockhash
+        self.confirmations = confirmations
+
+        self.skipped = 0 # outputs of transactions that were never decoded
+
+        header = self.data[:HEADER_SIZE]
+        if _dsha256(header)[::-1].hex() != blockhash:
+            raise ValueError('Raw block data does not match block hash {}'.format(blockhash))
+
+        self.count, self.start = _varint(self.data, HEADER_SIZE)
+
+    def __len__(self):
+        return self.count
+
+    def transactions(self, relevant):
+        # yields only the transactions with at least one output for which relevant(value, script) is true
+        data = self.data
+        pos = self.start
+
+        for i in range(self.count):
+            start = pos
+            pos += 4 # version
+
+            inputs, pos = _varint(data, pos)
+            vin = []
+
+            for j in range(inputs):
+                prevout = pos
+                pos += 36 # prevout hash and index
+
+                size, pos = _varint(data, pos)
+                vin.append((prevout, pos, pos + size))
+                pos += size + 4 # script and sequence
+
+            outputs, pos = _varint(data, pos)
+            vout = []
+            wanted = False
+
+            for j in range(outputs):
+                value = int.from_bytes(data[pos:pos+8], 'little')
+                size, pos = _varint(data, pos + 8)
+                script = data[pos:pos+size]
+                pos += size
+
+                if not wanted and relevant(value, script):
+                    wanted = True
+
+                vout.append((value, script))
+
+            pos += 4 # locktime
+
+            if wanted:
+                yield self._decode(data[start:pos], vin, vout)
+            else:
+                self.skipped += outputs
+
+    def _decode(self, raw, vin, vout):
+        data = self.data
+        txins = []
+
+        for prevout, begin, end in vin:
+            prevhash = data[prevout:prevout+32]
+            script = data[begin:end].hex()
+
+            if prevhash == NULL_TXID:
+                txins.append({ 'coinbase': script })
+            else:
+                txins.append({ 'txid': bytes(prevhash[::-1]).hex(), 'scriptSig': { 'hex': script } })
+
+        txouts = []
+
+        for value, script in vout:
+            stype, addresses = decode_script(script)
+
+            pubkey = { 'hex': script.hex(), 'type': stype }
+            if addresses is not None:
+                pubkey['addresses'] = addresses
+
+            txouts.append({ 'value': Decimal(value).scaleb(-8), 'scriptPubKey': pubkey })
+
+        return {
+            'txid': _dsha256(raw)[::-1].hex(),
+            'confirmations': self.confirmations,
+            'vin': txins,
+            'vout': txouts
+        }
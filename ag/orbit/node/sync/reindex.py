@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.command import main
+from ag.orbit.node.sync import Process
+
+
+def run(args):
+    if args is not None and len(args) > 0:
+        raise ValueError("Not expecting any arguments")
+
+    print()
+    print('Reindex token state from stored transactions...')
+    print()
+
+    # no node is needed
+    sync = Process(None)
+
+    try:
+        count, changed = sync.reindex()
+
+    finally:
+        sync.close()
+
+    print()
+    sync.print_stats()
+
+    print()
+    print('Replayed {} block{}'.format(count, '' if count == 1 else 's'))
+
+    if changed:
+        print('Orbit hash changed for {} block{}, first at block {}'.format(
+                len(changed), '' if len(changed) == 1 else 's', changed[0]))
+    else:
+        print('Orbit hash chain unchanged')
+
+
+if __name__ == '__main__':
+    main(run)
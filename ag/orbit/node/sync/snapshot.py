@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.command import main
+from ag.orbit.node.db import TokenDB
+from ag.orbit.node import snapshot
+from ag.orbit.node.sync.compare import fetch_orbits
+
+from sys import stdout
+from os import path
+from time import time
+
+
+def run(args):
+    if not args or args[0] not in ('export', 'import'):
+        raise ValueError("Expecting: export <file> [<height>], or:"
+                " import <file> <peer URL | orbit hash> [<state root> <state digest>]")
+
+    action = args[0]
+    args = args[1:]
+
+    if action == 'export' and len(args) not in (1, 2):
+        raise ValueError("Expecting: export <file> [<height>]")
+
+    if action == 'import' and len(args) not in (2, 4):
+        raise ValueError("Expecting: import <file> <peer URL | orbit hash> [<state root> <state digest>]")
+
+    print()
+
+    if action == 'export':
+        export(args[0], int(args[1]) if len(args) > 1 else None)
+    else:
+        load(*args)
+
+def export(filename, height=None):
+    print('Exporting token state to {}...'.format(filename))
+
+    began = time()
+
+    # read-only, so a running sync carries on while the snapshot is written
+    tokens = TokenDB(readonly=True)
+    try:
+        height, orbit, root, state, rows = snapshot.export(tokens, filename, height)
+
+    finally:
+        tokens.close()
+
+    print()
+    print('Exported {} rows at block {} in {:.1f}s ({:.1f} MiB)'.format(rows, height, time() - began,
+            path.getsize(filename) / 1048576))
+    print('    Orbit hash: {}'.format(orbit.hex()))
+    print('    State root: {}'.format(root.hex()))
+    print('    State digest: {}'.format(state.hex()))
+
+def load(filename, trusted, root=None, state=None):
+    # the snapshot is checked against what a trusted peer has at its height, or against a known orbit hash
+    #   (with the state root and digest, so that the state is checked and not just the blocks)
+    if '://' in trusted:
+        if root is not None:
+            raise ValueError("Only give a state root and digest with an orbit hash; the peer provides them")
+
+        height = snapshot.header(filename)['height']
+
+        print('Fetching the orbit hash, state root and state digest at block {} from {}...'.format(height, trusted))
+
+        peer = fetch_orbits(trusted.rstrip('/'), [height])
+
+        orbit = peer['orbits'].get(str(height))
+        root = peer.get('roots', {}).get(str(height))
+        state = peer.get('states', {}).get(str(height))
+
+        if orbit is None:
+            raise ValueError("The peer has no orbit hash at block {}".format(height))
+
+        print()
+
+    else:
+        orbit = trusted
+
+    print('Importing token state from {}...'.format(filename))
+
+    began = time()
+
+    tokens = TokenDB(auto_commit=False)
+    try:
+        height, orbit, loaded_root, loaded_state, rows = snapshot.load(tokens, filename, stdout, orbit, root, state)
+
+    finally:
+        tokens.close()
+
+    print()
+    print('Imported {} rows at block {} in {:.1f}s'.format(rows, height, time() - began))
+    print('    Orbit hash: {} (as expected)'.format(orbit.hex()))
+    print('    State root: {}{}'.format(loaded_root.hex(), ' (as expected)' if root else ''))
+    print('    State digest: {}{}'.format(loaded_state.hex(), ' (as expected)' if state else ''))
+
+    if root is None or state is None:
+        print()
+        print('The token state was only checked against the state root and digest in the snapshot itself; give the')
+        print('expected ones too, or import from a peer that has them, to check it against a trusted source.')
+
+    print()
+    print('Syncing carries on from block {}.'.format(height + 1))
+
+if __name__ == '__main__':
+    main(run)
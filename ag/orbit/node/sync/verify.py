@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.command import main
+from ag.orbit.node.db import TokenDB
+from ag.orbit.node.sync import Process
+
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from time import time
+
+
+# blocks handed to each worker at a time
+CHUNK = 500
+
+LAUNCH = b'\x42\x81' # what the launch block's orbit hash is chained to
+
+
+def run(args):
+    if args and args[0] == 'replay':
+        if len(args) > 1:
+            raise ValueError("Not expecting any arguments after: replay")
+
+        replay()
+
+    else:
+        start = None
+        end = None
+
+        args = list(args) if args else []
+        while args:
+            option = args.pop(0)
+
+            if option not in ('--from', '--to') or not args:
+                raise ValueError("Expecting: [--from <height>] [--to <height>], or: replay")
+
+            if option == '--from':
+                start = int(args.pop(0))
+            else:
+                end = int(args.pop(0))
+
+        audit(start, end)
+
+def _audit(start, end):
+    # runs in a worker process with its own read-only connection
+    tokens = TokenDB(readonly=True)
+
+    try:
+        return tokens.audit_blocks(start, end)
+
+    finally:
+        tokens.close()
+
+def audit(start=None, end=None):
+    # block content digests only depend on the journal, so they are recomputed in parallel;
+    #   each is then chained to the stored orbit hash of the block before it and compared
+    tokens = TokenDB(readonly=True)
+
+    try:
+        first, last = tokens.get_block_range()
+        if first is None:
+            raise ValueError("No blocks have been synced")
+
+        journal = tokens.get_journal_start()
+
+        if start is None:
+            start = max(first, journal) if journal is not None else first
+        else:
+            # there's nothing before the first synced block to chain to
+            start = max(start, first)
+
+            if journal is not None and start < journal:
+                raise ValueError("The change journal only covers blocks from {} (see `orbit-node sync prune`)".format(journal))
+
+        if end is None or end > last:
+            end = last
+
+        orbits = dict(tokens.get_orbits_between(start - 1, end))
+
+    finally:
+        tokens.close()
+
+    if start > end:
+        raise ValueError("Nothing to verify between blocks {} and {}".format(start, end))
+
+    if start == first:
+        prev = LAUNCH
+    else:
+        prev = orbits.get(start - 1)
+
+    print()
+    print('Verifying blocks {} to {}...'.format(start, end))
+
+    chunks = list(range(start, end + 1, CHUNK))
+
+    began = time()
+    verified = 0
+    mismatch = None
+    rows = []
+
+    pool = ProcessPoolExecutor()
+
+    try:
+        for results in pool.map(_audit, chunks, [ min(lo + CHUNK - 1, end) for lo in chunks ]):
+            for height, content, mismatched in results:
+                orbit = orbits[height]
+
+                if prev is None or sha256(sha256(prev + content).digest()).digest() != orbit:
+                    mismatch = height
+                    break
+
+                rows.extend((height, table, rowid) for table, rowid in mismatched)
+
+                verified += 1
+                prev = orbit
+
+            if mismatch is not None:
+                break
+
+            elapsed = time() - began
+            print('    {}... ({:.1f} blocks/s)'.format(height, verified / elapsed if elapsed else 0.0), flush=True)
+
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    elapsed = time() - began
+
+    print()
+    print('Verified {} block{} in {:.1f}s ({:.1f} blocks/s)'.format(verified, '' if verified == 1 else 's',
+            elapsed, verified / elapsed if elapsed else 0.0))
+
+    for height, table, rowid in rows[:10]:
+        print('    Row does not match its journaled digest: {} {} (block {})'.format(table, rowid, height))
+
+    if mismatch is not None:
+        raise ValueError("Orbit hash mismatch at block {}".format(mismatch))
+
+    if rows:
+        raise ValueError("{} row{} not match the journal".format(len(rows), ' does' if len(rows) == 1 else 's do'))
+
+def replay():
+    print()
+    print('Verify the orbit hash chain by replaying stored transactions...')
+    print()
+
+    # replayed on an in-memory copy so the database itself is left untouched
+    sync = Process(None, copy=True)
+
+    try:
+        count, changed = sync.reindex()
+
+    finally:
+        sync.close()
+
+    print()
+
+    if changed:
+        raise ValueError("Orbit hash mismatch from block {} ({} of {} blocks differ)".format(changed[0], len(changed), count))
+
+    print('Verified {} block{}: every orbit hash matches the recorded chain'.format(count, '' if count == 1 else 's'))
+
+
+if __name__ == '__main__':
+    main(run)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+#
+# Measures the latency of web API queries while the sync is processing blocks.
+#
+#   usage: etc/bench-concurrency.py [wal|rollback] [<blocks> [<transfers per block> [<readers>]]]
+#
+# Runs against a scratch database in a temporary directory. "rollback" reproduces the old setup (rollback
+#   journal with an exclusive write transaction per block) for comparison.
+
+from os import environ
+from sys import argv
+from tempfile import mkdtemp
+from shutil import rmtree
+
+# before anything reads the config
+scratch = mkdtemp(prefix='orbit-bench-')
+environ['ORBIT_NODE_DIR'] = scratch
+
+from ag.orbit.node.db import TokenDB
+
+from threading import Thread, Event
+from random import Random
+from time import time, sleep
+import sqlite3
+
+
+PAUSE = 0.001 # seconds each reader waits between queries
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(p * len(values) / 100))] if values else 0.0
+
+def reader(done, addresses, latencies, errors, seed):
+    tokens = TokenDB(readonly=True)
+    rnd = Random(seed)
+
+    try:
+        while not done.is_set():
+            began = time()
+
+            try:
+                tokens.get_user_tokens(rnd.choice(addresses))
+                latencies.append((time() - began) * 1000)
+
+            except sqlite3.OperationalError:
+                errors.append((time() - began) * 1000)
+
+            sleep(PAUSE)
+
+    finally:
+        tokens.close()
+
+def main():
+    args = argv[1:]
+
+    mode = args.pop(0) if args and args[0] in ('wal', 'rollback') else 'wal'
+    blocks = int(args[0]) if len(args) > 0 else 200
+    transfers = int(args[1]) if len(args) > 1 else 200
+    readers = int(args[2]) if len(args) > 2 else 4
+
+    tokens = TokenDB(auto_commit=False)
+
+    if mode == 'rollback':
+        tokens.conn.execute('''PRAGMA journal_mode = DELETE''')
+        tokens.conn.isolation_level = 'EXCLUSIVE'
+        tokens.checkpoint = 0
+
+    rnd = Random(1)
+    addresses = [ 'address{}'.format(i) for i in range(1000) ]
+
+    # every address starts out with plenty to send
+    blockrow = tokens.save_block('{:064x}'.format(0), 0)
+    txrow = tokens.save_tx('{:064x}'.format(0), blockrow, 1)
+    tokens.token_create('token', txrow, blockrow, 10 ** 12, 0, 'BENCH')
+
+    for tx, address in enumerate(addresses, 1):
+        txrow = tokens.save_tx('{:064x}'.format(tx), blockrow, 1)
+        tokens.token_transfer('token', txrow, blockrow, 'token', address, 10 ** 6)
+
+    tokens.hash(blockrow)
+    tokens.set_last_block(0)
+    tokens.commit()
+
+    done = Event()
+    latencies = [ [] for i in range(readers) ]
+    errors = [ [] for i in range(readers) ]
+
+    threads = [ Thread(target=reader, args=(done, addresses, latencies[i], errors[i], i)) for i in range(readers) ]
+    for thread in threads:
+        thread.start()
+
+    print('{} mode: {} blocks of {} transfers with {} concurrent reader{}...'.format(
+            mode, blocks, transfers, readers, '' if readers == 1 else 's'))
+
+    began = time()
+
+    try:
+        for height in range(1, blocks + 1):
+            blockrow = tokens.save_block('{:064x}'.format(height), height)
+
+            for i in range(transfers):
+                tx += 1
+                txrow = tokens.save_tx('{:064x}'.format(tx), blockrow, 1)
+                tokens.token_transfer('token', txrow, blockrow, *rnd.sample(addresses, 2), 1)
+
+            tokens.hash(blockrow)
+            tokens.set_last_block(height)
+            tokens.commit()
+
+        elapsed = time() - began
+
+    finally:
+        done.set()
+        for thread in threads:
+            thread.join()
+
+        tokens.close()
+
+    queries = sorted(ms for values in latencies for ms in values)
+    failed = sum(len(values) for values in errors)
+
+    print()
+    print('Sync: {:.1f} blocks/s'.format(blocks / elapsed))
+    print('Queries: {} ({:.0f}/s), {} failed'.format(len(queries), len(queries) / elapsed, failed))
+    print('Query latency (ms): p50 {:.2f}, p99 {:.2f}, max {:.2f}'.format(
+            percentile(queries, 50), percentile(queries, 99), queries[-1] if queries else 0.0))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+
+    finally:
+        rmtree(scratch, ignore_errors=True)
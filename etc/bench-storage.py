@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+#
+# Compares the token database before and after the compact storage migration: hex hashes and scripts with
+#   repeated address strings, against BLOBs and an interned address dictionary.
+#
+#   usage: etc/bench-storage.py [<blocks> [<transactions per block> [<addresses>]]]
+#
+# Runs against a scratch database in a temporary directory. Both layouts are vacuumed before they are measured.
+#   Python's sqlite3 doesn't expose the page cache hit counters, so how well each layout caches is shown by how
+#   many rows fit in a page and by random lookups through a small page cache.
+
+from os import environ, path
+from sys import argv
+from tempfile import mkdtemp
+from shutil import rmtree, copyfile
+
+# before anything reads the config
+scratch = mkdtemp(prefix='orbit-bench-')
+environ['ORBIT_NODE_DIR'] = scratch
+
+from ag.orbit.node.db import TokenDB
+
+from random import Random
+from time import time
+import sqlite3
+
+
+CACHE = 256         # pages of cache for the lookups (1 MiB)
+LOOKUPS = 20000     # of each kind
+
+TABLES = ('block', 'tx', 'txin', 'txout', 'balance', 'transfer', 'registration', 'address')
+
+# the same lookups in each layout: a user's balances, and a transaction by hash
+LEGACY = ('''SELECT t.address, b.units FROM balance b
+             LEFT JOIN token t ON t.rowid = b.token
+             WHERE b.address = ?''',
+          '''SELECT rowid, block FROM tx WHERE hash = ?''')
+COMPACT = ('''SELECT t.address, b.units FROM balance b
+              LEFT JOIN token t ON t.rowid = b.token
+              WHERE b.address = (SELECT rowid FROM address WHERE address = ?)''',
+           '''SELECT rowid, block FROM tx WHERE hash = ?''')
+
+
+def populate(conn, blocks, txs, addresses, rnd):
+    # a synced database in the layout from before the migration: every hash and script in hex, and addresses
+    #   spelled out in every balance and transfer
+    conn.execute('''INSERT INTO token (address, tx, created, updated, supply, decimals, symbol)
+                    VALUES ('token', 1, 1, 1, 1000000000000, 0, 'BENCH')''')
+
+    conn.executemany('''INSERT INTO balance (address, token, updated, units, available) VALUES (?, 1, 1, 1000000, 1000000)''',
+                     [ (address,) for address in addresses ])
+
+    tx = 0
+
+    for height in range(blocks):
+        blockrow = conn.execute('''INSERT INTO block (hash, height) VALUES (?, ?)''',
+                                (rnd.getrandbits(256).to_bytes(32, 'big').hex(), height)).lastrowid
+
+        for i in range(txs):
+            tx += 1
+            txrow = conn.execute('''INSERT INTO tx (hash, block, confirmations) VALUES (?, ?, 1)''',
+                                 (rnd.getrandbits(256).to_bytes(32, 'big').hex(), blockrow)).lastrowid
+
+            # a P2PKH input (signature and public key) and outputs paying an address and carrying ORBIT data
+            conn.execute('''INSERT INTO txin (hash, tx, asmhex) VALUES (?, ?, ?)''',
+                         (rnd.getrandbits(256).to_bytes(32, 'big').hex(), txrow, rnd.randbytes(107).hex()))
+            conn.execute('''INSERT INTO txout (tx, value, type, addresses, asmhex) VALUES (?, 546, 'pubkeyhash', ?, ?)''',
+                         (txrow, rnd.choice(addresses), ('76a914' + rnd.randbytes(20).hex() + '88ac')))
+            conn.execute('''INSERT INTO txout (tx, value, type, addresses, asmhex) VALUES (?, 0, 'nulldata', NULL, ?)''',
+                         (txrow, '6a' + rnd.randbytes(40).hex()))
+
+            addr_from, addr_to = rnd.sample(addresses, 2)
+            conn.execute('''INSERT INTO transfer (tx, created, addr_from, addr_to, units) VALUES (?, ?, ?, ?, 1)''',
+                         (txrow, blockrow, addr_from, addr_to))
+
+    conn.commit()
+
+def measure(filename):
+    conn = sqlite3.connect(filename)
+    conn.execute('''VACUUM''')
+
+    size = path.getsize(filename)
+    tables = {}
+    pages = {}
+
+    try:
+        # bytes used by each table with its indexes, and pages of the table itself
+        for table, name, used, count in conn.execute('''SELECT m.tbl_name, m.name, SUM(s.pgsize), COUNT(*)
+                                                        FROM dbstat s
+                                                        LEFT JOIN sqlite_master m ON m.name = s.name
+                                                        GROUP BY m.name'''):
+            tables[table] = tables.get(table, 0) + used
+
+            if name == table:
+                pages[table] = count
+
+    except sqlite3.OperationalError:
+        # SQLite built without the dbstat table
+        pass
+
+    rows = { table: conn.execute('''SELECT COUNT(*) FROM {}'''.format(table)).fetchone()[0]
+             for table in TABLES if conn.execute('''SELECT 1 FROM sqlite_master WHERE name = ?''', (table,)).fetchone() }
+
+    conn.close()
+
+    return size, tables, pages, rows
+
+def lookups(filename, queries, addresses, hashes, rnd):
+    conn = sqlite3.connect(filename)
+    conn.execute('''PRAGMA cache_size = {}'''.format(CACHE))
+
+    results = []
+
+    for query, keys in zip(queries, (addresses, hashes)):
+        began = time()
+
+        for i in range(LOOKUPS):
+            conn.execute(query, (rnd.choice(keys),)).fetchall()
+
+        results.append(LOOKUPS / (time() - began))
+
+    conn.close()
+
+    return results
+
+def main():
+    args = argv[1:]
+
+    blocks = int(args[0]) if len(args) > 0 else 2000
+    txs = int(args[1]) if len(args) > 1 else 50
+    count = int(args[2]) if len(args) > 2 else 20000
+
+    rnd = Random(1)
+    addresses = [ 'bitcoincash:q' + ''.join(rnd.choice('qpzry9x8gf2tvdw0s3jn54khce6mua7l') for c in range(41))
+                  for i in range(count) ]
+
+    # the schema as it was before the compact storage migration
+    compact = TokenDB.MIGRATIONS
+    TokenDB.MIGRATIONS = compact[:compact.index('_migrate_compact')]
+
+    print('Populating {} blocks of {} transactions between {} addresses...'.format(blocks, txs, count))
+
+    tokens = TokenDB()
+    populate(tokens.conn, blocks, txs, addresses, rnd)
+
+    hashes = [ row[0] for row in tokens.conn.execute('''SELECT hash FROM tx ORDER BY RANDOM() LIMIT 10000''') ]
+    tokens.close()
+
+    legacy = path.join(scratch, 'legacy.db')
+    copyfile(path.join(scratch, 'tokens.db'), legacy)
+
+    print('Migrating...')
+
+    TokenDB.MIGRATIONS = compact
+
+    began = time()
+    tokens = TokenDB()
+    tokens.close()
+    migrated = time() - began
+
+    before = measure(legacy)
+    after = measure(path.join(scratch, 'tokens.db'))
+
+    print()
+    print('Migration: {:.1f}s'.format(migrated))
+    print()
+    print('{:<14}{:>14}{:>14}{:>10}'.format('', 'hex (KiB)', 'compact (KiB)', 'change'))
+
+    for table in TABLES + (None,):
+        if table is None:
+            name, old, new = 'total file', before[0], after[0]
+        elif table in before[1] or table in after[1]:
+            name, old, new = table, before[1].get(table, 0), after[1].get(table, 0)
+        else:
+            continue
+
+        print('{:<14}{:>14.0f}{:>14.0f}{:>10}'.format(name, old / 1024, new / 1024,
+                '{:.0f}%'.format((new - old) * 100 / old) if old else 'new'))
+
+    print()
+    print('{:<14}{:>14}{:>14}'.format('rows per page', 'hex', 'compact'))
+
+    for table in ('block', 'tx', 'txin', 'txout', 'balance', 'transfer'):
+        if table in before[2] and table in after[2]:
+            print('{:<14}{:>14.1f}{:>14.1f}'.format(table, before[3][table] / before[2][table],
+                    after[3][table] / after[2][table]))
+
+    old = lookups(legacy, LEGACY, addresses, hashes, Random(2))
+    new = lookups(path.join(scratch, 'tokens.db'), COMPACT, addresses, [ bytes.fromhex(h) for h in hashes ], Random(2))
+
+    print()
+    print('Lookups/s through a {} page cache:'.format(CACHE))
+    print('    Balances by address: {:.0f} hex, {:.0f} compact'.format(old[0], new[0]))
+    print('    Transactions by hash: {:.0f} hex, {:.0f} compact'.format(old[1], new[1]))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+
+    finally:
+        rmtree(scratch, ignore_errors=True)
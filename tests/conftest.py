@@ -0,0 +1,13 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.node import config
+
+import pytest
+
+
+@pytest.fixture
+def node_dir(tmp_path, monkeypatch):
+    # a fresh node directory, so each test gets its own token database
+    monkeypatch.setattr(config, 'dir', str(tmp_path))
+    return tmp_path
@@ -0,0 +1,191 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.node import config
+from ag.orbit.node.db import TokenDB
+
+from test_plans import populate
+
+from random import Random
+from hashlib import sha256
+
+
+LAUNCH = 100
+
+# (begins, delivers, ends, available, maximum): a faucet that ends with units left over, then one that is
+#   fully claimed before it ends
+ADVERTISEMENTS = [ (101, 103, 105, 300, 100), (106, 106, 108, 50, 50) ]
+
+# height -> [ (user, units) ] registered in the block
+REGISTRATIONS = { 101: [ ('alice', 100), ('bob', 50) ], 106: [ ('carol', 50) ] }
+
+
+def block(tokens, height):
+    blockrow = tokens.save_block(sha256(height.to_bytes(4, 'big')).hexdigest(), height)
+    tokens.get_active_registrations_map(blockrow)
+
+    return blockrow
+
+def tx(tokens, blockrow, n):
+    return tokens.save_tx(sha256(bytes((blockrow, n))).hexdigest(), blockrow, 1)
+
+def advertise(tokens, blockrow):
+    # returns the advertisement rowids
+    tokens.flush()
+    conn = tokens.conn
+    advertisements = []
+
+    conn.executemany('''INSERT OR IGNORE INTO address (address) VALUES (?)''', [ ('alice',), ('bob',), ('carol',) ])
+
+    for n, (begins, delivers, ends, available, maximum) in enumerate(ADVERTISEMENTS):
+        advertisement = conn.execute('''INSERT INTO advertisement
+                                        (tx, token, created, updated, begins, ends, delivers, available, claimed,
+                                            rate, minimum, maximum)
+                                        VALUES (?, 1, ?, ?, ?, ?, ?, ?, 0, 0, 1, ?)''',
+                                        (tx(tokens, blockrow, n + 1), blockrow, blockrow, begins, ends, delivers,
+                                            available, maximum)).lastrowid
+        advertisements.append(advertisement)
+
+        conn.executemany('''INSERT INTO schedule (height, advertisement, event) VALUES (?, ?, ?)''',
+                         [ (delivers, advertisement, TokenDB.DELIVER), (ends, advertisement, TokenDB.END) ])
+
+        tokens._update_balance(conn.cursor(), 1, 'owner', blockrow, 0, -available)
+
+        # an earlier registration by each user, long since finished
+        for i, user in enumerate(('alice', 'bob', 'carol')):
+            conn.execute('''INSERT INTO registration
+                            (tx, address, advertisement, created, updated, finished, maximum, payments, claimed)
+                            VALUES (?, (SELECT rowid FROM address WHERE address = ?), ?, ?, ?, ?, 0, 0, 0)''',
+                            (tx(tokens, blockrow, 10 * (n + 1) + i), user, advertisement, blockrow, blockrow, blockrow))
+
+    return advertisements
+
+def available(tokens, user):
+    tokens.flush()
+
+    balance = tokens.conn.execute('''SELECT b.available FROM balance b
+                                     LEFT JOIN address a ON a.rowid = b.address
+                                     WHERE a.address = ?''',
+                                     (user,)).fetchone()
+
+    return balance[0] if balance else None
+
+def finished(tokens, advertisement):
+    return tokens.conn.execute('''SELECT b.height FROM advertisement a
+                                  LEFT JOIN block b ON b.rowid = a.finished
+                                  WHERE a.rowid = ?''',
+                                  (advertisement,)).fetchone()[0]
+
+def test_deliveries_and_endings(node_dir):
+    # the rules since the schedule: units are delivered at the block whose height is the advertisement's
+    #   delivery height, and an advertisement is closed once, when it ends or is fully claimed
+    tokens = TokenDB(auto_commit=False)
+    seen = {}
+
+    try:
+        for height in range(LAUNCH, 110):
+            blockrow = block(tokens, height)
+
+            # block rowids count from 1, so a height is never mistaken for one
+            assert blockrow != height
+
+            if height == LAUNCH:
+                tokens.token_create('owner', tx(tokens, blockrow, 0), blockrow, 1000, 0, 'T')
+                first, second = advertise(tokens, blockrow)
+
+            for n, (user, units) in enumerate(REGISTRATIONS.get(height, [])):
+                tokens.token_register('owner', tx(tokens, blockrow, 100 + n), blockrow, user, units)
+
+            tokens.process_advertisements(blockrow)
+            tokens.hash(blockrow)
+            tokens.commit()
+
+            seen[height] = { user: available(tokens, user) for user in ('owner', 'alice', 'bob') }
+
+        # claimed as registered, but only available from the delivery block
+        assert [ seen[height]['alice'] for height in (101, 102, 103) ] == [ 0, 0, 100 ]
+        assert [ seen[height]['bob'] for height in (101, 102, 103) ] == [ 0, 0, 50 ]
+
+        # what nobody claimed goes back to the owner when the first one ends
+        assert seen[104]['owner'] == 1000 - 300 - 50
+        assert seen[105]['owner'] == 1000 - 150 - 50
+        assert finished(tokens, first) == 105
+
+        # the second is delivered and closed the block it was fully claimed, and not closed again when it ends
+        assert available(tokens, 'carol') == 50
+        assert finished(tokens, second) == 106
+        assert tokens.conn.execute('''SELECT COUNT(*) FROM registration WHERE finished IS NULL''').fetchone()[0] == 0
+
+    finally:
+        tokens.close()
+
+
+def reference(tokens, blockrow):
+    # process_advertisements() as it was before the schedule, with the same rules: every advertisement is looked
+    #   at every block
+    cursor = tokens.conn.cursor()
+    height = tokens._get_height(cursor, blockrow)
+
+    for advertisement, tokenrow in cursor.execute('''SELECT rowid, token FROM advertisement
+                                                     WHERE delivers = ?''',
+                                                     (height,)).fetchall():
+        claimed = {}
+
+        for address, units in cursor.execute('''SELECT u.address, r.claimed
+                                                FROM registration r
+                                                LEFT JOIN address u ON u.rowid = r.address
+                                                WHERE r.advertisement = ?''',
+                                                (advertisement,)):
+            claimed[address] = claimed.get(address, 0) + units
+
+        for address in sorted(claimed):
+            tokens._update_balance(cursor, tokenrow, address, blockrow, 0, claimed[address])
+
+    for advertisement, remaining, tokenrow, address in cursor.execute('''
+            SELECT a.rowid, a.available - a.claimed, t.rowid, t.address
+            FROM advertisement a
+            LEFT JOIN token t ON t.rowid = a.token
+            WHERE a.finished IS NULL AND (a.claimed = a.available OR a.ends = ?)
+            ORDER BY a.rowid''',
+            (height,)).fetchall():
+        cursor.execute('''UPDATE registration
+                          SET updated = ?, finished = ?
+                          WHERE advertisement = ? AND finished IS NULL''',
+                          (blockrow, blockrow, advertisement))
+
+        cursor.execute('''UPDATE advertisement
+                          SET updated = ?, finished = ?
+                          WHERE rowid = ?''',
+                          (blockrow, blockrow, advertisement))
+
+        tokens._advertisement_finished(advertisement)
+
+        if remaining:
+            tokens._update_balance(cursor, tokenrow, address, blockrow, 0, remaining)
+
+        tokens.eligible.clear()
+
+    tokens.claimed.clear()
+
+def orbits(tokens):
+    return tokens.conn.execute('''SELECT height, orbit FROM block ORDER BY height''').fetchall()
+
+def test_schedule_matches_reference(node_dir, monkeypatch):
+    # the schedule only changes which advertisements are looked at, never what happens to them
+    tokens = TokenDB(auto_commit=False)
+    try:
+        populate(tokens, Random(1))
+        scheduled = orbits(tokens)
+    finally:
+        tokens.close()
+
+    (node_dir / 'reference').mkdir()
+    monkeypatch.setattr(config, 'dir', str(node_dir / 'reference'))
+    monkeypatch.setattr(TokenDB, 'process_advertisements', reference)
+
+    tokens = TokenDB(auto_commit=False)
+    try:
+        populate(tokens, Random(1))
+        assert orbits(tokens) == scheduled
+    finally:
+        tokens.close()
@@ -0,0 +1,130 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.node.cache import BlockCache
+
+from test_raw import BLOCK, BLOCK_HASH
+
+from hashlib import sha256
+import os
+
+
+def blocks(count):
+    # (hash, height, raw) for some made-up blocks of different sizes
+    for height in range(100, 100 + count):
+        raw = os.urandom(64) * (height - 90)
+        yield sha256(raw).hexdigest(), height, raw
+
+def test_round_trip(node_dir):
+    stored = list(blocks(10)) + [ (BLOCK_HASH, 99993, BLOCK) ]
+
+    cache = BlockCache()
+    try:
+        assert cache.range() == (None, None, 0)
+
+        for blockhash, height, raw in stored:
+            assert cache.put(blockhash, height, raw)
+
+            # read back while the data file keeps growing
+            assert cache.get(blockhash) == raw
+            assert cache.get(stored[0][0]) == stored[0][2]
+
+        # already cached
+        assert not cache.put(BLOCK_HASH, 99993, BLOCK)
+
+    finally:
+        cache.close()
+
+    assert BlockCache.exists()
+
+    cache = BlockCache()
+    try:
+        assert cache.range() == (100, 99993, len(stored))
+        assert cache.size() == os.path.getsize(str(node_dir / BlockCache.DIR / BlockCache.DATA))
+
+        for blockhash, height, raw in stored:
+            assert cache.has(blockhash)
+            assert cache.get_hash(height) == blockhash
+            assert cache.get(blockhash) == raw
+
+        assert not cache.has('00' * 32)
+        assert cache.get('00' * 32) is None
+        assert cache.get_hash(99) is None
+
+    finally:
+        cache.close()
+
+def test_reorganized(node_dir):
+    cache = BlockCache()
+    try:
+        cache.put('aa' * 32, 100, b'first')
+        cache.put('bb' * 32, 100, b'second')
+
+        # only the block now at the height is kept
+        assert cache.get_hash(100) == 'bb' * 32
+        assert cache.get('aa' * 32) is None
+        assert cache.get('bb' * 32) == b'second'
+        assert cache.range() == (100, 100, 1)
+
+    finally:
+        cache.close()
+
+def test_truncated(node_dir):
+    stored = list(blocks(5))
+
+    cache = BlockCache()
+    try:
+        for blockhash, height, raw in stored:
+            cache.put(blockhash, height, raw)
+    finally:
+        cache.close()
+
+    # a crash before the last blocks reached the disk, leaving part of one
+    data = str(node_dir / BlockCache.DIR / BlockCache.DATA)
+    with open(data, 'r+b') as f:
+        f.truncate(os.path.getsize(data) - 10)
+
+    cache = BlockCache()
+    try:
+        assert cache.range() == (100, 103, 4)
+
+        for blockhash, height, raw in stored[:4]:
+            assert cache.get(blockhash) == raw
+
+        assert not cache.has(stored[4][0])
+        assert cache.get(stored[4][0]) is None
+
+        # and it can be cached again, after what's left of the partial one
+        assert cache.put(*stored[4])
+        assert cache.get(stored[4][0]) == stored[4][2]
+
+    finally:
+        cache.close()
+
+    cache = BlockCache()
+    try:
+        assert cache.range() == (100, 104, 5)
+        for blockhash, height, raw in stored:
+            assert cache.get(blockhash) == raw
+    finally:
+        cache.close()
+
+def test_damaged(node_dir):
+    cache = BlockCache()
+    try:
+        cache.put(BLOCK_HASH, 99993, BLOCK)
+    finally:
+        cache.close()
+
+    # written over in place, so the index still covers it
+    data = str(node_dir / BlockCache.DIR / BlockCache.DATA)
+    with open(data, 'r+b') as f:
+        f.seek(0)
+        f.write(bytes(16))
+
+    cache = BlockCache()
+    try:
+        assert cache.has(BLOCK_HASH)
+        assert cache.get(BLOCK_HASH) is None
+    finally:
+        cache.close()
@@ -0,0 +1,130 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.node import config
+from ag.orbit.node.db import TokenDB
+from ag.orbit.node.daemon.webapi import Server, ORBITS
+from ag.orbit.node.sync import compare
+
+from urllib.parse import urlencode
+from math import ceil, log
+import json
+import pytest
+
+
+LAUNCH = 100
+BLOCKS = 1000
+
+
+def build(path, blocks, diverge=None):
+    # a synced chain of empty blocks; from the divergent height on, the blocks are different ones
+    path.mkdir()
+    config.dir = str(path)
+
+    tokens = TokenDB(auto_commit=False)
+
+    for height in range(LAUNCH, LAUNCH + blocks):
+        fork = 1 if diverge is not None and height >= diverge else 0
+        blockrow = tokens.save_block('{:062x}{:02x}'.format(height, fork), height)
+        tokens.hash(blockrow)
+        tokens.set_last_block(height)
+
+    tokens.commit()
+    tokens.close()
+
+@pytest.fixture
+def nodes(node_dir, monkeypatch):
+    # compare(local, peer) between a local token database and a peer served by the web API of another node
+    #   directory, through the Flask test client; returns the result and the number of requests to the peer
+    opened = []
+
+    def nodes(local_blocks, peer_blocks, diverge=None):
+        build(node_dir / 'local', local_blocks)
+        build(node_dir / 'peer', peer_blocks, diverge)
+
+        config.dir = str(node_dir / 'local')
+        local = TokenDB(readonly=True)
+        opened.append(local)
+
+        # the peer's server opens its own connections to the peer's database
+        config.dir = str(node_dir / 'peer')
+        server = Server('127.0.0.1', 0)
+        client = server.flask.test_client()
+        opened.append(server.pool)
+
+        requests = []
+
+        def peer(url, heights):
+            requests.append(heights)
+            response = client.get('/{}?{}'.format(ORBITS, urlencode({ 'heights': ','.join(str(h) for h in heights) })))
+            assert response.status_code == 200
+            return json.loads(response.data.decode('utf-8'))[ORBITS]
+
+        monkeypatch.setattr(compare, 'fetch_orbits', peer)
+
+        return compare.compare(local, 'http://peer'), len(requests)
+
+    yield nodes
+
+    for each in opened:
+        each.close()
+
+
+def bound(blocks):
+    # the first and last heights, then each round trip narrows the search by SAMPLES + 1
+    return 2 + ceil(log(blocks, compare.SAMPLES + 1))
+
+@pytest.mark.parametrize('diverge', [ LAUNCH + 1, LAUNCH + 17, LAUNCH + 500, LAUNCH + 733, LAUNCH + BLOCKS - 1 ])
+def test_divergence(nodes, diverge):
+    (divergent, agreed, trips), requests = nodes(BLOCKS, BLOCKS, diverge)
+
+    assert divergent[0] == diverge
+    assert divergent[1] != divergent[2]
+    assert agreed == diverge - 1
+
+    assert trips == requests
+    assert trips <= bound(BLOCKS)
+
+def test_divergence_at_launch(nodes):
+    (divergent, agreed, trips), requests = nodes(BLOCKS, BLOCKS, LAUNCH)
+
+    assert divergent[0] == LAUNCH
+    assert agreed is None
+    assert trips == requests == 1
+
+def test_no_divergence(nodes):
+    (divergent, agreed, trips), requests = nodes(BLOCKS, BLOCKS)
+
+    assert divergent is None
+    assert agreed == LAUNCH + BLOCKS - 1
+    assert trips == requests == 1
+
+def test_peer_behind(nodes):
+    (divergent, agreed, trips), requests = nodes(BLOCKS, 600)
+
+    assert divergent is None
+    assert agreed == LAUNCH + 599
+    assert trips == requests == 2
+
+def test_peer_ahead(nodes):
+    (divergent, agreed, trips), requests = nodes(600, BLOCKS)
+
+    assert divergent is None
+    assert agreed == LAUNCH + 599
+    assert trips == requests == 1
+
+def test_peer_behind_divergent(nodes):
+    (divergent, agreed, trips), requests = nodes(BLOCKS, 600, LAUNCH + 321)
+
+    assert divergent[0] == LAUNCH + 321
+    assert agreed == LAUNCH + 320
+    assert trips == requests
+    assert trips <= bound(600) + 1
+
+def test_peer_ahead_divergent(nodes):
+    (divergent, agreed, trips), requests = nodes(600, BLOCKS, LAUNCH + 321)
+
+    assert divergent[0] == LAUNCH + 321
+    assert agreed == LAUNCH + 320
+    assert trips == requests
+    assert trips <= bound(600)
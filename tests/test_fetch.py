@@ -0,0 +1,81 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.node.rpc import RPC_TYPE_ERROR, RPC_INVALID_ADDRESS_OR_KEY
+from ag.orbit.node.sync.fetch import Fetcher, VERBOSE, RAWTX
+
+from bitcoinrpc.authproxy import JSONRPCException
+
+import pytest
+
+
+BLOCKHASH = '00' * 31 + '01'
+TXIDS = [ '{:064x}'.format(i) for i in range(3) ]
+
+
+class Node():
+
+    # getblock as a node gives it; a verbosity of 2 fails with the given error
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = []
+
+    def getblockhash(self, height):
+        return BLOCKHASH
+
+    def getblock(self, blockhash, *verbosity):
+        self.calls.append(('getblock',) + verbosity)
+
+        if verbosity == (2,):
+            if self.error:
+                raise JSONRPCException(self.error)
+
+            return { 'hash': blockhash, 'confirmations': 5, 'tx': [ { 'txid': txid } for txid in TXIDS ] }
+
+        return { 'hash': blockhash, 'confirmations': 5, 'tx': TXIDS }
+
+    def batch(self, calls, size):
+        self.calls.append(('batch', len(calls)))
+        return [ { 'txid': txid, 'confirmations': 5 } for method, txid, verbose in calls ]
+
+def test_verbose():
+    node = Node()
+    fetcher = Fetcher(node)
+
+    blockhash, block, txs = fetcher.fetch(100)
+    assert txs == [ { 'txid': txid, 'confirmations': 5 } for txid in TXIDS ]
+
+    assert fetcher.strategy == VERBOSE
+    assert node.calls == [ ('getblock', 2) ]
+
+@pytest.mark.parametrize('error', [
+    { 'code': -1, 'message': 'JSON value is not a boolean as expected' },
+    { 'code': RPC_TYPE_ERROR, 'message': 'Expected type bool, got number' },
+])
+def test_verbosity_not_supported(error):
+    # only the node lacking verbose getblock sends the fetcher to getrawtransaction, for good
+    node = Node(error)
+    fetcher = Fetcher(node)
+
+    for height in (100, 101):
+        blockhash, block, txs = fetcher.fetch(height)
+        assert txs == [ { 'txid': txid, 'confirmations': 5 } for txid in TXIDS ]
+
+    assert fetcher.strategy == RAWTX
+    assert node.calls == [ ('getblock', 2), ('getblock',), ('batch', 3), ('getblock',), ('batch', 3) ]
+
+@pytest.mark.parametrize('error', [
+    { 'code': RPC_INVALID_ADDRESS_OR_KEY, 'message': 'Block not found' },
+    { 'code': -1, 'message': 'Block not available (pruned data)' },
+])
+def test_other_errors(error):
+    # any other failure is the block's, so it's raised and verbose getblock is tried again next time
+    node = Node(error)
+    fetcher = Fetcher(node)
+
+    with pytest.raises(JSONRPCException):
+        fetcher.fetch(100)
+
+    assert fetcher.strategy == VERBOSE
+    assert node.calls == [ ('getblock', 2) ]
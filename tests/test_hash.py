@@ -0,0 +1,157 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.node import TokenError
+from ag.orbit.node.db import TokenDB
+
+from decimal import Decimal
+from hashlib import sha256
+
+
+# the row encoding and hashing from before the digests were streamed, as they were written
+
+def _hash(data):
+    return sha256(sha256(data).digest()).digest()
+
+def baseline_hash_rows(rows):
+    if not rows:
+        return b'\x00'
+
+    data = b'\x01'
+
+    for row in rows:
+        data += baseline_hash_cols(row)
+
+    data += b'\xFF'
+
+    return _hash(data)
+
+def baseline_hash_cols(cols):
+    data = '['
+
+    for col in cols:
+        if col:
+            data += '{}'.format(col)
+        data += '|'
+
+    data += ']'
+
+    return _hash(data.encode('utf-8'))
+
+
+ROWS = [
+    (),
+    (None,),
+    (0,),
+    ('',),
+    (None, None, None),
+    (1, 'bitcoincash:qpm2qsznhks23z7629mms6s4cwef74vcwvy22gdx6a', 2, 3, 1000000, 1000000),
+    (-5, -1000000, Decimal('-0.00000001'), Decimal('-12.5')),
+    (Decimal('0'), Decimal('0.0'), Decimal('1.50'), Decimal('1E+3'), Decimal('123456789.123456789')),
+    (0.0, 1.5, -2.25, 1e20),
+    (7, None, 'TOKEN', None, 'http://orbit.cash/token', '', 0, Decimal('-1')),
+    ('ünïcødé', '|', '[]', 'Y'),
+    (2 ** 63 - 1, -2 ** 63),
+]
+
+
+def test_row_encoding():
+    tokens = TokenDB.__new__(TokenDB)
+
+    for row in ROWS:
+        assert tokens._hash_cols(row) == baseline_hash_cols(row), row
+
+def test_rows_digest():
+    tokens = TokenDB.__new__(TokenDB)
+
+    for rows in (ROWS, ROWS[:1], ROWS[6:7], ROWS[::-1]):
+        assert tokens._hash_digests(tokens._hash_cols(row) for row in rows) == baseline_hash_rows(rows)
+
+    # an empty result set still came as a cursor, so it hashed as an empty list of rows
+    assert tokens._hash_digests([]) == _hash(b'\x01\xFF')
+
+
+# a recorded chain, from the launch block: (height, block hash, [ (tx hash, operation, arguments) ])
+CHAIN = [
+    (541000, '000000000000000000e9b7b5f2bc5c5ef4e8c53ac4bbc70e0bd1ee66c6d9dc7a', [
+        ('4f8d0b1ef3d5a1c2a6b1e0c9a4b8f7e6d5c4b3a291807f6e5d4c3b2a19080706', 'create',
+            ('bitcoincash:qpm2qsznhks23z7629mms6s4cwef74vcwvy22gdx6a', 2100000000000000, 8, 'ORB', 'Orbit Token',
+             'http://orbit.cash', None)),
+        ('a1b2c3d4e5f60718293a4b5c6d7e8f90a1b2c3d4e5f60718293a4b5c6d7e8f90', 'transfer',
+            ('bitcoincash:qpm2qsznhks23z7629mms6s4cwef74vcwvy22gdx6a',
+             'bitcoincash:qpm2qsznhks23z7629mms6s4cwef74vcwvy22gdx6a',
+             'bitcoincash:qr95sy3j9xwd2ap32xkykttr4cvcu7as4y0qverfuy', 50000000000)),
+    ]),
+    (541001, '0000000000000000016dfa2f8b9bd35c1f4a49b3d2e6e0f86c3a4f9e7f0d2c11', []),
+    (541002, '00000000000000000170c1e4a9d6b55e3e1d0a0c7a3b1f2e5d6c7b8a99887766', [
+        ('0f1e2d3c4b5a69788796a5b4c3d2e1f00f1e2d3c4b5a69788796a5b4c3d2e1f0', 'create',
+            ('bitcoincash:qr95sy3j9xwd2ap32xkykttr4cvcu7as4y0qverfuy', 1000, 0, 'ZERO', None, None, None)),
+        ('1111111111111111111111111111111111111111111111111111111111111111', 'transfer',
+            ('bitcoincash:qr95sy3j9xwd2ap32xkykttr4cvcu7as4y0qverfuy',
+             'bitcoincash:qr95sy3j9xwd2ap32xkykttr4cvcu7as4y0qverfuy',
+             'bitcoincash:qzl8jth497mtckku404cadsylwanm3rfxsx0g38nwl', 1000)),
+        ('2222222222222222222222222222222222222222222222222222222222222222', 'transfer',
+            ('bitcoincash:qpm2qsznhks23z7629mms6s4cwef74vcwvy22gdx6a',
+             'bitcoincash:qr95sy3j9xwd2ap32xkykttr4cvcu7as4y0qverfuy',
+             'bitcoincash:qzl8jth497mtckku404cadsylwanm3rfxsx0g38nwl', 50000000000)),
+        ('3333333333333333333333333333333333333333333333333333333333333333', 'transfer',
+            ('bitcoincash:qpm2qsznhks23z7629mms6s4cwef74vcwvy22gdx6a',
+             'bitcoincash:qr95sy3j9xwd2ap32xkykttr4cvcu7as4y0qverfuy',
+             'bitcoincash:qzl8jth497mtckku404cadsylwanm3rfxsx0g38nwl', 1)),
+    ]),
+    (541003, '000000000000000000b6a9d8c7e6f5a4b3c2d1e0f9a8b7c6d5e4f3a2b1c0d9e8', [
+        ('4444444444444444444444444444444444444444444444444444444444444444', 'transfer',
+            ('bitcoincash:qr95sy3j9xwd2ap32xkykttr4cvcu7as4y0qverfuy',
+             'bitcoincash:qzl8jth497mtckku404cadsylwanm3rfxsx0g38nwl',
+             'bitcoincash:qzl8jth497mtckku404cadsylwanm3rfxsx0g38nwl', 1)),
+        ('5555555555555555555555555555555555555555555555555555555555555555', 'transfer',
+            ('bitcoincash:qpm2qsznhks23z7629mms6s4cwef74vcwvy22gdx6a',
+             'bitcoincash:qzl8jth497mtckku404cadsylwanm3rfxsx0g38nwl',
+             'bitcoincash:qpm2qsznhks23z7629mms6s4cwef74vcwvy22gdx6a', 25000000000)),
+    ]),
+]
+
+# the orbit hashes the code from before the hashing changes gave for CHAIN
+ORBITS = [
+    '23ba88822cf342e67e9c1cd58bac088115eee1688b53449ea436f0fcb4f4d87c',
+    '1d4c63c1d0b0b5ee90764c9e486f920e09ffc934a575d28fdcaa139b24764ce2',
+    'aab8e791fdb9d8ce900034e013540b8c9931f7cc0e35ba45ce1e3471d81982ad',
+    '5f14ba687b638dcaf2311367d727e3d7d53167102008f1253f44ae4a47360365',
+]
+
+
+def replay(tokens):
+    orbits = []
+
+    for height, blockhash, txs in CHAIN:
+        blockrow = tokens.save_block(blockhash, height)
+
+        for txhash, op, args in txs:
+            txrow = tokens.save_tx(txhash, blockrow, 1)
+
+            try:
+                if op == 'create':
+                    address, supply, decimals, symbol, name, main_uri, image_uri = args
+                    tokens.token_create(address, txrow, blockrow, supply, decimals, symbol, name, main_uri, image_uri)
+                else:
+                    tokens.token_transfer(args[0], txrow, blockrow, *args[1:])
+
+            except TokenError:
+                pass
+
+        tokens.process_advertisements(blockrow)
+
+        orbits.append(bytes(tokens.hash(blockrow)).hex())
+        tokens.commit()
+
+    return orbits
+
+
+def test_recorded_chain(node_dir):
+    tokens = TokenDB(auto_commit=False)
+
+    try:
+        assert replay(tokens) == ORBITS
+
+    finally:
+        tokens.close()
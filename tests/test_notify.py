@@ -0,0 +1,31 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.node.daemon.notify import SocketListener, send, parse, SOCKET, DEFAULT_SOCKET
+
+from threading import Event
+
+
+def test_parse():
+    assert parse('socket') == (SOCKET, DEFAULT_SOCKET)
+    assert parse('socket:127.0.0.1:1234') == (SOCKET, ('127.0.0.1', 1234))
+
+def test_socket_listener():
+    # `orbit-node daemon notify` stands in for bitcoind -blocknotify
+    event = Event()
+    listen = SocketListener(event, ('127.0.0.1', 0))
+    listen.start()
+
+    try:
+        assert not event.is_set()
+
+        send(listen.sock.getsockname(), '00' * 32)
+
+        assert event.wait(5)
+        assert listen.notified == 1
+
+    finally:
+        listen.stop()
+        listen.join(5)
+
+    assert not listen.is_alive()
@@ -0,0 +1,169 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.node import config, TokenError
+from ag.orbit.node.db import TokenDB
+
+import sqlite3
+
+
+class RowByRow(TokenDB):
+
+    # every balance read and write goes straight to SQLite and every operation is flushed as it completes,
+    #   the way TokenDB worked before the block overlay
+
+    def _balance(self, cursor, tokenrow, address):
+        balance = cursor.execute('''SELECT rowid, updated, units, available FROM balance
+                                    WHERE token = ? AND address = (SELECT rowid FROM address WHERE address = ?)''',
+                                    (tokenrow, address)).fetchone()
+
+        return list(balance) if balance else None
+
+    def _insert_balance(self, cursor, tokenrow, address, blockrow, units, available):
+        self._intern(cursor, [ address ])
+
+        cursor.execute('''INSERT INTO balance
+                          (address, token, updated, units, available)
+                          VALUES ((SELECT rowid FROM address WHERE address = ?), ?, ?, ?, ?)''',
+                          (address, tokenrow, blockrow, units, available))
+
+    def _update_balance(self, cursor, tokenrow, address, blockrow, units, available):
+        cursor.execute('''UPDATE balance
+                          SET updated = ?, units = units + ?, available = available + ?
+                          WHERE token = ? AND address = (SELECT rowid FROM address WHERE address = ?)''',
+                          (blockrow, units, available, tokenrow, address))
+
+    def token_create(self, *args, **kwargs):
+        tokenrow = TokenDB.token_create(self, *args, **kwargs)
+        self.flush()
+        return tokenrow
+
+    def token_transfer(self, *args):
+        txrow = TokenDB.token_transfer(self, *args)
+        self.flush()
+        return txrow
+
+
+# (block, operation, arguments); a token's supply starts out with the address that created it
+STREAM = [
+    (0, 'create', ('alice', 1000)),
+    (0, 'transfer', ('alice', 'alice', 'bob', 300)),
+    (0, 'transfer', ('alice', 'bob', 'carol', 100)),
+    (0, 'transfer', ('alice', 'bob', 'bob', 50)),           # to self: rejected
+    (0, 'create', ('bob', 50)),
+    (0, 'transfer', ('bob', 'bob', 'alice', 50)),           # leaves bob with a zero balance
+    (0, 'transfer', ('bob', 'bob', 'carol', 1)),            # rejected: nothing left
+    (0, 'transfer', ('alice', 'carol', 'alice', 100)),      # carol's new balance goes back to zero
+    (1, 'transfer', ('alice', 'alice', 'dave', 800)),
+    (1, 'transfer', ('bob', 'bob', 'alice', 0)),            # from a zero balance
+    (1, 'transfer', ('alice', 'dave', 'carol', 801)),       # rejected: more than is available
+    (1, 'create', ('alice', 10)),                           # rejected: already defined
+    (2, 'transfer', ('bob', 'alice', 'erin', 25)),
+    (2, 'transfer', ('alice', 'dave', 'bob', 800)),
+    (2, 'transfer', ('carol', 'alice', 'bob', 1)),          # rejected: no such token
+    (2, 'transfer', ('bob', 'erin', 'alice', 25)),
+]
+
+
+def replay(tokens):
+    # returns the orbit hash of each block and whether each operation was accepted
+    hashes = []
+    accepted = []
+
+    blockrow = None
+    current = None
+
+    for i, (block, op, args) in enumerate(STREAM):
+        if block != current:
+            if blockrow is not None:
+                hashes.append(tokens.hash(blockrow))
+                tokens.commit()
+
+            blockrow = tokens.save_block('{:064x}'.format(block + 1), 100 + block)
+            current = block
+
+        txrow = tokens.save_tx('{:064x}'.format(i + 1000), blockrow, 1)
+
+        try:
+            if op == 'create':
+                address, supply = args
+                tokens.token_create(address, txrow, blockrow, supply, 0, address.upper())
+            else:
+                tokens.token_transfer(args[0], txrow, blockrow, *args[1:])
+
+            accepted.append(True)
+
+        except (TokenError, sqlite3.IntegrityError):
+            accepted.append(False)
+
+    hashes.append(tokens.hash(blockrow))
+    tokens.commit()
+
+    return hashes, accepted
+
+def contents(tokens):
+    balances = tokens.conn.execute('''SELECT b.rowid, t.address, a.address, b.updated, b.units, b.available
+                                      FROM balance b
+                                      LEFT JOIN token t ON t.rowid = b.token
+                                      LEFT JOIN address a ON a.rowid = b.address
+                                      ORDER BY b.rowid''').fetchall()
+
+    transfers = tokens.conn.execute('''SELECT x.rowid, x.tx, x.created, f.address, t.address, x.units
+                                       FROM transfer x
+                                       LEFT JOIN address f ON f.rowid = x.addr_from
+                                       LEFT JOIN address t ON t.rowid = x.addr_to
+                                       ORDER BY x.rowid''').fetchall()
+
+    return balances, transfers
+
+
+def test_overlay_matches_row_by_row(node_dir, monkeypatch):
+    monkeypatch.setattr(config, 'dir', str(node_dir / 'overlay'))
+    (node_dir / 'overlay').mkdir()
+    overlay = TokenDB(auto_commit=False)
+
+    monkeypatch.setattr(config, 'dir', str(node_dir / 'rows'))
+    (node_dir / 'rows').mkdir()
+    rows = RowByRow(auto_commit=False)
+
+    try:
+        hashes, accepted = replay(overlay)
+        expected_hashes, expected_accepted = replay(rows)
+
+        assert accepted == expected_accepted
+        assert accepted.count(False) == 5
+
+        assert hashes == expected_hashes
+        assert len(hashes) == 3
+
+        balances, transfers = contents(overlay)
+        assert (balances, transfers) == contents(rows)
+
+        # the zero balances are kept as rows
+        assert (4, 'bob', 'bob', 2, 0, 0) in balances
+        assert len(transfers) == len([ op for block, op, args in STREAM if op == 'transfer' ]) - 4
+
+    finally:
+        overlay.close()
+        rows.close()
+
+def test_journal_order(node_dir):
+    # balances updated in a block are journaled in the order they first changed, whatever the hash seed
+    tokens = TokenDB(auto_commit=False)
+
+    try:
+        replay(tokens)
+
+        updates = tokens.conn.execute('''SELECT j.block, t.address, a.address FROM journal j
+                                         LEFT JOIN balance b ON b.rowid = j.row
+                                         LEFT JOIN token t ON t.rowid = b.token
+                                         LEFT JOIN address a ON a.rowid = b.address
+                                         WHERE j.tbl = 'balance' AND j.change = 'update'
+                                         ORDER BY j.seq''').fetchall()
+
+    finally:
+        tokens.close()
+
+    assert updates == [
+        (2, 'alice', 'alice'), (2, 'bob', 'bob'), (2, 'bob', 'alice'),
+        (3, 'bob', 'alice'), (3, 'alice', 'dave'), (3, 'alice', 'bob') ]
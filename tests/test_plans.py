@@ -0,0 +1,204 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.node import TokenError
+from ag.orbit.node.db import TokenDB
+from ag.orbit.node.sync import plans
+from ag.orbit.node.sync.plans import HOT, LITERALS, FULL_SCAN, explain
+
+from random import Random
+from hashlib import sha256
+import re
+
+
+LAUNCH = 100
+BLOCKS = 60
+TXS = 20            # per block, each with an input and two outputs
+TOKENS = 5
+USERS = 200
+ADVERTISEMENTS = 4  # per token, each with a registration from every tenth user
+
+# tables that stay a handful of rows however long the chain gets, so reading all of them is as cheap as a search
+SMALL = { 'status', 'sqlite_master' }
+
+
+def populate(tokens, rnd):
+    # a sync of a chain with tokens, transfers and advertisements, then the web API reading it back
+    owners = [ 'token{}'.format(i) for i in range(TOKENS) ]
+    users = [ 'user{}'.format(i) for i in range(USERS) ]
+    registrations = []
+
+    for n in range(BLOCKS):
+        height = LAUNCH + n
+        blockrow = tokens.save_block(rnd.getrandbits(256).to_bytes(32, 'big').hex(), height)
+
+        tokens.get_active_registrations_map(blockrow)
+
+        for i in range(TXS):
+            txrow = tokens.save_tx(rnd.getrandbits(256).to_bytes(32, 'big').hex(), blockrow, 1)
+            tokens.save_txin(rnd.getrandbits(256).to_bytes(32, 'big').hex(), txrow, rnd.randbytes(107).hex())
+            tokens.save_txout(txrow, 546, 'pubkeyhash', rnd.choice(users), '76a914' + rnd.randbytes(20).hex() + '88ac')
+            tokens.save_txout(txrow, 0, 'nulldata', None, '6a' + rnd.randbytes(40).hex())
+
+            try:
+                if n == 0 and i < TOKENS:
+                    tokens.token_create(owners[i], txrow, blockrow, 10 ** 12, 0, 'T{}'.format(i))
+
+                elif registrations and i % 5 == 0:
+                    tokens.registration_payment(txrow, blockrow, registrations.pop(), 1000)
+
+                else:
+                    token = rnd.choice(owners)
+                    source = token if i % 2 else rnd.choice(users)
+                    tokens.token_transfer(token, txrow, blockrow, source, rnd.choice(users), rnd.randint(1, 1000))
+
+            except TokenError:
+                pass
+
+        if n == 0:
+            registrations = advertise(tokens, blockrow, height, users)
+
+        tokens.process_advertisements(blockrow)
+        tokens.hash(blockrow)
+        tokens.set_last_block(height)
+        tokens.commit()
+
+    for user in users[::10]:
+        tokens.get_user_tokens(user)
+        tokens.get_user_proofs(user)
+
+    last = LAUNCH + BLOCKS - 1
+
+    for height in range(last - 9, last + 1):
+        tokens.get_orbit_hashes([ LAUNCH, height, last ])
+
+    changes = tokens.get_changes(0, 100)
+    tokens.get_changes(changes[-1]['seq'], 100)
+
+    tokens.audit_blocks(last - 9, last)
+
+def advertise(tokens, blockrow, height, users):
+    # advertisements delivering and ending over the rest of the chain, with registrations to be paid for;
+    #   returns the registration rowids
+    conn = tokens.conn
+    tokens.flush()
+
+    registrations = []
+
+    for tokenrow in range(1, TOKENS + 1):
+        for i in range(ADVERTISEMENTS):
+            begins = height + 1 + 10 * i
+            txrow = conn.execute('''SELECT MAX(rowid) + 1 FROM tx''').fetchone()[0]
+            conn.execute('''INSERT INTO tx (hash, block, confirmations) VALUES (?, ?, 1)''',
+                         (sha256(bytes((txrow % 256, txrow // 256))).digest(), blockrow))
+
+            advertisement = conn.execute('''INSERT INTO advertisement
+                                            (tx, token, created, updated, begins, ends, delivers, available, claimed,
+                                                rate, minimum, maximum)
+                                            VALUES (?, ?, ?, ?, ?, ?, ?, 100000, 0, 1, 1, 10000)''',
+                                            (txrow, tokenrow, blockrow, blockrow, begins, begins + 8, begins + 4)).lastrowid
+
+            conn.executemany('''INSERT INTO schedule (height, advertisement, event) VALUES (?, ?, ?)''',
+                             [ (begins + 4, advertisement, TokenDB.DELIVER), (begins + 8, advertisement, TokenDB.END) ])
+
+            conn.executemany('''INSERT OR IGNORE INTO address (address) VALUES (?)''', [ (user,) for user in users ])
+
+            # each user registered once before and unregistered, then registered again
+            for user in users[i::10]:
+                for finished in (blockrow, None):
+                    txrow = conn.execute('''SELECT MAX(rowid) + 1 FROM tx''').fetchone()[0]
+                    conn.execute('''INSERT INTO tx (hash, block, confirmations) VALUES (?, ?, 1)''',
+                                 (sha256(bytes((txrow % 256, txrow // 256))).digest(), blockrow))
+
+                    rowid = conn.execute('''INSERT INTO registration
+                                              (tx, address, advertisement, created, updated, finished, maximum, payments, claimed)
+                                              VALUES (?, (SELECT rowid FROM address WHERE address = ?), ?, ?, ?, ?, 10000, 0, 0)''',
+                                              (txrow, user, advertisement, blockrow, blockrow, finished)).lastrowid
+
+                registrations.append(rowid)
+
+    return registrations
+
+def trace(tokens):
+    # { normalized statement: [ executions, one execution as it ran ] }, as `orbit-node sync plans` collects them
+    statements = {}
+
+    def traced(sql):
+        if sql.startswith('--'):
+            return
+
+        key = ' '.join(LITERALS.sub('?', sql).split())
+
+        try:
+            statements[key][0] += 1
+        except KeyError:
+            statements[key] = [ 1, sql ]
+
+    tokens.conn.set_trace_callback(traced)
+
+    try:
+        populate(tokens, Random(1))
+
+    finally:
+        tokens.conn.set_trace_callback(None)
+
+    return statements
+
+
+def scanned_table(sql, detail):
+    # plans name a table by its alias when it has one
+    name = FULL_SCAN.match(detail).group(1)
+    table = re.search(r'\b(?:FROM|JOIN|UPDATE)\s+(\w+)\s+(?:AS\s+)?{}\b'.format(re.escape(name)), sql, re.IGNORECASE)
+
+    return table.group(1) if table else name
+
+
+def test_no_hot_full_scans(node_dir):
+    tokens = TokenDB(auto_commit=False)
+
+    try:
+        plans = explain(tokens.conn, trace(tokens))
+
+    finally:
+        tokens.close()
+
+    hot = [ plan for plan in plans if plan[0] >= HOT ]
+
+    # the workload has to reach the statements worth checking
+    for table in ('balance', 'transfer', 'advertisement', 'registration', 'journal', 'address', 'state_node'):
+        assert any(table in sql for count, sql, details, scanned in hot), table
+
+    scans = [ (sql, detail) for count, sql, details, scanned in hot
+              for detail in scanned if scanned_table(sql, detail) not in SMALL ]
+
+    assert scans == []
+
+def test_traced_addresses(node_dir):
+    # the web API is traced for addresses holding balances, as a user would ask for them
+    tokens = TokenDB(auto_commit=False)
+
+    class Sync():
+        def reindex(self):
+            return 1, 1
+
+    sync = Sync()
+    sync.tokens = tokens
+
+    try:
+        blockrow = tokens.save_block('00' * 32, LAUNCH)
+        tokens.token_create('token0', tokens.save_tx('01' * 32, blockrow, 1), blockrow, 1000, 0, 'T0')
+        tokens.token_transfer('token0', tokens.save_tx('02' * 32, blockrow, 1), blockrow, 'token0', 'user0', 10)
+        tokens.hash(blockrow)
+        tokens.set_last_block(LAUNCH)
+        tokens.commit()
+
+        asked = []
+        get_user_tokens = tokens.get_user_tokens
+        tokens.get_user_tokens = lambda address: asked.append(address) or get_user_tokens(address)
+
+        plans.trace(sync)
+
+    finally:
+        tokens.close()
+
+    assert set(asked) == { 'token0', 'user0' }
@@ -0,0 +1,181 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.node.sync import Process
+from ag.orbit.node.sync.raw import (RawBlock, address_script, orbit_candidate, ORBIT_PREFIX, OP_RETURN, OP_PUSHDATA1,
+        OP_PUSHDATA2, OP_PUSHDATA4)
+
+from collections import Counter
+from decimal import Decimal
+import pytest
+
+
+def push(data):
+    # the shortest push of the data, as wallets make ORBIT outputs
+    return bytes((len(data),)) + data
+
+# OP_RETURN scripts: (script, whether the parser sees it)
+SCRIPTS = [
+    # ORBIT data as it's actually made, which the parser always got
+    (bytes((OP_RETURN,)) + push(ORBIT_PREFIX + b'\x00\x01'), True),
+    (bytes((OP_RETURN,)) + push(ORBIT_PREFIX + bytes(range(73))), True),
+    (bytes((OP_RETURN,)) + push(ORBIT_PREFIX), True),
+
+    # pushes too long for a single byte: the parser is handed the length along with the data, just as before,
+    #   so it only sees the ones whose length happens to read as the prefix
+    (bytes((OP_RETURN, OP_PUSHDATA1, 80)) + ORBIT_PREFIX + bytes(78), False),
+    (bytes((OP_RETURN, OP_PUSHDATA1)) + ORBIT_PREFIX + bytes(0x42 - 1), True),
+    (bytes((OP_RETURN, OP_PUSHDATA2)) + (300).to_bytes(2, 'little') + ORBIT_PREFIX + bytes(298), False),
+    (bytes((OP_RETURN, OP_PUSHDATA2)) + ORBIT_PREFIX + bytes(0x8142), True),
+    (bytes((OP_RETURN, OP_PUSHDATA4)) + (300).to_bytes(4, 'little') + ORBIT_PREFIX + bytes(298), False),
+    (bytes((OP_RETURN, OP_PUSHDATA4)) + ORBIT_PREFIX + bytes(2) + bytes(0x8142), True),
+
+    # other data, or none
+    (bytes((OP_RETURN,)) + push(b'\xde\xad\xbe\xef'), False),
+    (bytes((OP_RETURN,)) + push(ORBIT_PREFIX[:1]), False),
+    (bytes((OP_RETURN,)), False),
+    (bytes((OP_RETURN, 0)), False),
+
+    # not a push at all (never standard), even if the prefix follows
+    (bytes((OP_RETURN, 0x51)) + ORBIT_PREFIX, False),
+    (bytes((OP_RETURN, 0x4f)) + ORBIT_PREFIX, False),
+]
+
+
+class Recorder():
+
+    # stands in for the ORBIT API, noting what it is asked to parse
+
+    def __init__(self):
+        self.parsed = []
+
+    def parse(self, data):
+        self.parsed.append(bytes(data))
+        return None
+
+
+@pytest.mark.parametrize('script, parsed', SCRIPTS)
+def test_candidate(script, parsed):
+    # the raw block filter and the verbose filter agree
+    sync = Process.__new__(Process)
+    sync.filtered = Counter()
+
+    assert orbit_candidate(script) == sync._candidate(script.hex()) == parsed
+
+def test_parsed_as_before(node_dir):
+    # the parser gets exactly what it always got for an OP_RETURN (everything after the push opcode), for those
+    #   that can be ORBIT data
+    sync = Process(None)
+
+    try:
+        sync.api = Recorder()
+
+        blockrow = sync.tokens.save_block('00' * 32, 100)
+        sync.validate(blockrow, [{
+            'txid': '{:064x}'.format(i),
+            'vout': [ { 'value': 0, 'scriptPubKey': { 'hex': script.hex() } } ]
+            } for i, (script, parsed) in enumerate(SCRIPTS) ])
+
+    finally:
+        sync.close()
+
+    assert sync.api.parsed == [ script[2:] for script, parsed in SCRIPTS if parsed ]
+    assert all(data.startswith(ORBIT_PREFIX) for data in sync.api.parsed)
+
+    assert sync.filtered['pushdata'] == 4
+    assert sync.filtered['prefix'] == sum(1 for script, parsed in SCRIPTS if not parsed) - 4
+
+
+# block 99993, as returned by `getblock <hash> 0`
+BLOCK_HASH = '00000000000306f827d8cc344b91a2a74074e3e1800e523ead74a20a915db27c'
+BLOCK = bytes.fromhex(
+    '01000000acda3db591d5c2c63e8c09e7523a5b0581707ef3e3520d6ca180000000000000701179cb9a9e0fe709cc96261b6b943b31362b61'
+    'dacba94b03f9b71a06cc2eff7d1c1b4d4c86041b75962f880401000000010000000000000000000000000000000000000000000000000000'
+    '000000000000ffffffff07044c86041b0152ffffffff014034152a01000000434104216220ab283b5e2871c332de670d163fb1b7e509fd67'
+    'db77997c5568e7c25afd988f19cd5cc5aec6430866ec64b5214826b28e0f7a86458073ff933994b47a5cac0000000001000000042a40ae58'
+    'b06c3a61ae55dbee05cab546e80c508f71f24ef0cdc9749dac91ea5f000000004a49304602210089c685b37903c4aa62d984929afeaca554'
+    'd1641f9a668398cd228fb54588f06b0221008a5cfbc5b0a38ba78c4f4341e53272b9cd0e377b2fb740106009b8d7fa693f0b01ffffffff7b'
+    '999491e30af112b11105cb053bc3633a8a87f44740eb158849a76891ff228b00000000494830450221009a4aa8663ff4017063d2020519f2'
+    'eade5b4e3e30be69bf9a62b4e6472d1747b2022021ee3b3090b8ce439dbf08a5df31e2dc23d68073ebda45dc573e8a4f74f5cdfc01ffffff'
+    'ffdea82ec2f9e88e0241faa676c13d093030b17c479770c6cc83239436a4327d49000000004a493046022100c29d9de71a34707c52578e35'
+    '5fa0fdc2bb69ce0a957e6b591658a02b1e039d69022100f82c8af79c166a822d305f0832fb800786d831aea419069b3aed97a6edf8f02101'
+    'fffffffff3e7987da9981c2ae099f97a551783e1b21669ba0bf3aca8fe12896add91a11a0000000049483045022100e332c81781b281a3b3'
+    '5cf75a5a204a2be451746dad8147831255291ebac2604d02205f889a2935270d1bf1ef47db773d68c4d5c6a51bb51f082d3e1c491de63c34'
+    '5601ffffffff0100c817a8040000001976a91420420e56079150b50fb0617dce4c374bd61eccea88ac00000000010000000265a7293b2d69'
+    'ba51d554cd32ac7586f7fbeaeea06835f26e03a2feab6aec375f000000004a493046022100922361eaafe316003087d355dd3c0ef3d9f44e'
+    'dae661c212a28a91e020408008022100c9b9c84d53d82c0ba9208f695c79eb42a453faea4d19706a8440e1d05e6cff7501fffffffff6971f'
+    '00725d17c1c531088144b45ed795a307a22d51ca377c6f7f93675bb03a000000008b483045022100d060f2b2f4122edac61a25ea06396fe9'
+    '135affdabc66d350b5ae1813bc6bf3f302205d8363deef2101fc9f3d528a8b3907e9d29c40772e587dcea12838c574cb80f801410449fce4'
+    'a25c972a43a6bc67456407a0d4ced782d4cf8c0a35a130d5f65f0561e9f35198349a7c0b4ec79a15fead66bd7642f17cc8c40c5df95f15ac'
+    '7190c76442ffffffff0200f2052a010000001976a914c3f537bc307c7eda43d86b55695e46047b770ea388ac00cf7b05000000001976a914'
+    '07bef290008c089a60321b21b1df2d7f2202f40388ac0000000001000000014ab7418ecda2b2531eef0145d4644a4c82a7da1edd285d1aab'
+    '1ec0595ac06b69000000008c493046022100a796490f89e0ef0326e8460edebff9161da19c36e00c7408608135f72ef0e03e0221009e01ef'
+    '7bc17cddce8dfda1f1a6d3805c51f9ab2f8f2145793d8e85e0dd6e55300141043e6d26812f24a5a9485c9d40b8712215f0c3a37b0334d76b'
+    '2c24fcafa587ae5258853b6f49ceeb29cd13ebb76aa79099fad84f516bbba47bd170576b121052f1ffffffff0200a24a04000000001976a9'
+    '143542e17b6229a25d5b76909f9d28dd6ed9295b2088ac003fab01000000001976a9149cea2b6e3e64ad982c99ebba56a882b9e8a816fe88'
+    'ac00000000'
+    )
+
+# what `getblock <hash> 2` gives for it: txid, [ (input txid or None for the coinbase, script size) ],
+#   [ (value, type, address, script) ]
+VERBOSE = [
+    ('bd0ba1c99c72cac99d690f9a8f23cbe641b187e8e70963db386b27dae8082450', [ (None, 7) ], [
+        ('50.01', 'pubkey', 'bitcoincash:qr048nluen0rzu5us4e4ueaxd7hg9hk9syyxqvgedl',
+            '4104216220ab283b5e2871c332de670d163fb1b7e509fd67db77997c5568e7c25afd988f19cd5cc5aec6430866ec64b5214826b'
+            '28e0f7a86458073ff933994b47a5cac') ]),
+    ('1253a31351799dd100c7697daef9ef3799d355fffd2e5e7abf88fd22a791908a', [
+        ('5fea91ac9d74c9cdf04ef2718f500ce846b5ca05eedb55ae613a6cb058ae402a', 74),
+        ('8b22ff9168a7498815eb4047f4878a3a63c33b05cb0511b112f10ae39194997b', 73),
+        ('497d32a436942383ccc67097477cb13030093dc176a6fa41028ee8f9c22ea8de', 74),
+        ('1aa191dd6a8912fea8acf30bba6916b2e18317557af999e02a1c98a97d98e7f3', 73) ], [
+        ('200', 'pubkeyhash', 'bitcoincash:qqsyyrjkq7g4pdg0kpshmnjvxa9av8kvagcmj69m80',
+            '76a91420420e56079150b50fb0617dce4c374bd61eccea88ac') ]),
+    ('51730153a8c4fc4d0b34200a51465349e70230ae332fb25a54e07dff18b62c7f', [
+        ('5f37ec6aabfea2036ef23568a0eeeafbf78675ac32cd54d551ba692d3b29a765', 74),
+        ('3ab05b67937f6f7c37ca512da207a395d75eb444810831c5c1175d72001f97f6', 139) ], [
+        ('50', 'pubkeyhash', 'bitcoincash:qrpl2dauxp78akjrmp442627gcz8kacw5vqtjm23f2',
+            '76a914c3f537bc307c7eda43d86b55695e46047b770ea388ac'),
+        ('0.92', 'pubkeyhash', 'bitcoincash:qqrmau5sqzxq3xnqxgdjrvwl94ljyqh5qvpg87u2qw',
+            '76a91407bef290008c089a60321b21b1df2d7f2202f40388ac') ]),
+    ('e3aa9040ac22445f6f250fb5319734a74a3eea122d983b83187a05aa52060a68', [
+        ('696bc05a59c01eab1a5d28dd1edaa7824c4a64d44501ef1e53b2a2cd8e41b74a', 140) ], [
+        ('0.72', 'pubkeyhash', 'bitcoincash:qq659ctmvg56yh2mw6gfl8fgm4hdj22myqhq4qdcqh',
+            '76a9143542e17b6229a25d5b76909f9d28dd6ed9295b2088ac'),
+        ('0.28', 'pubkeyhash', 'bitcoincash:qzww52mw8ej2mxpvn84m544gs2u732qklc7dxmhc24',
+            '76a9149cea2b6e3e64ad982c99ebba56a882b9e8a816fe88ac') ]),
+]
+
+def test_raw_block():
+    block = RawBlock(BLOCK, BLOCK_HASH, 3)
+    assert len(block) == len(VERBOSE)
+
+    txs = list(block.transactions(lambda value, script: True))
+    assert block.skipped == 0
+    assert [ tx['txid'] for tx in txs ] == [ txid for txid, vin, vout in VERBOSE ]
+
+    for tx, (txid, vin, vout) in zip(txs, VERBOSE):
+        assert tx['confirmations'] == 3
+
+        assert [ (txin.get('txid'), len(bytes.fromhex(txin['coinbase'] if txid is None else txin['scriptSig']['hex'])))
+                 for txin, (txid, size) in zip(tx['vin'], vin) ] == vin
+
+        assert tx['vout'] == [ { 'value': Decimal(value), 'scriptPubKey': {
+                                    'hex': script, 'type': stype, 'addresses': [ address ] } }
+                               for value, stype, address, script in vout ]
+
+        for value, stype, address, script in vout:
+            if stype == 'pubkeyhash':
+                assert address_script(address).hex() == script
+
+    assert txs[0]['vin'][0]['coinbase'] == '044c86041b0152'
+
+def test_raw_block_relevant():
+    # only the transactions paying the watched address are decoded
+    block = RawBlock(BLOCK, BLOCK_HASH, 1)
+    watched = address_script('bitcoincash:qqrmau5sqzxq3xnqxgdjrvwl94ljyqh5qvpg87u2qw')
+
+    assert [ tx['txid'] for tx in block.transactions(lambda value, script: script == watched) ] == [ VERBOSE[2][0] ]
+    assert block.skipped == 1 + 1 + 2
+
+    with pytest.raises(ValueError, match='does not match block hash'):
+        RawBlock(BLOCK, '00' * 32, 1)
@@ -0,0 +1,66 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.node.db import TokenDB
+
+from hashlib import sha256
+
+
+TOKEN = 'bitcoincash:qpm2qsznhks23z7629mms6s4cwef74vcwvy22gdx6a'
+USER = 'bitcoincash:qr95sy3j9xwd2ap32xkykttr4cvcu7as4y0qverfuy'
+
+
+def block(tokens, height):
+    return tokens.save_block(sha256(height.to_bytes(4, 'big')).hexdigest(), height)
+
+def tx(tokens, blockrow, n):
+    return tokens.save_tx(sha256(bytes((blockrow, n))).hexdigest(), blockrow, 1)
+
+def register(tokens, blockrow, n):
+    # as the sync does: the registration goes into the map it got for the block
+    registrations = tokens.get_active_registrations_map(blockrow)
+
+    rowid = tokens.token_register(TOKEN, tx(tokens, blockrow, n), blockrow, USER, 10)
+
+    token_regs = registrations.setdefault(TOKEN, {})
+    assert USER not in token_regs
+    token_regs[USER] = rowid
+
+    return rowid
+
+def test_register_twice(node_dir):
+    # a paid advertisement, whose registrations are finished as soon as they're made
+    tokens = TokenDB(auto_commit=False)
+
+    try:
+        first = block(tokens, 100)
+        tokens.token_create(TOKEN, tx(tokens, first, 0), first, 1000, 0, 'T')
+        tokens.flush()
+
+        conn = tokens.conn
+        advertisement = conn.execute('''INSERT INTO advertisement
+                                        (tx, token, created, updated, begins, ends, delivers, available, claimed,
+                                            rate, minimum, maximum)
+                                        VALUES (?, 1, ?, ?, 100, 110, 105, 100, 0, 2, 1, 100)''',
+                                        (tx(tokens, first, 1), first, first)).lastrowid
+
+        # an earlier registration by the user, long since finished
+        conn.execute('''INSERT INTO address (address) VALUES (?)''', (USER,))
+        conn.execute('''INSERT INTO registration
+                        (tx, address, advertisement, created, updated, finished, maximum, payments, claimed)
+                        VALUES (?, (SELECT rowid FROM address WHERE address = ?), ?, ?, ?, ?, 0, 0, 0)''',
+                        (tx(tokens, first, 2), USER, advertisement, first, first, first))
+
+        register(tokens, first, 3)
+        tokens.commit()
+
+        second = block(tokens, 101)
+        assert tokens.get_active_registrations_map(second) == {}
+
+        register(tokens, second, 0)
+        tokens.commit()
+
+        assert conn.execute('''SELECT COUNT(*) FROM registration WHERE finished IS NOT NULL''').fetchone()[0] == 3
+
+    finally:
+        tokens.close()
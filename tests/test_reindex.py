@@ -0,0 +1,116 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.node.db import signer_address
+from ag.orbit.node.sync import Process
+from ag.orbit.node.sync.raw import ORBIT_PREFIX, OP_RETURN
+
+from test_hash import CHAIN, ORBITS
+
+from decimal import Decimal
+from hashlib import sha256
+import pytest
+
+
+# every transaction is signed with the same key
+PUBKEY = bytes.fromhex('0279be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798')
+SCRIPTSIG = bytes((71,)) + bytes(71) + bytes((len(PUBKEY),)) + PUBKEY
+
+CHANGE = ('76a91420420e56079150b50fb0617dce4c374bd61eccea88ac',
+          'bitcoincash:qqsyyrjkq7g4pdg0kpshmnjvxa9av8kvagcmj69m80')
+
+
+def transactions(txs):
+    # CHAIN's transactions as bitcoind would give them: the ORBIT data names the recorded operation, and is
+    #   followed by a change output; each spends its own made-up output
+    for txhash, op, args in txs:
+        data = ORBIT_PREFIX + bytes.fromhex(txhash)
+
+        yield {
+            'txid': txhash,
+            'confirmations': 1,
+            'vin': [ { 'txid': sha256(bytes.fromhex(txhash)).hexdigest(), 'scriptSig': { 'hex': SCRIPTSIG.hex() } } ],
+            'vout': [
+                { 'value': Decimal(0), 'scriptPubKey': {
+                    'hex': (bytes((OP_RETURN, len(data))) + data).hex(), 'type': 'nulldata' } },
+                { 'value': Decimal('0.00012345'), 'scriptPubKey': {
+                    'hex': CHANGE[0], 'type': 'pubkeyhash', 'addresses': [ CHANGE[1] ] } }
+            ]
+        }
+
+
+class Recorded():
+
+    # stands in for the ORBIT API: the data is the hash of a CHAIN transaction, parsed into its operation
+
+    def __init__(self):
+        self.ops = { bytes.fromhex(txhash): (args[0], (op, args)) for height, blockhash, txs in CHAIN
+                     for txhash, op, args in txs }
+
+    def parse(self, data):
+        data = bytes(data)
+        assert data.startswith(ORBIT_PREFIX)
+
+        return self.ops[data[len(ORBIT_PREFIX):]]
+
+def apply(self, address, op, txrow, blockrow, registrations, signer):
+    # Process.op() for the recorded operations, applied as test_hash.replay() does
+    assert signer == signer_address([ SCRIPTSIG ])
+
+    op, args = op
+
+    if op == 'create':
+        address, supply, decimals, symbol, name, main_uri, image_uri = args
+        self.tokens.token_create(address, txrow, blockrow, supply, decimals, symbol, name, main_uri, image_uri)
+    else:
+        self.tokens.token_transfer(args[0], txrow, blockrow, *args[1:])
+
+@pytest.fixture
+def sync(node_dir, monkeypatch):
+    monkeypatch.setattr(Process, 'op', apply)
+
+    sync = Process(None, out=None)
+    sync.api = Recorded()
+
+    yield sync
+
+    sync.close()
+
+def orbits(tokens):
+    return [ bytes(orbit).hex() for height, orbit in sorted(tokens.get_orbits().items()) ]
+
+def test_reindex(sync):
+    # synced as from a node...
+    for height, blockhash, txs in CHAIN:
+        blockrow = sync.tokens.save_block(blockhash, height)
+        sync.validate(blockrow, list(transactions(txs)))
+        sync.tokens.hash(blockrow)
+        sync.tokens.set_last_block(height)
+        sync.tokens.commit()
+
+    assert orbits(sync.tokens) == ORBITS
+
+    # ...the transactions stored are those that came in
+    for (blockrow, height), (height, blockhash, txs) in zip(sync.tokens.get_blocks(), CHAIN):
+        stored = sync.stored_txs(blockrow)
+
+        assert [ { key: value for key, value in tx.items() if key != 'rowid' } for tx in stored ] == list(
+                transactions(txs))
+
+    # ...and replaying them offline gives the same state and orbit hashes
+    assert sync.reindex() == (len(CHAIN), [])
+    assert orbits(sync.tokens) == ORBITS
+
+def test_reindex_changed(sync):
+    for height, blockhash, txs in CHAIN:
+        blockrow = sync.tokens.save_block(blockhash, height)
+        sync.validate(blockrow, list(transactions(txs)))
+        sync.tokens.hash(blockrow)
+        sync.tokens.commit()
+
+    # an orbit hash that no longer matches what the transactions give is reported, and put right
+    sync.tokens.conn.execute('''UPDATE block SET orbit = ? WHERE height = ?''', (bytes(32), CHAIN[1][0]))
+    sync.tokens.commit()
+
+    assert sync.reindex() == (len(CHAIN), [ CHAIN[1][0] ])
+    assert orbits(sync.tokens) == ORBITS
@@ -0,0 +1,102 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.node.rpc import Backends, RPC_IN_WARMUP, RPC_INVALID_PARAMETER, RPC_INVALID_ADDRESS_OR_KEY
+
+from bitcoinrpc.authproxy import JSONRPCException
+
+from threading import Lock
+import pytest
+
+
+class Node():
+
+    # answers like a Client, or raises the given error
+
+    def __init__(self, url, error=None):
+        self.url = url
+        self.error = error
+        self.calls = 0
+
+        self.lock = Lock()
+        self.latency = {}
+
+    def call(self, method, *params):
+        self.calls += 1
+
+        if self.error:
+            raise self.error
+
+        return self.url
+
+
+def test_failover_on_transport_error():
+    nodes = [ Node('http://a:1', ConnectionRefusedError()), Node('http://b:1') ]
+    backends = Backends(nodes)
+
+    assert backends.call('getblockcount') == 'http://b:1'
+    assert backends.failed == [1, 0]
+    assert backends.down[0] > 0
+
+def test_failover_on_warmup():
+    nodes = [ Node('http://a:1', JSONRPCException({ 'code': RPC_IN_WARMUP, 'message': 'Loading' })), Node('http://b:1') ]
+    backends = Backends(nodes)
+
+    assert backends.call('getblockcount') == 'http://b:1'
+    assert backends.failed == [1, 0]
+
+def test_application_error_is_not_a_failure():
+    # e.g. a verbosity the node doesn't support: every backend would refuse it, so none of them is marked down
+    error = JSONRPCException({ 'code': -1, 'message': 'JSON value is not a boolean as expected' })
+    nodes = [ Node('http://a:1', error), Node('http://b:1', error) ]
+    backends = Backends(nodes)
+
+    with pytest.raises(JSONRPCException):
+        backends.call('getblock', '00' * 32, 3)
+
+    assert sum(node.calls for node in nodes) == 1
+    assert backends.failed == [0, 0]
+    assert backends.down == [0.0, 0.0]
+
+class Lagging(Node):
+
+    # a healthy node that hasn't caught up with the tip yet
+
+    def __init__(self, url, tip):
+        super().__init__(url)
+        self.tip = tip
+
+    def call(self, method, *params):
+        self.calls += 1
+
+        if method == 'getblockhash' and params[0] > self.tip:
+            raise JSONRPCException({ 'code': RPC_INVALID_PARAMETER, 'message': 'Block height out of range' })
+
+        if method == 'getblock' and params[0] != self.url:
+            raise JSONRPCException({ 'code': RPC_INVALID_ADDRESS_OR_KEY, 'message': 'Block not found' })
+
+        return self.url
+
+def test_lagging_backend_is_skipped():
+    # the idle backend is picked first, but is behind the tip
+    nodes = [ Lagging('http://a:1', 100), Lagging('http://b:1', 101) ]
+    backends = Backends(nodes)
+
+    assert backends.call('getblockhash', 101) == 'http://b:1'
+    assert backends.call('getblock', 'http://b:1') == 'http://b:1'
+    assert nodes[0].calls == 2
+
+    # skipped, but not avoided for the next request
+    assert backends.failed == [0, 0]
+    assert backends.down == [0.0, 0.0]
+
+def test_lagging_backends_everywhere():
+    nodes = [ Lagging('http://a:1', 100), Lagging('http://b:1', 100) ]
+    backends = Backends(nodes)
+
+    with pytest.raises(JSONRPCException) as e:
+        backends.call('getblockhash', 101)
+
+    assert e.value.error['code'] == RPC_INVALID_PARAMETER
+    assert sum(node.calls for node in nodes) == 2
+    assert backends.failed == [0, 0]
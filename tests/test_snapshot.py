@@ -0,0 +1,233 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.node import config, snapshot
+from ag.orbit.node.db import TokenDB
+from ag.orbit.node.daemon.webapi import Server, ORBITS
+from ag.orbit.node.sync import snapshot as command
+
+from hashlib import sha256
+from urllib.parse import urlencode
+import gzip
+import json
+import pytest
+
+
+LAUNCH = 100
+
+# (from, to, units) for each block after the token is created; a forged chain pays the last one elsewhere
+TRANSFERS = [ ('owner', 'alice', 500), ('alice', 'bob', 200), ('owner', 'carol', 100), ('bob', 'carol', 50) ]
+
+
+def build(path, forged=False, symbol='TEST'):
+    # returns the orbit hash, state root and state digest at the tip
+    path.mkdir()
+    config.dir = str(path)
+
+    tokens = TokenDB(auto_commit=False)
+
+    for i, transfer in enumerate([ None ] + TRANSFERS):
+        height = LAUNCH + i
+        blockrow = tokens.save_block('{:064x}'.format(height), height)
+        txrow = tokens.save_tx('{:064x}'.format(height + 1000), blockrow, 1)
+
+        if transfer is None:
+            tokens.token_create('owner', txrow, blockrow, 1000, 0, symbol)
+        else:
+            if forged and i == len(TRANSFERS):
+                transfer = ('owner', 'mallory', 400)
+
+            tokens.token_transfer('owner', txrow, blockrow, *transfer)
+
+        tokens.hash(blockrow)
+        tokens.set_last_block(height)
+        tokens.commit()
+
+    orbit, root, state = tokens.conn.execute('''SELECT b.orbit, r.root, r.state FROM block b
+                                                LEFT JOIN state_root r ON r.block = b.rowid
+                                                ORDER BY b.height DESC LIMIT 1''').fetchone()
+    tokens.close()
+
+    return orbit.hex(), root.hex(), state.hex()
+
+def export(path, filename, height=None):
+    config.dir = str(path)
+
+    tokens = TokenDB(readonly=True)
+    try:
+        return snapshot.export(tokens, str(filename), height)
+    finally:
+        tokens.close()
+
+def load(path, filename, orbit=None, root=None, state=None):
+    path.mkdir()
+    config.dir = str(path)
+
+    tokens = TokenDB(auto_commit=False)
+    try:
+        return snapshot.load(tokens, str(filename), None, orbit, root, state)
+    finally:
+        tokens.close()
+
+def counterfeit(filename, fake, orbit, claimed, insert=None):
+    # rewrites a snapshot to claim another orbit hash instead of its own, with a digest to match; insert is an
+    #   optional (table, row) to add
+    digest = sha256()
+
+    with gzip.open(str(filename), 'rt', encoding='utf-8') as infile:
+        lines = infile.read().splitlines(True)[:-1]
+
+    with gzip.open(str(fake), 'wt', encoding='utf-8') as out:
+        rows = 0
+
+        for line in lines:
+            line = line.replace(orbit, claimed)
+
+            if insert and line.startswith('{{"table":"{}"'.format(insert[0])):
+                line += json.dumps(insert[1], separators=(',', ':')) + '\n'
+                rows += 1
+
+            digest.update(line.encode('utf-8'))
+            out.write(line)
+
+            if line.startswith('['):
+                rows += 1
+
+        out.write(json.dumps({ "digest": digest.hexdigest(), "rows": rows }, separators=(',', ':')) + '\n')
+
+
+@pytest.fixture
+def honest(node_dir):
+    orbit, root, state = build(node_dir / 'honest')
+    filename = node_dir / 'honest.snapshot'
+    export(node_dir / 'honest', filename)
+
+    return orbit, root, state, filename
+
+
+def test_export_only_at_tip(node_dir, honest):
+    height, orbit, root, state, rows = export(node_dir / 'honest', node_dir / 'tip.snapshot', LAUNCH + len(TRANSFERS))
+    assert height == LAUNCH + len(TRANSFERS)
+
+    with pytest.raises(ValueError, match='last synced block'):
+        export(node_dir / 'honest', node_dir / 'earlier.snapshot', LAUNCH + 1)
+
+def test_import_expected(node_dir, honest):
+    orbit, root, state, filename = honest
+
+    height, loaded_orbit, loaded_root, loaded_state, rows = load(node_dir / 'new', filename, orbit, root, state)
+
+    assert (loaded_orbit.hex(), loaded_root.hex(), loaded_state.hex()) == (orbit, root, state)
+
+    tokens = TokenDB(readonly=True)
+    try:
+        assert tokens.get_orbit_hashes([ height ])['orbits'][str(height)] == orbit
+    finally:
+        tokens.close()
+
+def test_import_unexpected(node_dir, honest):
+    orbit, root, state, filename = honest
+
+    with pytest.raises(ValueError, match='orbit hash'):
+        load(node_dir / 'new', filename, 'ff' * 32)
+
+def test_import_counterfeit(node_dir, honest):
+    orbit, root, state, filename = honest
+
+    forged = build(node_dir / 'forged', True)
+    assert forged[0] != orbit and forged[1] != root
+
+    export(node_dir / 'forged', node_dir / 'forged.snapshot')
+    counterfeit(node_dir / 'forged.snapshot', node_dir / 'fake.snapshot', forged[0], orbit)
+
+    # it holds together and claims the right orbit hash, so only the state root gives it away
+    with pytest.raises(ValueError, match='state root'):
+        load(node_dir / 'rejected', node_dir / 'fake.snapshot', orbit, root)
+
+    height, loaded_orbit, loaded_root, loaded_state, rows = load(node_dir / 'fooled', node_dir / 'fake.snapshot', orbit)
+    assert loaded_root.hex() == forged[1]
+
+def test_import_counterfeit_token(node_dir, honest):
+    orbit, root, state, filename = honest
+
+    # the same balances under another symbol: only the state digest tells them apart
+    forged = build(node_dir / 'forged', symbol='FAKE')
+    assert forged[0] != orbit and forged[1] == root and forged[2] != state
+
+    export(node_dir / 'forged', node_dir / 'forged.snapshot')
+    counterfeit(node_dir / 'forged.snapshot', node_dir / 'fake.snapshot', forged[0], orbit)
+
+    with pytest.raises(ValueError, match='state digest'):
+        load(node_dir / 'rejected', node_dir / 'fake.snapshot', orbit, root, state)
+
+    load(node_dir / 'fooled', node_dir / 'fake.snapshot', orbit, root)
+
+def test_import_tampered(node_dir, honest):
+    orbit, root, state, filename = honest
+
+    # a token row changed without updating the header's state digest
+    counterfeit(filename, node_dir / 'renamed.snapshot', '"TEST"', '"FAKE"')
+
+    with pytest.raises(ValueError, match='state digest'):
+        load(node_dir / 'renamed', node_dir / 'renamed.snapshot')
+
+    # and a scheduled event no advertisement made
+    counterfeit(filename, node_dir / 'scheduled.snapshot', orbit, orbit, ('schedule', [ 1, LAUNCH + 10, 1, 'deliver' ]))
+
+    with pytest.raises(ValueError, match='schedule'):
+        load(node_dir / 'scheduled', node_dir / 'scheduled.snapshot')
+
+def test_import_from_peer(node_dir, honest, monkeypatch):
+    orbit, root, state, filename = honest
+
+    config.dir = str(node_dir / 'honest')
+    server = Server('127.0.0.1', 0)
+    client = server.flask.test_client()
+
+    # its one pooled connection is opened now, while the node directory is the peer's
+    server.pool.release(server.pool.acquire())
+
+    def peer(url, heights):
+        response = client.get('/{}?{}'.format(ORBITS, urlencode({ 'heights': ','.join(str(h) for h in heights) })))
+        return json.loads(response.data.decode('utf-8'))[ORBITS]
+
+    monkeypatch.setattr(command, 'fetch_orbits', peer)
+
+    (node_dir / 'new').mkdir()
+    config.dir = str(node_dir / 'new')
+    command.load(str(filename), 'http://peer')
+
+    tokens = TokenDB(readonly=True)
+    try:
+        assert tokens.get_snapshot_height() == LAUNCH + len(TRANSFERS)
+    finally:
+        tokens.close()
+        server.pool.close()
+
+def test_state_digest_migrated(node_dir):
+    orbit, root, state = build(node_dir / 'node')
+
+    # as a database from before there were state digests would be
+    tokens = TokenDB()
+    tokens.conn.execute('''DROP TABLE state_row''')
+    tokens.conn.execute('''UPDATE state_root SET state = NULL''')
+    tokens.conn.execute('''UPDATE status SET value = ? WHERE key = 'schema' ''', (len(TokenDB.MIGRATIONS) - 1,))
+    tokens.conn.commit()
+    tokens.close()
+
+    # the last block gets its digest back, and the next one carries on from it
+    tokens = TokenDB(auto_commit=False)
+    try:
+        height = LAUNCH + len(TRANSFERS)
+        assert tokens.get_orbit_hashes([ height ])['states'][str(height)] == state
+
+        blockrow = tokens.save_block('{:064x}'.format(height + 1), height + 1)
+        tokens.token_transfer('owner', tokens.save_tx('{:064x}'.format(height + 1001), blockrow, 1), blockrow,
+                'carol', 'alice', 10)
+        tokens.hash(blockrow)
+        tokens.commit()
+
+        assert tokens.get_orbit_hashes([ height + 1 ])['states'][str(height + 1)] == tokens.build_state_digest().hex()
+
+    finally:
+        tokens.close()
@@ -0,0 +1,103 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.node.db import TokenDB
+from ag.orbit.node.state import StateTree, BITS, EMPTY, leaf_key, leaf_hash, node_hash, verify
+
+from test_hash import CHAIN, replay
+
+from random import Random
+import sqlite3
+
+
+TOKENS = [ 'token{}'.format(i) for i in range(3) ]
+USERS = [ 'user{}'.format(i) for i in range(40) ]
+
+
+def scratch_root(balances):
+    # the root straight from the definition, over every balance at once
+    leaves = sorted((int.from_bytes(leaf_key(token, address), 'big'), leaf_hash(leaf_key(token, address), units, available))
+                    for (token, address), (units, available) in balances.items())
+
+    def subtree(depth, leaves):
+        if len(leaves) < 2:
+            return leaves[0][1] if leaves else EMPTY
+
+        bit = 1 << (BITS - depth - 1)
+
+        return node_hash(subtree(depth + 1, [ leaf for leaf in leaves if not leaf[0] & bit ]),
+                         subtree(depth + 1, [ leaf for leaf in leaves if leaf[0] & bit ]))
+
+    return subtree(0, leaves)
+
+def blocks(rnd, count):
+    # the balances changed in each block, some of them changed again later
+    for n in range(count):
+        yield { (rnd.choice(TOKENS), rnd.choice(USERS)): (rnd.randint(0, 10 ** 6), rnd.randint(0, 10 ** 6))
+                for i in range(rnd.randint(1, 12)) }
+
+def tree():
+    return StateTree(sqlite3.connect(':memory:'))
+
+def test_incremental_root():
+    state = tree()
+    balances = {}
+
+    assert state.root() == EMPTY
+
+    for changed in blocks(Random(1), 20):
+        balances.update(changed)
+
+        root = state.update((token, address, units, available) for (token, address), (units, available) in changed.items())
+
+        assert root == state.root() == scratch_root(balances)
+
+        # and the same as a tree built in one go
+        assert tree().update((token, address, units, available)
+                             for (token, address), (units, available) in balances.items()) == root
+
+def test_proofs():
+    state = tree()
+    balances = {}
+
+    for changed in blocks(Random(2), 10):
+        balances.update(changed)
+        state.update((token, address, units, available) for (token, address), (units, available) in changed.items())
+
+    root = state.root()
+
+    for (token, address), (units, available) in balances.items():
+        siblings = state.proof(token, address)
+
+        assert verify(token, address, units, available, siblings, root)
+
+        # any other amount, or the amount for someone else, is rejected
+        assert not verify(token, address, units + 1, available, siblings, root)
+        assert not verify(token, address, units, available - 1, siblings, root)
+        assert not verify(token, address + 'x', units, available, siblings, root)
+
+    assert state.proof(TOKENS[0], 'nobody') is None
+
+def test_user_proofs(node_dir):
+    tokens = TokenDB(auto_commit=False)
+    try:
+        replay(tokens)
+        tokens.set_last_block(CHAIN[-1][0])
+        tokens.commit()
+
+        root = tokens.conn.execute('''SELECT root FROM state_root ORDER BY block DESC LIMIT 1''').fetchone()[0].hex()
+
+        # an address with no balances still gets the state they would be proven against
+        assert tokens.get_user_proofs('bitcoincash:qqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqq') == {
+                "height": CHAIN[-1][0], "root": root, "balances": [] }
+
+        proofs = tokens.get_user_proofs('bitcoincash:qzl8jth497mtckku404cadsylwanm3rfxsx0g38nwl')
+        assert proofs['balances']
+
+        for balance in proofs['balances']:
+            assert verify(balance['address'], 'bitcoincash:qzl8jth497mtckku404cadsylwanm3rfxsx0g38nwl',
+                    balance['units'], balance['available'], [ bytes.fromhex(s) for s in balance['siblings'] ],
+                    bytes.fromhex(proofs['root']))
+
+    finally:
+        tokens.close()
@@ -0,0 +1,69 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.node.db import TokenDB
+from ag.orbit.node.sync.verify import audit
+
+from test_hash import CHAIN, replay
+
+import sqlite3
+import pytest
+
+
+FIRST = CHAIN[0][0]
+LAST = CHAIN[-1][0]
+
+
+@pytest.fixture
+def chain(node_dir):
+    tokens = TokenDB(auto_commit=False)
+    try:
+        replay(tokens)
+    finally:
+        tokens.close()
+
+    return node_dir / 'tokens.db'
+
+def audit_blocks(start, end):
+    tokens = TokenDB(readonly=True)
+    try:
+        return tokens.audit_blocks(start, end)
+    finally:
+        tokens.close()
+
+def test_clean_chain(chain):
+    assert [ mismatched for height, content, mismatched in audit_blocks(FIRST, LAST) ] == [ [] ] * len(CHAIN)
+
+    audit()
+    audit(FIRST + 2, LAST)
+
+    # from before the first synced block is from the first
+    audit(0, LAST)
+
+def test_tampered_row(chain):
+    conn = sqlite3.connect(str(chain))
+    balance, block = conn.execute('''SELECT b.rowid, k.height FROM balance b
+                                     LEFT JOIN block k ON k.rowid = b.updated
+                                     ORDER BY b.rowid DESC LIMIT 1''').fetchone()
+    conn.execute('''UPDATE balance SET units = units + 1 WHERE rowid = ?''', (balance,))
+    conn.commit()
+    conn.close()
+
+    assert [ (height, mismatched) for height, content, mismatched in audit_blocks(FIRST, LAST) if mismatched ] == [
+            (block, [ ('balance', balance) ]) ]
+
+    with pytest.raises(ValueError, match='1 row does not match the journal'):
+        audit()
+
+def test_tampered_orbit(chain):
+    conn = sqlite3.connect(str(chain))
+    conn.execute('''UPDATE block SET orbit = ? WHERE height = ?''', (bytes(32), FIRST + 2))
+    conn.commit()
+    conn.close()
+
+    with pytest.raises(ValueError, match='mismatch at block {}'.format(FIRST + 2)):
+        audit(0, LAST)
+
+    # the block after it no longer chains to it either
+    with pytest.raises(ValueError, match='mismatch at block {}'.format(FIRST + 3)):
+        audit(FIRST + 3, LAST)
@@ -0,0 +1,103 @@
+# Copyright (C) 2018 Alpha Griffin
+# @%@~LICENSE~@%@
+
+from ag.orbit.node.db import TokenDB
+from ag.orbit.node.daemon.webapi import Server, ORBITS
+
+import sqlite3
+import json
+import pytest
+
+
+# a database left by a version from before the conversion to the compact schema
+BEFORE_COMPACT = TokenDB.MIGRATIONS[:TokenDB.MIGRATIONS.index('_migrate_compact')]
+
+
+def test_readonly_before_created(node_dir):
+    with pytest.raises(ValueError, match='not been created'):
+        TokenDB(readonly=True)
+
+def test_readonly_before_migrated(node_dir, monkeypatch):
+    # a database left by an older version, before the last migration
+    with monkeypatch.context() as m:
+        m.setattr(TokenDB, 'MIGRATIONS', TokenDB.MIGRATIONS[:-1])
+        TokenDB().close()
+
+    with pytest.raises(ValueError, match='schema version {}'.format(len(TokenDB.MIGRATIONS) - 1)):
+        TokenDB(readonly=True)
+
+    TokenDB(migrate=True).close()
+    TokenDB(readonly=True).close()
+
+def test_conversion_is_explicit(node_dir, monkeypatch):
+    with monkeypatch.context() as m:
+        m.setattr(TokenDB, 'MIGRATIONS', BEFORE_COMPACT)
+        TokenDB().close()
+
+    with pytest.raises(ValueError, match='sync migrate'):
+        TokenDB(auto_commit=False)
+
+    # an in-memory copy converts itself, leaving the database as it was
+    TokenDB(copy=True).close()
+
+    with pytest.raises(ValueError, match='sync migrate'):
+        TokenDB()
+
+def test_server_on_new_node(node_dir):
+    server = Server('127.0.0.1', 0)
+    client = server.flask.test_client()
+
+    try:
+        response = client.get('/{}?heights=100'.format(ORBITS))
+
+        assert response.status_code == 200
+        assert json.loads(response.data.decode('utf-8'))[ORBITS] == { "height": None, "orbits": {}, "roots": {}, "states": {} }
+
+    finally:
+        server.pool.close()
+
+def test_server_waits_for_migration(node_dir, monkeypatch):
+    # started before `sync migrate` has converted the database: it comes up, but refuses requests until then
+    with monkeypatch.context() as m:
+        m.setattr(TokenDB, 'MIGRATIONS', BEFORE_COMPACT)
+        TokenDB().close()
+
+    server = Server('127.0.0.1', 0)
+    client = server.flask.test_client()
+
+    try:
+        assert client.get('/{}?heights=100'.format(ORBITS)).status_code == 503
+
+        TokenDB(migrate=True).close()
+
+        assert client.get('/{}?heights=100'.format(ORBITS)).status_code == 200
+
+    finally:
+        server.pool.close()
+
+def test_server_during_migration(node_dir, monkeypatch):
+    with monkeypatch.context() as m:
+        m.setattr(TokenDB, 'MIGRATIONS', BEFORE_COMPACT)
+        TokenDB().close()
+
+    # `sync migrate` holds the write lock for the whole conversion
+    conn = sqlite3.connect(str(node_dir / 'tokens.db'))
+    conn.execute('''BEGIN IMMEDIATE''')
+
+    try:
+        server = Server('127.0.0.1', 0)
+        client = server.flask.test_client()
+
+        assert client.get('/{}?heights=100'.format(ORBITS)).status_code == 503
+
+    finally:
+        conn.rollback()
+        conn.close()
+
+    TokenDB(migrate=True).close()
+
+    try:
+        assert client.get('/{}?heights=100'.format(ORBITS)).status_code == 200
+
+    finally:
+        server.pool.close()